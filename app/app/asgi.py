@@ -0,0 +1,23 @@
+"""
+ASGI config for app project.
+
+It exposes the ASGI callable as a module-level variable named
+``application``. Requests run through the WSGI application on a bounded
+thread pool, see core.asgi.
+"""
+
+import os
+
+from django.conf import settings
+from django.core.wsgi import get_wsgi_application
+
+from core.asgi import ThreadPoolASGIHandler
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'app.settings')
+
+application = ThreadPoolASGIHandler(
+    get_wsgi_application(),
+    max_workers=settings.ASGI_THREADS,
+    max_body_size=settings.ASGI_MAX_BODY_SIZE,
+    spool_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE,
+)
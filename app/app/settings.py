@@ -45,6 +45,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.profiling.ProfilingMiddleware',
+    'core.timing.ServerTimingMiddleware',
+    'core.metrics.MetricsMiddleware',
+    'core.querycheck.QueryCheckMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -78,13 +82,24 @@ WSGI_APPLICATION = 'app.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/2.1/ref/settings/#databases
 
+# core.db.backends.postgresql adds HEALTH_CHECKS and POOL, see its docstring.
+# Persistent connections are kept for DB_CONN_MAX_AGE seconds; with
+# DB_POOL_SIZE above 0 set DB_CONN_MAX_AGE to 0 so each request returns its
+# connection to the pool.
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql',
+        'ENGINE': 'core.db.backends.postgresql',
         'HOST': os.environ.get('DB_HOST'),
         'NAME': os.environ.get('DB_NAME'),
         'USER': os.environ.get('DB_USER'),
         'PASSWORD': os.environ.get('DB_PASS'),
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 60)),
+        'HEALTH_CHECKS': bool(int(os.environ.get('DB_HEALTH_CHECKS', 1))),
+        'POOL': {
+            'MAX_SIZE': int(os.environ.get('DB_POOL_SIZE', 0)),
+            'IDLE_TIMEOUT': int(os.environ.get('DB_POOL_IDLE_TIMEOUT', 300)),
+            'TIMEOUT': float(os.environ.get('DB_POOL_TIMEOUT', 10)),
+        },
     }
 }
 
@@ -132,3 +147,142 @@ MEDIA_ROOT = 'vol/web/media'
 STATIC_ROOT = 'vol/web/static'
 
 AUTH_USER_MODEL = 'core.User'
+
+# Default page size for list endpoints, and the upper bound on the
+# ?page_size= a client may request
+API_PAGE_SIZE = int(os.environ.get('API_PAGE_SIZE', 50))
+API_MAX_PAGE_SIZE = int(os.environ.get('API_MAX_PAGE_SIZE', 500))
+# Render recipe, tag and ingredient list pages from values() rows instead
+# of serializers, see recipe.lean
+API_LEAN_LISTS = bool(int(os.environ.get('API_LEAN_LISTS', 0)))
+
+# Share of requests measured by core.timing.ServerTimingMiddleware, which
+# reports their query, serializer, render and view time in a
+# Server-Timing header and a core.timing log line; off unless set, e.g.
+# to 0.01 in production
+SERVER_TIMING_SAMPLE_RATE = float(
+    os.environ.get('SERVER_TIMING_SAMPLE_RATE', 0)
+)
+
+# core.querycheck.QueryCheckMiddleware, for development and CI: requests
+# repeating a query shape REPEAT_THRESHOLD times or running a query slower
+# than SLOW_MS milliseconds are appended to REPORT, and fail when RAISE is
+# set. Run the tests with QUERY_CHECK=1 QUERY_CHECK_RAISE=1 to catch N+1s.
+QUERY_CHECK = {
+    'ENABLED': bool(int(os.environ.get('QUERY_CHECK', 0))),
+    'REPEAT_THRESHOLD': int(os.environ.get('QUERY_CHECK_REPEATS', 3)),
+    'SLOW_MS': float(os.environ.get('QUERY_CHECK_SLOW_MS', 100)),
+    'REPORT': os.environ.get('QUERY_CHECK_REPORT',
+                             '/tmp/query-check.jsonl'),
+    'RAISE': bool(int(os.environ.get('QUERY_CHECK_RAISE', 0))),
+}
+
+# Directory where each process keeps its metrics for /metrics to sum, see
+# core.metrics; unset, each process reports only its own
+METRICS_MULTIPROC_DIR = os.environ.get('METRICS_MULTIPROC_DIR') or None
+
+# On-demand request profiles, see core.profiling: requests carrying an
+# X-Profile header from the profile_header command, valid for
+# HEADER_MAX_AGE seconds, or a SAMPLE_RATE share of all requests, are
+# profiled with PROFILER ('cprofile' or 'pyinstrument') into DIR, keeping
+# the newest KEEP files
+PROFILING = {
+    'ENABLED': bool(int(os.environ.get('PROFILING', 0))),
+    'SAMPLE_RATE': float(os.environ.get('PROFILING_SAMPLE_RATE', 0)),
+    'PROFILER': os.environ.get('PROFILING_PROFILER', 'cprofile'),
+    'DIR': os.environ.get('PROFILING_DIR', '/tmp/profiles'),
+    'KEEP': int(os.environ.get('PROFILING_KEEP', 50)),
+    'HEADER_MAX_AGE': int(os.environ.get('PROFILING_HEADER_MAX_AGE', 3600)),
+}
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'core.timing': {
+            'handlers': ['console'],
+            'level': os.environ.get('SERVER_TIMING_LOG_LEVEL', 'INFO'),
+            'propagate': False,
+        },
+    },
+}
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+}
+
+# Token to user lookups cached by core.authentication.CachedTokenAuthentication
+# SHARED_CACHE optionally names an entry in CACHES, such as memcached or
+# redis, to use as a second, shared tier that revocations are checked
+# against; it holds two keys per token, so size its MAX_ENTRIES for that.
+# Without one a revoked token keeps working in other processes until their
+# local copy expires
+TOKEN_AUTH_CACHE = {
+    'MAX_SIZE': int(os.environ.get('TOKEN_CACHE_SIZE', 10000)),
+    'TTL': int(os.environ.get('TOKEN_CACHE_TTL', 60)),
+    'SHARED_CACHE': os.environ.get('TOKEN_CACHE_SHARED') or None,
+}
+
+# Largest batch accepted by POST /api/recipe/recipes/bulk/
+RECIPE_BULK_MAX_ITEMS = int(os.environ.get('RECIPE_BULK_MAX_ITEMS', 1000))
+
+# Recipes read per query by GET /api/recipe/recipes/export/
+RECIPE_EXPORT_CHUNK_SIZE = int(os.environ.get('RECIPE_EXPORT_CHUNK_SIZE',
+                                              1000))
+
+# Text search configuration used for the Postgres recipe search vector
+RECIPE_SEARCH_CONFIG = os.environ.get('RECIPE_SEARCH_CONFIG', 'english')
+
+# Resized copies made of every recipe image: longest edge in pixels per
+# size name, encoded in each of the formats. Renditions are generated on a
+# pool of RECIPE_IMAGE_WORKERS threads, or inline when it is 0.
+RECIPE_IMAGE_RENDITIONS = {
+    'thumb': 160,
+    'small': 480,
+    'large': 1280,
+}
+RECIPE_IMAGE_FORMATS = ('webp', 'jpeg')
+RECIPE_IMAGE_QUALITY = 82
+RECIPE_IMAGE_WORKERS = int(os.environ.get('RECIPE_IMAGE_WORKERS', 2))
+
+# Limits on recipe image uploads: bytes accepted, pixels accepted without
+# decoding, pixels of a format that must be fully decoded to downscale
+# (anything but JPEG), and the longest edge kept before downscaling
+RECIPE_IMAGE_MAX_UPLOAD_SIZE = int(
+    os.environ.get('RECIPE_IMAGE_MAX_UPLOAD_SIZE', 10 * 1024 * 1024)
+)
+RECIPE_IMAGE_MAX_PIXELS = int(
+    os.environ.get('RECIPE_IMAGE_MAX_PIXELS', 40 * 1000 * 1000)
+)
+RECIPE_IMAGE_MAX_DECODE_PIXELS = int(
+    os.environ.get('RECIPE_IMAGE_MAX_DECODE_PIXELS', 12 * 1000 * 1000)
+)
+RECIPE_IMAGE_INGEST_MAX_EDGE = int(
+    os.environ.get('RECIPE_IMAGE_INGEST_MAX_EDGE', 4096)
+)
+
+# app.asgi runs Django on a pool of ASGI_THREADS threads per worker, each
+# holding its own database connection, and refuses request bodies over
+# ASGI_MAX_BODY_SIZE bytes before they reach Django
+ASGI_THREADS = int(os.environ.get('ASGI_THREADS', 8))
+ASGI_MAX_BODY_SIZE = int(os.environ.get(
+    'ASGI_MAX_BODY_SIZE', RECIPE_IMAGE_MAX_UPLOAD_SIZE + 64 * 1024
+))
+
+# How core.views.serve_media sends media files. MEDIA_SENDFILE may be
+# 'x-accel-redirect' (nginx, files under MEDIA_SENDFILE_PREFIX) or
+# 'x-sendfile' (Apache, lighttpd) to have the front proxy copy the bytes;
+# empty streams them from Python. Files under MEDIA_IMMUTABLE_PREFIXES are
+# never rewritten in place and are cached for a year.
+MEDIA_IMMUTABLE_PREFIXES = ('uploads/',)
+MEDIA_CACHE_MAX_AGE = int(os.environ.get('MEDIA_CACHE_MAX_AGE', 86400))
+MEDIA_SENDFILE = os.environ.get('MEDIA_SENDFILE', '')
+MEDIA_SENDFILE_PREFIX = os.environ.get('MEDIA_SENDFILE_PREFIX',
+                                       '/protected-media/')
@@ -0,0 +1,163 @@
+'''ASGI adapter running the Django WSGI handler on a bounded thread pool
+
+Request bodies are read on the event loop, so slow clients and uploads in
+flight hold no thread, and bodies over the size cap are refused there
+without reaching Django. At most max_workers requests run Django at once,
+each on its own thread with its own database connection, and responses
+are sent a chunk at a time as the handler produces them.
+'''
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from tempfile import SpooledTemporaryFile
+
+
+TOO_LARGE = b'Request body too large'
+
+
+class ThreadPoolASGIHandler:
+    '''serve a WSGI application to an ASGI server'''
+
+    def __init__(self, wsgi_application, max_workers, max_body_size=None,
+                 spool_size=64 * 1024):
+        self.wsgi_application = wsgi_application
+        self.executor = ThreadPoolExecutor(max_workers,
+                                           thread_name_prefix='asgi')
+        self.max_body_size = max_body_size
+        self.spool_size = spool_size
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        if scope['type'] != 'http':
+            raise ValueError(f'Unsupported scope type {scope["type"]}')
+
+        with SpooledTemporaryFile(max_size=self.spool_size) as body:
+            received = await self.read_body(scope, receive, body)
+            if received is None:
+                return
+            if self.max_body_size is not None and \
+                    received > self.max_body_size:
+                return await self.send_too_large(send)
+            body.seek(0)
+            loop = asyncio.get_event_loop()
+            await loop.run_in_executor(self.executor, self.run, loop,
+                                       scope, body, send)
+
+    async def read_body(self, scope, receive, body):
+        '''buffer the request body, returning its size
+
+        Returns None if the client disconnects first. Reading stops as
+        soon as the body passes max_body_size.
+        '''
+        received = 0
+        declared = dict(scope.get('headers', ())).get(b'content-length')
+        if self.max_body_size is not None and declared and \
+                declared.isdigit() and int(declared) > self.max_body_size:
+            return int(declared)
+
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return None
+            chunk = message.get('body', b'')
+            received += len(chunk)
+            if self.max_body_size is not None and \
+                    received > self.max_body_size:
+                return received
+            body.write(chunk)
+            if not message.get('more_body'):
+                return received
+
+    async def send_too_large(self, send):
+        await send({
+            'type': 'http.response.start',
+            'status': 413,
+            'headers': [(b'content-type', b'text/plain'),
+                        (b'content-length', str(len(TOO_LARGE)).encode()),
+                        (b'connection', b'close')],
+        })
+        await send({'type': 'http.response.body', 'body': TOO_LARGE})
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await asyncio.get_event_loop().run_in_executor(
+                    None, self.executor.shutdown
+                )
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def run(self, loop, scope, body, send):
+        '''run the WSGI application for one request on a pool thread'''
+        def sync_send(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info and response.get('sent'):
+                raise exc_info[1].with_traceback(exc_info[2])
+            response['start'] = {
+                'type': 'http.response.start',
+                'status': int(status.split(' ', 1)[0]),
+                'headers': [(name.lower().encode('latin1'),
+                             value.encode('latin1'))
+                            for name, value in headers],
+            }
+
+        result = self.wsgi_application(build_environ(scope, body),
+                                       start_response)
+        try:
+            for chunk in result:
+                if not chunk:
+                    continue
+                if not response.get('sent'):
+                    sync_send(response['start'])
+                    response['sent'] = True
+                sync_send({'type': 'http.response.body', 'body': chunk,
+                           'more_body': True})
+            if not response.get('sent'):
+                sync_send(response['start'])
+            sync_send({'type': 'http.response.body'})
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+
+
+def build_environ(scope, body):
+    '''the WSGI environ for an ASGI http scope and its buffered body'''
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode().decode('latin1'),
+        'PATH_INFO': scope['path'].encode().decode('latin1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f'HTTP/{scope.get("http_version", "1.1")}',
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.errors': BytesIO(),
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'] = scope['client'][0]
+
+    for name, value in scope.get('headers', ()):
+        name = name.decode('latin1').upper().replace('-', '_')
+        if name not in ('CONTENT_LENGTH', 'CONTENT_TYPE'):
+            name = f'HTTP_{name}'
+        value = value.decode('latin1')
+        if name in environ:
+            separator = '; ' if name == 'HTTP_COOKIE' else ','
+            value = environ[name] + separator + value
+        environ[name] = value
+
+    return environ
@@ -0,0 +1,184 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from core.metrics import AUTH_CACHE
+
+
+class TokenCache:
+    '''bounded LRU of token key to cached user state, with a time to live
+
+    Entries live in process memory and, when a cache alias is given, in a
+    shared Django cache as a second tier. Each shared entry carries a
+    random stamp, also kept under a small key of its own, and a local hit
+    only counts while the shared stamp still matches, so a revocation in
+    any process takes effect in all of them at once. Without a shared
+    tier the local one is authoritative for the ttl.
+    '''
+
+    def __init__(self, max_size, ttl, shared_cache=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.shared_cache = shared_cache
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+
+    @property
+    def shared(self):
+        '''the shared cache tier, if one is configured'''
+        if self.shared_cache:
+            return caches[self.shared_cache]
+
+    def _shared_key(self, key):
+        return f'auth-token:{key}'
+
+    def _stamp_key(self, key):
+        return f'auth-token-stamp:{key}'
+
+    def _store_local(self, key, state, stamp=None):
+        with self._lock:
+            self._entries[key] = (state, stamp, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def get(self, key):
+        '''return the cached state for key, or None'''
+        shared = self.shared
+        hit = None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                state, stamp, expires = entry
+                if expires > time.monotonic():
+                    hit = state
+                else:
+                    del self._entries[key]
+        if hit is not None and shared is not None \
+                and shared.get(self._stamp_key(key)) != stamp:
+            with self._lock:
+                if self._entries.get(key) is entry:
+                    del self._entries[key]
+            hit = None
+        if hit is not None:
+            with self._lock:
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                self.hits += 1
+            AUTH_CACHE.inc(result='hit')
+            return hit
+
+        if shared is not None:
+            stamp, state = shared.get(self._shared_key(key), (None, None))
+            if state is not None:
+                self._store_local(key, state, stamp)
+                with self._lock:
+                    self.shared_hits += 1
+                AUTH_CACHE.inc(result='shared_hit')
+                return state
+
+        with self._lock:
+            self.misses += 1
+        AUTH_CACHE.inc(result='miss')
+
+    def set(self, key, state):
+        '''cache user state under token key in every tier'''
+        shared = self.shared
+        stamp = None
+        if shared is not None:
+            stamp = uuid.uuid4().hex
+            shared.set_many({self._shared_key(key): (stamp, state),
+                             self._stamp_key(key): stamp}, self.ttl)
+        self._store_local(key, state, stamp)
+
+    def evict(self, key):
+        '''forget token key in every tier'''
+        with self._lock:
+            self._entries.pop(key, None)
+        shared = self.shared
+        if shared is not None:
+            shared.delete_many([self._shared_key(key), self._stamp_key(key)])
+
+    def clear(self):
+        '''empty the local tier and reset the counters'''
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.shared_hits = self.misses = 0
+
+    def stats(self):
+        '''return hit and miss counters'''
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'hits': self.hits,
+                'shared_hits': self.shared_hits,
+                'misses': self.misses,
+            }
+
+
+token_cache = TokenCache(
+    max_size=settings.TOKEN_AUTH_CACHE['MAX_SIZE'],
+    ttl=settings.TOKEN_AUTH_CACHE['TTL'],
+    shared_cache=settings.TOKEN_AUTH_CACHE['SHARED_CACHE'],
+)
+
+
+def evict_user_tokens(user_id):
+    '''drop cached lookups for every token belonging to a user
+
+    Saving a user calls this; changes made with update() or raw SQL must
+    call it too, or cached copies last until the ttl runs out.
+    '''
+    keys = Token.objects.filter(user_id=user_id).values_list('key', flat=True)
+    for key in keys:
+        token_cache.evict(key)
+
+
+def _cached_fields():
+    '''user columns kept in the cache, leaving out the password hash'''
+    return [field.attname for field in get_user_model()._meta.concrete_fields
+            if field.attname != 'password']
+
+
+def dump_user(user):
+    '''return the cacheable state of user'''
+    return (user._state.db,
+            tuple(getattr(user, name) for name in _cached_fields()))
+
+
+def load_user(state):
+    '''rebuild a user from dump_user state, with the password deferred'''
+    db, values = state
+    return get_user_model().from_db(db, _cached_fields(), values)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    '''token authentication that skips the token/user join when cached'''
+
+    def authenticate_credentials(self, key):
+        '''return the cached user for key, looking it up on a miss'''
+        state = token_cache.get(key)
+        if state is not None:
+            user = load_user(state)
+            if not user.is_active:
+                raise exceptions.AuthenticationFailed(
+                    _('User inactive or deleted.')
+                )
+            return (user, Token(key=key, user=user))
+
+        user, token = super().authenticate_credentials(key)
+        token_cache.set(key, dump_user(user))
+
+        return (user, token)
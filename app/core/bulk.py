@@ -0,0 +1,156 @@
+from django.db import IntegrityError, connections, router, transaction
+from django.db.models.functions import Lower
+
+from core import search
+from core.models import Recipe
+
+
+def insert_returning_ids(model, objs, batch_size=None):
+    '''bulk insert objs and make sure each one has its primary key set
+
+    Postgres returns the new ids from the INSERT itself. Other backends
+    assign ids in insert order, so inside the caller's transaction they
+    are read back with one extra query.
+    '''
+    using = router.db_for_write(model)
+    if not objs:
+        return objs
+    if connections[using].features.can_return_ids_from_bulk_insert:
+        return model.objects.using(using).bulk_create(objs, batch_size)
+
+    model.objects.using(using).bulk_create(objs, batch_size)
+    ids = model.objects.using(using).order_by('-pk') \
+        .values_list('pk', flat=True)[:len(objs)]
+    for obj, pk in zip(objs, reversed(list(ids))):
+        obj.pk = pk
+
+    return objs
+
+
+def insert_rows(model, fields, rows, batch_size=None):
+    '''insert tuples of plain column values in multi-row INSERTs
+
+    For large link tables, where building a model instance per row costs
+    more than the insert itself. Values go to the database unconverted.
+    '''
+    if not rows:
+        return
+    connection = connections[router.db_for_write(model)]
+    fields = [model._meta.get_field(name) for name in fields]
+    qn = connection.ops.quote_name
+    prefix = 'INSERT INTO {} ({}) '.format(
+        qn(model._meta.db_table),
+        ', '.join(qn(field.column) for field in fields)
+    )
+    size = connection.ops.bulk_batch_size(fields, rows)
+    if batch_size:
+        size = min(size, batch_size)
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), size):
+            batch = rows[start:start + size]
+            placeholders = [['%s'] * len(fields)] * len(batch)
+            cursor.execute(
+                prefix + connection.ops.bulk_insert_sql(fields, placeholders),
+                [value for row in batch for value in row]
+            )
+
+
+def bulk_create_recipes(user, items, batch_size=None):
+    '''create recipes and their tag and ingredient links in bulk
+
+    items are validated field dicts as accepted by Recipe(), optionally
+    carrying 'tags' and 'ingredients' lists of ids owned by user. With
+    user None each item names its own 'user_id'.
+    '''
+    owner = {'user': user} if user is not None else {}
+    recipes = []
+    links = []
+    for item in items:
+        item = dict(item)
+        links.append((item.pop('tags', []), item.pop('ingredients', [])))
+        recipes.append(Recipe(**owner, **item))
+
+    using = router.db_for_write(Recipe)
+    with transaction.atomic(using=using):
+        insert_returning_ids(Recipe, recipes, batch_size)
+        insert_rows(Recipe.tags.through, ('recipe', 'tag'), [
+            (recipe.pk, tag_id)
+            for recipe, (tag_ids, _) in zip(recipes, links)
+            for tag_id in set(tag_ids)
+        ], batch_size)
+        insert_rows(Recipe.ingredients.through, ('recipe', 'ingredient'), [
+            (recipe.pk, ingredient_id)
+            for recipe, (_, ingredient_ids) in zip(recipes, links)
+            for ingredient_id in set(ingredient_ids)
+        ], batch_size)
+        search.index_recipes((recipe.pk for recipe in recipes), using)
+
+    return recipes
+
+
+def _lower_keys(names, using):
+    '''map names to their lower() in the database, matching Lower('name')
+
+    Python and SQL agree on ASCII, so only other names cost a query; they
+    fold differently outside it, and SQLite's lower() leaves them as is.
+    '''
+    keys = {name: name.lower() for name in names if name.isascii()}
+    other = list({name for name in names if name not in keys})
+    if not other:
+        return keys
+    with connections[using].cursor() as cursor:
+        for start in range(0, len(other), 500):
+            chunk = other[start:start + 500]
+            cursor.execute(
+                'SELECT ' + ', '.join(['LOWER(%s)'] * len(chunk)), chunk
+            )
+            keys.update(zip(chunk, cursor.fetchone()))
+
+    return keys
+
+
+def bulk_get_or_create_named(model, user, names, attempts=3):
+    '''resolve names to ids of user's tags or ingredients, creating misses
+
+    Existing rows are found in one query and the missing ones inserted in
+    one statement. Names match case-insensitively, as enforced by the
+    (user_id, lower(name)) unique index; if a concurrent request inserts
+    the same name first the lookup is repeated. Returns a dict of name to
+    id and the list of names that were created.
+    '''
+    using = router.db_for_write(model)
+    names = list(names)
+    keys = _lower_keys(names, using)
+    wanted = {}
+    for name in names:
+        wanted.setdefault(keys[name], name)
+
+    found = {}
+    created = []
+    for _ in range(attempts):
+        found.update(
+            model.objects.using(using).annotate(lower_name=Lower('name'))
+            .filter(user=user,
+                    lower_name__in=[n for n in wanted if n not in found])
+            .values_list('lower_name', 'id')
+        )
+        missing = [name for lower, name in wanted.items()
+                   if lower not in found]
+        if not missing:
+            break
+        try:
+            with transaction.atomic(using=using):
+                objs = insert_returning_ids(
+                    model, [model(user=user, name=name) for name in missing]
+                )
+        except IntegrityError:
+            continue
+        found.update((keys[obj.name], obj.pk) for obj in objs)
+        created.extend(missing)
+        break
+    else:
+        raise IntegrityError(
+            f'could not resolve {model.__name__} names for {user}'
+        )
+
+    return {name: found[keys[name]] for name in names}, created
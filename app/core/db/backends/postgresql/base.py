@@ -0,0 +1,103 @@
+'''Postgres backend with connection health checks and optional pooling
+
+Set in DATABASES as 'core.db.backends.postgresql'. Two extra settings are
+read from the database's entry:
+
+HEALTH_CHECKS: before a persistent (CONN_MAX_AGE) or pooled connection is
+    first used in a request, make sure it still works and reconnect if not.
+POOL: with MAX_SIZE above 0, connections come from a process-wide
+    core.db.pool.ConnectionPool of that size and are returned to it when
+    Django closes them, so use it with CONN_MAX_AGE 0. IDLE_TIMEOUT closes
+    connections idle that long and TIMEOUT bounds the wait for a free one.
+'''
+from django.db.backends.postgresql import base
+from psycopg2 import extensions
+
+from core.db.pool import ConnectionPool, get_pool
+
+
+def _check(conn):
+    if conn.closed:
+        return False
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute('SELECT 1')
+    except base.Database.Error:
+        return False
+
+    return True
+
+
+def _reset(conn):
+    '''roll back anything left open so the next user starts clean'''
+    if conn.closed:
+        raise base.Database.InterfaceError('connection already closed')
+    if conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+        conn.rollback()
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    health_check_done = False
+
+    @property
+    def pool(self):
+        options = self.settings_dict.get('POOL') or {}
+        if not options.get('MAX_SIZE'):
+            return None
+        settings = self.settings_dict
+        key = (f'{self.alias}:{settings["USER"]}@{settings["HOST"]}:'
+               f'{settings["PORT"]}/{settings["NAME"]}')
+
+        return get_pool(key, lambda: ConnectionPool(
+            options['MAX_SIZE'],
+            idle_timeout=options.get('IDLE_TIMEOUT', 300),
+            timeout=options.get('TIMEOUT', 10),
+            check=_check if settings.get('HEALTH_CHECKS') else None,
+            reset=_reset,
+        ))
+
+    def get_new_connection(self, conn_params):
+        pool = self.pool
+        if pool is None:
+            return super().get_new_connection(conn_params)
+
+        connection = pool.get(
+            lambda: super(DatabaseWrapper, self).get_new_connection(
+                conn_params
+            )
+        )
+        options = self.settings_dict['OPTIONS']
+        self.isolation_level = options.get('isolation_level',
+                                           connection.isolation_level)
+
+        return connection
+
+    def _close(self):
+        pool = self.pool
+        if pool is None or self.connection is None:
+            return super()._close()
+        if self.errors_occurred and not self.is_usable():
+            pool.discard(self.connection)
+        else:
+            pool.put(self.connection)
+
+    def connect(self):
+        # a new connection needs no check, and checking it while connect()
+        # sets autocommit would leave a transaction open on it
+        self.health_check_done = True
+        super().connect()
+
+    def close_if_unusable_or_obsolete(self):
+        '''called as each request starts and ends'''
+        super().close_if_unusable_or_obsolete()
+        self.health_check_done = False
+
+    def ensure_connection(self):
+        # pooled connections are checked as they are checked out
+        if (self.connection is not None and not self.health_check_done and
+                self.settings_dict.get('HEALTH_CHECKS') and
+                self.pool is None):
+            self.health_check_done = True
+            if not self.in_atomic_block and not self.is_usable():
+                self.close()
+        super().ensure_connection()
@@ -0,0 +1,164 @@
+'''a small thread-safe pool of database connections
+
+The pool knows nothing about the database driver: it is handed a connect
+callable on checkout and check, reset and close callables up front, so it
+can be exercised with stand-in connections.
+'''
+import threading
+import time
+
+
+class PoolTimeout(Exception):
+    '''raised when no connection frees up within the checkout timeout'''
+
+
+class ConnectionPool:
+    '''keep up to max_size connections open and hand them out LIFO
+
+    Idle connections are closed after idle_timeout seconds. check(conn)
+    says whether a reused connection still works; reset(conn) prepares a
+    returned one for its next user and may raise to have it discarded.
+    '''
+
+    def __init__(self, max_size, idle_timeout=300, timeout=10, check=None,
+                 reset=None, close=None, clock=time.monotonic):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self._check = check or (lambda conn: True)
+        self._reset = reset or (lambda conn: None)
+        self._close = close or (lambda conn: conn.close())
+        self._clock = clock
+        self._cond = threading.Condition()
+        # (connection, returned at), oldest first; reuse takes the newest
+        self._idle = []
+        self._size = 0
+        self._counts = dict.fromkeys(
+            ('checkouts', 'waits', 'timeouts', 'connects', 'reconnects',
+             'discarded', 'expired'), 0
+        )
+
+    def _count(self, name):
+        with self._cond:
+            self._counts[name] += 1
+
+    def _expire(self):
+        '''drop idle connections past idle_timeout, with the lock held'''
+        expired = []
+        now = self._clock()
+        while self._idle and now - self._idle[0][1] > self.idle_timeout:
+            expired.append(self._idle.pop(0)[0])
+        self._size -= len(expired)
+        self._counts['expired'] += len(expired)
+        if expired:
+            self._cond.notify(len(expired))
+
+        return expired
+
+    def _close_quietly(self, conn):
+        try:
+            self._close(conn)
+        except Exception:
+            pass
+
+    def get(self, connect):
+        '''check out a connection, opening one with connect() if needed'''
+        deadline = self._clock() + self.timeout
+        waited = False
+        with self._cond:
+            expired = self._expire()
+            while not self._idle and self._size >= self.max_size:
+                if not waited:
+                    waited = True
+                    self._counts['waits'] += 1
+                remaining = deadline - self._clock()
+                if remaining <= 0:
+                    self._counts['timeouts'] += 1
+                    raise PoolTimeout(
+                        f'no connection free after {self.timeout}s'
+                    )
+                self._cond.wait(remaining)
+            conn = self._idle.pop()[0] if self._idle else None
+            if conn is None:
+                # hold the slot while connecting outside the lock
+                self._size += 1
+        for old in expired:
+            self._close_quietly(old)
+
+        if conn is not None:
+            if self._check(conn):
+                self._count('checkouts')
+                return conn
+            self._close_quietly(conn)
+            self._count('reconnects')
+        try:
+            conn = connect()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._counts['connects'] += 1
+            self._counts['checkouts'] += 1
+
+        return conn
+
+    def put(self, conn):
+        '''return a checked out connection for reuse'''
+        try:
+            self._reset(conn)
+        except Exception:
+            self.discard(conn)
+            return
+        with self._cond:
+            self._idle.append((conn, self._clock()))
+            self._cond.notify()
+
+    def discard(self, conn):
+        '''close a checked out connection that must not be reused'''
+        self._close_quietly(conn)
+        with self._cond:
+            self._size -= 1
+            self._counts['discarded'] += 1
+            self._cond.notify()
+
+    def close_all(self):
+        '''close every idle connection'''
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+            self._cond.notify(len(idle))
+        for conn, _ in idle:
+            self._close_quietly(conn)
+
+    def stats(self):
+        with self._cond:
+            return dict(
+                self._counts,
+                size=self._size,
+                idle=len(self._idle),
+                in_use=self._size - len(self._idle),
+                max_size=self.max_size,
+            )
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(key, factory):
+    '''return the process-wide pool for key, creating it with factory()'''
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = factory()
+
+        return _pools[key]
+
+
+def pool_stats():
+    '''stats of every pool in this process, by key'''
+    with _pools_lock:
+        pools = dict(_pools)
+
+    return {key: pool.stats() for key, pool in pools.items()}
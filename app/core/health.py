@@ -0,0 +1,33 @@
+'''database readiness checks shared by wait_for_db and the probe views'''
+import time
+
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.migrations.executor import MigrationExecutor
+
+
+def check_database(alias=DEFAULT_DB_ALIAS):
+    '''run SELECT 1 and return its round trip in milliseconds
+
+    Raises the backend's OperationalError when the database is unreachable,
+    after closing the connection so the next check opens a fresh one.
+    '''
+    connection = connections[alias]
+    start = time.perf_counter()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1')
+            cursor.fetchone()
+    except Exception:
+        connection.close()
+        raise
+
+    return (time.perf_counter() - start) * 1000
+
+
+def pending_migrations(alias=DEFAULT_DB_ALIAS):
+    '''return the names of migrations not yet applied to the database'''
+    executor = MigrationExecutor(connections[alias])
+    plan = executor.migration_plan(executor.loader.graph.leaf_nodes())
+
+    return [f'{migration.app_label}.{migration.name}'
+            for migration, _ in plan]
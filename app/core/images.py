@@ -0,0 +1,139 @@
+'''background generation of resized recipe image renditions'''
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from PIL import Image, features
+
+from core.metrics import RENDITION_QUEUE
+from core.models import Recipe, RecipeImageRendition
+
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+_unsupported_logged = set()
+
+
+def get_executor():
+    '''return the shared rendition worker pool, starting it on first use'''
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.RECIPE_IMAGE_WORKERS,
+                thread_name_prefix='renditions'
+            )
+
+    return _executor
+
+
+def queue_renditions(recipe_id):
+    '''generate renditions for a recipe once the current transaction commits
+
+    With RECIPE_IMAGE_WORKERS set to 0 they are generated inline instead.
+    '''
+    transaction.on_commit(lambda: submit_renditions(recipe_id))
+
+
+def submit_renditions(recipe_id):
+    '''hand a recipe to the worker pool'''
+    if not settings.RECIPE_IMAGE_WORKERS:
+        generate_renditions(recipe_id)
+        return
+
+    RENDITION_QUEUE.inc()
+    get_executor().submit(_run_in_worker, recipe_id)
+
+
+def _run_in_worker(recipe_id):
+    close_old_connections()
+    try:
+        generate_renditions(recipe_id)
+    except Exception:
+        logger.exception('rendition generation failed for recipe %s',
+                         recipe_id)
+    finally:
+        RENDITION_QUEUE.dec()
+        close_old_connections()
+
+
+def _encode(image, image_format):
+    '''return image encoded in the given format'''
+    buffer = BytesIO()
+    if image_format == 'jpeg':
+        image.save(buffer, 'JPEG', quality=settings.RECIPE_IMAGE_QUALITY,
+                   optimize=True, progressive=True)
+    else:
+        image.save(buffer, image_format.upper(),
+                   quality=settings.RECIPE_IMAGE_QUALITY)
+
+    return buffer.getvalue()
+
+
+def encodable_formats():
+    '''the configured rendition formats this Pillow build can write'''
+    formats = []
+    for image_format in settings.RECIPE_IMAGE_FORMATS:
+        if image_format == 'webp' and not features.check('webp'):
+            if image_format not in _unsupported_logged:
+                _unsupported_logged.add(image_format)
+                logger.warning('Pillow was built without %s support, '
+                               'skipping those renditions', image_format)
+            continue
+        formats.append(image_format)
+
+    return formats
+
+
+def generate_renditions(recipe_id):
+    '''resize a recipe's image into every configured size and format'''
+    recipe = Recipe.objects.filter(pk=recipe_id).only('id', 'image').first()
+    if recipe is None or not recipe.image:
+        return
+    source_name = recipe.image.name
+    largest = max(settings.RECIPE_IMAGE_RENDITIONS.values())
+    formats = encodable_formats()
+
+    renditions = []
+    with recipe.image.open('rb') as source, Image.open(source) as image:
+        # let the JPEG decoder scale down while decoding
+        image.draft('RGB', (largest, largest))
+        image = image.convert('RGB')
+        for size, edge in settings.RECIPE_IMAGE_RENDITIONS.items():
+            resized = image.copy()
+            resized.thumbnail((edge, edge), Image.LANCZOS)
+            for image_format in formats:
+                rendition = RecipeImageRendition(
+                    recipe_id=recipe_id,
+                    size=size,
+                    format=image_format,
+                    width=resized.width,
+                    height=resized.height
+                )
+                rendition.image.save(
+                    f'{size}.{image_format}',
+                    ContentFile(_encode(resized, image_format)),
+                    save=False
+                )
+                renditions.append(rendition)
+
+    with transaction.atomic():
+        current = Recipe.objects.select_for_update().filter(pk=recipe_id) \
+            .values_list('image', flat=True).first()
+        if current == source_name:
+            RecipeImageRendition.objects.filter(recipe_id=recipe_id).delete()
+            RecipeImageRendition.objects.bulk_create(renditions)
+            Recipe.objects.filter(pk=recipe_id) \
+                .update(updated_at=timezone.now())
+            return renditions
+
+    # the image was replaced or the recipe deleted while resizing
+    for rendition in renditions:
+        rendition.image.delete(save=False)
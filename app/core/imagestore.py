@@ -0,0 +1,94 @@
+'''content-addressed, reference counted storage of recipe images
+
+An image is stored once under the hash of its bytes, however many recipes
+use it, so its URL never changes content and can be cached forever. Each
+use is counted in a StoredImage row; the file is deleted after the last
+reference is released and that transaction commits.
+'''
+import hashlib
+import os
+
+from django.db import transaction
+from django.db.models import F
+
+from core.models import Recipe, StoredImage
+
+
+IMAGE_DIR = 'uploads/recipe'
+EXTENSIONS = {'JPEG': 'jpg', 'MPO': 'jpg'}
+
+
+def _storage():
+    return Recipe._meta.get_field('image').storage
+
+
+def content_hash(file):
+    '''return the sha256 of a file, read in chunks
+
+    Files received by core.uploads.LimitedUploadHandler were hashed while
+    they streamed in and are not read again.
+    '''
+    digest = getattr(file, 'sha256', None)
+    if digest:
+        return digest
+    hasher = hashlib.sha256()
+    file.seek(0)
+    for chunk in file.chunks():
+        hasher.update(chunk)
+    file.seek(0)
+
+    return hasher.hexdigest()
+
+
+def image_name(file):
+    '''storage name of an image validated by an ImageField'''
+    image_format = getattr(getattr(file, 'image', None), 'format', None)
+    if image_format:
+        ext = EXTENSIONS.get(image_format, image_format.lower())
+    else:
+        ext = os.path.splitext(file.name)[1].lstrip('.').lower() or 'bin'
+    digest = content_hash(file)
+
+    return f'{IMAGE_DIR}/{digest[:2]}/{digest}.{ext}'
+
+
+def store(file):
+    '''take a reference to file's content, saving it if it is new
+
+    Returns the storage name to assign to Recipe.image.
+    '''
+    name = image_name(file)
+    storage = _storage()
+    with transaction.atomic():
+        # the row lock keeps collect() from deleting the file meanwhile
+        stored, _ = StoredImage.objects.select_for_update() \
+            .get_or_create(name=name)
+        if not storage.exists(name):
+            file.seek(0)
+            saved = storage.save(name, file)
+            if saved != name:
+                # another process wrote the same bytes first
+                storage.delete(saved)
+        StoredImage.objects.filter(pk=stored.pk) \
+            .update(ref_count=F('ref_count') + 1)
+
+    return name
+
+
+def release(name):
+    '''drop a reference, deleting the file after commit if it was the last'''
+    if not name:
+        return
+    StoredImage.objects.filter(name=name, ref_count__gt=0) \
+        .update(ref_count=F('ref_count') - 1)
+    transaction.on_commit(lambda: collect(name))
+
+
+def collect(name):
+    '''delete an image's file and row if nothing references it any more'''
+    with transaction.atomic():
+        stored = StoredImage.objects.select_for_update() \
+            .filter(name=name, ref_count=0).first()
+        if stored is not None:
+            _storage().delete(name)
+            stored.delete()
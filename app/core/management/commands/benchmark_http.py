@@ -0,0 +1,110 @@
+import http.client
+import statistics
+import threading
+import time
+from urllib.parse import urlsplit
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.authtoken.models import Token
+
+from core.management.commands.benchmark_list_rendering import BENCH_EMAIL
+
+
+class Command(BaseCommand):
+    '''measure requests per second a running server sustains'''
+    help = ('Send authenticated GETs to a running server from concurrent '
+            'keep-alive connections and report throughput and latency. '
+            'Run benchmark_list_rendering first to seed the user.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'url', nargs='?',
+            default='http://localhost:8000/api/recipe/recipes/'
+        )
+        parser.add_argument('--concurrency', type=int, default=16)
+        parser.add_argument('--duration', type=float, default=10,
+                            help='seconds to send requests for')
+        parser.add_argument('--email', default=BENCH_EMAIL)
+        parser.add_argument(
+            '--slow-clients', type=int, default=0,
+            help='extra connections that keep uploading a body slowly'
+        )
+        parser.add_argument('--slow-seconds', type=float, default=2,
+                            help='seconds each slow upload takes')
+
+    def handle(self, *args, **options):
+        try:
+            user = get_user_model().objects.get(email=options['email'])
+        except get_user_model().DoesNotExist:
+            raise CommandError(f'No user {options["email"]}')
+        token, _ = Token.objects.get_or_create(user=user)
+        url = urlsplit(options['url'])
+        path = url.path + (f'?{url.query}' if url.query else '')
+        headers = {'Authorization': f'Token {token.key}'}
+
+        timings = []
+        errors = []
+        deadline = time.monotonic() + options['duration']
+
+        def client():
+            conn = http.client.HTTPConnection(url.hostname, url.port or 80)
+            while time.monotonic() < deadline:
+                start = time.perf_counter()
+                try:
+                    conn.request('GET', path, headers=headers)
+                    response = conn.getresponse()
+                    response.read()
+                except (OSError, http.client.HTTPException) as exc:
+                    errors.append(exc)
+                    conn.close()
+                    continue
+                if response.status != 200:
+                    errors.append(response.status)
+                    continue
+                timings.append((time.perf_counter() - start) * 1000)
+            conn.close()
+
+        def slow_client():
+            body = b'{}' + b' ' * 98
+            pause = options['slow_seconds'] / len(body)
+            while time.monotonic() < deadline:
+                conn = http.client.HTTPConnection(url.hostname,
+                                                  url.port or 80)
+                try:
+                    conn.putrequest('POST', path)
+                    for name, value in headers.items():
+                        conn.putheader(name, value)
+                    conn.putheader('Content-Type', 'application/json')
+                    conn.putheader('Content-Length', str(len(body)))
+                    conn.endheaders()
+                    for i in range(len(body)):
+                        conn.send(body[i:i + 1])
+                        time.sleep(pause)
+                    conn.getresponse().read()
+                except (OSError, http.client.HTTPException):
+                    pass
+                conn.close()
+
+        threads = [threading.Thread(target=client)
+                   for _ in range(options['concurrency'])]
+        threads += [threading.Thread(target=slow_client)
+                    for _ in range(options['slow_clients'])]
+        start = time.monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.monotonic() - start
+
+        if not timings:
+            raise CommandError(f'No successful requests: {errors[:5]}')
+        timings.sort()
+        p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+        self.stdout.write(
+            f'{len(timings) / elapsed:.1f} req/s over {elapsed:.1f}s, '
+            f'{options["concurrency"]} connections, '
+            f'{options["slow_clients"]} slow uploads, '
+            f'p50 {statistics.median(timings):.1f}ms, p99 {p99:.1f}ms, '
+            f'{len(errors)} errors'
+        )
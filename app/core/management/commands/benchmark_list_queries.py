@@ -0,0 +1,159 @@
+import random
+import statistics
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Exists, OuterRef
+
+from core.models import Tag, Ingredient, Recipe
+
+
+BENCH_EMAIL = 'list-benchmark@example.com'
+BATCH_SIZE = 10000
+# the composite list indexes added by migration 0007; the updated_at
+# indexes from 0011 serve conditional GETs and stay in place
+LIST_INDEXES = (
+    'core_tag_user_id_74e398_idx',
+    'core_ingred_user_id_b96ee8_idx',
+    'core_recipe_user_id_bf8313_idx',
+)
+
+
+class Rollback(Exception):
+    '''raised to undo the temporary index drops'''
+
+
+class Command(BaseCommand):
+    '''compare plans and latency of the per-user list query shapes'''
+    help = ('Seed a benchmark user and time the tag, ingredient and recipe '
+            'list queries with and without the composite indexes.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rows', type=int, default=1000000,
+            help='total rows to seed across tags, ingredients and recipes'
+        )
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--page-size', type=int, default=50)
+        parser.add_argument(
+            '--no-explain', action='store_true',
+            help='only print timings'
+        )
+
+    def handle(self, *args, **options):
+        self.options = options
+        user = self.seed(options['rows'])
+
+        shapes = [
+            ('tags assigned, join + distinct',
+             Tag.objects.filter(user=user, recipe__isnull=False)
+             .order_by('-name').distinct()),
+            ('tags assigned, exists',
+             Tag.objects.annotate(assigned=Exists(
+                 Recipe.tags.through.objects.filter(tag=OuterRef('pk'))
+             )).filter(user=user, assigned=True).order_by('-name')),
+            ('ingredients assigned, join + distinct',
+             Ingredient.objects.filter(user=user, recipe__isnull=False)
+             .order_by('-name').distinct()),
+            ('ingredients assigned, exists',
+             Ingredient.objects.annotate(assigned=Exists(
+                 Recipe.ingredients.through.objects.filter(
+                     ingredient=OuterRef('pk')
+                 )
+             )).filter(user=user, assigned=True).order_by('-name')),
+            ('tags', Tag.objects.filter(user=user).order_by('-name')),
+            ('recipes', Recipe.objects.filter(user=user).order_by('-id')),
+        ]
+
+        self.stdout.write(self.style.MIGRATE_HEADING('With indexes'))
+        self.run(shapes)
+
+        self.stdout.write(self.style.MIGRATE_HEADING('Without indexes'))
+        try:
+            with transaction.atomic():
+                self.drop_list_indexes()
+                self.run(shapes)
+                raise Rollback
+        except Rollback:
+            pass
+
+    def seed(self, rows):
+        '''create the benchmark user's rows unless they already exist'''
+        user, created = get_user_model().objects.get_or_create(
+            email=BENCH_EMAIL
+        )
+        if not created:
+            return user
+
+        # Django 2.1 does not cap a given batch size at SQLite's limit on
+        # compound SELECT terms, so let it choose there
+        batch_size = None if connection.vendor == 'sqlite' else BATCH_SIZE
+        rng = random.Random(0)
+        per_model = rows // 3
+        self.stdout.write(f'Seeding {per_model} rows per model')
+        for model in (Tag, Ingredient):
+            model.objects.bulk_create(
+                (model(user=user, name=f'{model.__name__} {i:08d}')
+                 for i in range(per_model)),
+                batch_size
+            )
+        Recipe.objects.bulk_create(
+            (Recipe(user=user, title=f'Recipe {i}', time_minutes=10,
+                    price='5.00') for i in range(per_model)),
+            batch_size
+        )
+
+        recipe_ids = list(Recipe.objects.filter(user=user)
+                          .values_list('id', flat=True))
+        for model, field in ((Tag, 'tags'), (Ingredient, 'ingredients')):
+            ids = list(model.objects.filter(user=user)
+                       .values_list('id', flat=True))
+            through = getattr(Recipe, field).through
+            column = f'{model.__name__.lower()}_id'
+            # link recipes to the first tenth of the rows only, so
+            # assigned_only has something to filter out
+            assigned = ids[:max(len(ids) // 10, 1)]
+            through.objects.bulk_create(
+                (through(recipe_id=recipe_id,
+                         **{column: rng.choice(assigned)})
+                 for recipe_id in recipe_ids),
+                batch_size
+            )
+        self.analyze()
+
+        return user
+
+    def analyze(self):
+        '''refresh planner statistics after seeding'''
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def drop_list_indexes(self):
+        '''drop the composite list indexes inside the open transaction'''
+        with connection.cursor() as cursor:
+            for name in LIST_INDEXES:
+                cursor.execute(f'DROP INDEX {connection.ops.quote_name(name)}')
+
+    def run(self, shapes):
+        '''print plan and first page latency for each query shape'''
+        page_size = self.options['page_size']
+        for label, queryset in shapes:
+            page = queryset[:page_size]
+            timings = []
+            for _ in range(self.options['repeat']):
+                start = time.perf_counter()
+                list(page.all())
+                timings.append((time.perf_counter() - start) * 1000)
+
+            self.stdout.write(
+                f'{label}: median {statistics.median(timings):.2f}ms, '
+                f'max {max(timings):.2f}ms'
+            )
+            if not self.options['no_explain']:
+                if connection.vendor == 'postgresql':
+                    plan = page.explain(analyze=True)
+                else:
+                    plan = page.explain()
+                self.stdout.write(plan)
@@ -0,0 +1,120 @@
+import statistics
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from core.models import Tag, Ingredient, Recipe
+from recipe.views import RecipeViewSet, TagViewSet
+
+
+BENCH_EMAIL = 'render-benchmark@example.com'
+
+
+class Command(BaseCommand):
+    '''compare serializer and lean rendering of full list pages'''
+    help = ('Seed a benchmark user and time recipe and tag list pages '
+            'rendered by serializers and by the API_LEAN_LISTS path.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipes', type=int, default=5000)
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, **options):
+        user = self.seed(options['recipes'])
+        factory = APIRequestFactory(HTTP_HOST='localhost')
+        page_size = settings.API_MAX_PAGE_SIZE
+        views = [
+            ('recipes', RecipeViewSet.as_view({'get': 'list'}),
+             '/api/recipe/recipes/'),
+            ('tags', TagViewSet.as_view({'get': 'list'}),
+             '/api/recipe/tags/'),
+        ]
+
+        for label, view, path in views:
+            def render():
+                request = factory.get(path, {'page_size': page_size})
+                force_authenticate(request, user=user)
+                return view(request).render().content
+
+            timings = {}
+            contents = {}
+            for lean in (False, True):
+                with override_settings(API_LEAN_LISTS=lean):
+                    contents[lean] = render()
+                    timings[lean] = self.time(render, options['repeat'])
+            if contents[False] != contents[True]:
+                raise CommandError(f'{label}: lean output differs')
+
+            serializer, lean = (statistics.median(timings[mode])
+                                for mode in (False, True))
+            self.stdout.write(
+                f'{label} ({page_size} rows): serializers {serializer:.2f}ms '
+                f'({1000 / serializer:.1f} pages/s), lean {lean:.2f}ms '
+                f'({1000 / lean:.1f} pages/s), {serializer / lean:.1f}x'
+            )
+
+    def time(self, func, repeat):
+        '''return the wall time of each call of func in milliseconds'''
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            timings.append((time.perf_counter() - start) * 1000)
+
+        return timings
+
+    def seed(self, count):
+        '''create the benchmark user's recipes unless they already exist'''
+        user, created = get_user_model().objects.get_or_create(
+            email=BENCH_EMAIL
+        )
+        if not created:
+            return user
+
+        self.stdout.write(f'Seeding {count} recipes')
+        tags = Tag.objects.bulk_create(
+            Tag(user=user, name=f'Tag {i}') for i in range(50)
+        )
+        ingredients = Ingredient.objects.bulk_create(
+            Ingredient(user=user, name=f'Ingredient {i}') for i in range(50)
+        )
+        # SQLite does not return ids from bulk inserts
+        if connection.vendor != 'postgresql':
+            tags = list(Tag.objects.filter(user=user))
+            ingredients = list(Ingredient.objects.filter(user=user))
+        batch_size = None if connection.vendor == 'sqlite' else 1000
+        Recipe.objects.bulk_create(
+            (Recipe(user=user, title=f'Recipe {i}', time_minutes=i % 90,
+                    price=f'{i % 100}.{i % 10}0',
+                    link=f'https://example.com/{i}')
+             for i in range(count)),
+            batch_size
+        )
+
+        recipe_ids = Recipe.objects.filter(user=user) \
+            .values_list('id', flat=True)
+        tag_links = []
+        ingredient_links = []
+        for i, recipe_id in enumerate(recipe_ids):
+            tag_links.extend(
+                Recipe.tags.through(recipe_id=recipe_id,
+                                    tag_id=tags[(i + n) % len(tags)].id)
+                for n in range(3)
+            )
+            ingredient_links.extend(
+                Recipe.ingredients.through(
+                    recipe_id=recipe_id,
+                    ingredient_id=ingredients[(i + n) % len(ingredients)].id
+                )
+                for n in range(2)
+            )
+        Recipe.tags.through.objects.bulk_create(tag_links, batch_size)
+        Recipe.ingredients.through.objects.bulk_create(ingredient_links,
+                                                       batch_size)
+
+        return user
@@ -0,0 +1,168 @@
+import csv
+import json
+import os
+import time
+from itertools import islice
+
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from core.bulk import bulk_create_recipes, bulk_get_or_create_named
+from core.models import Tag, Ingredient, Recipe, ImportCheckpoint
+
+
+FIELDS = ('title', 'time_minutes', 'price', 'link')
+UNCHECKED = tuple(field.name for field in Recipe._meta.fields
+                  if field.name not in FIELDS)
+NAME_FIELDS = {'tags': Tag, 'ingredients': Ingredient}
+
+
+class Command(BaseCommand):
+    '''bulk load recipes from an NDJSON or CSV export'''
+    help = ('Import recipes for a user from an NDJSON or CSV file in the '
+            'export format, in batches that can be resumed.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--user', required=True,
+                            help='email of the user to import for')
+        parser.add_argument('--format', choices=('ndjson', 'csv'),
+                            help='defaults to the file extension')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument(
+            '--checkpoint',
+            help='name the imported rows are recorded under, defaults to '
+                 'the absolute PATH'
+        )
+        parser.add_argument('--resume', action='store_true',
+                            help='skip the rows the checkpoint records')
+
+    def handle(self, *args, **options):
+        try:
+            user = get_user_model().objects.get(email=options['user'])
+        except get_user_model().DoesNotExist:
+            raise CommandError(f'No user {options["user"]}')
+        path = options['path']
+        file_format = options['format'] or \
+            os.path.splitext(path)[1].lstrip('.').lower()
+        if file_format not in ('ndjson', 'csv'):
+            raise CommandError('Pass --format ndjson or csv')
+        checkpoint = options['checkpoint'] or os.path.abspath(path)
+        max_length = ImportCheckpoint._meta.get_field('name').max_length
+        if len(checkpoint) > max_length:
+            raise CommandError(f'Pass a --checkpoint name of at most '
+                               f'{max_length} characters')
+        done = self.read_checkpoint(user, checkpoint) \
+            if options['resume'] else 0
+
+        imported = skipped = 0
+        start = time.monotonic()
+        with open(path, encoding='utf-8', newline='') as f:
+            rows = self.read_rows(f, file_format)
+            if done:
+                self.stdout.write(f'Resuming after {done} rows')
+                rows = islice(rows, done, None)
+            while True:
+                batch = list(islice(rows, options['batch_size']))
+                if not batch:
+                    break
+                items = [self.clean(done + i + 1, line, row)
+                         for i, (line, row) in enumerate(batch)]
+                items = [item for item in items if item is not None]
+                with transaction.atomic():
+                    self.import_batch(user, items)
+                    ImportCheckpoint.objects.update_or_create(
+                        user=user, name=checkpoint,
+                        defaults={'rows': done + len(batch)}
+                    )
+
+                done += len(batch)
+                imported += len(items)
+                skipped += len(batch) - len(items)
+                rate = imported / max(time.monotonic() - start, 1e-6)
+                self.stdout.write(
+                    f'{done} rows read, {imported} imported, '
+                    f'{skipped} skipped, {rate:.0f} rows/s'
+                )
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {imported} recipes for {user.email}'
+        ))
+
+    def read_rows(self, f, file_format):
+        '''yield (line number, row) for each row, reading as a stream
+
+        CSV rows are dicts. NDJSON rows are left as text for clean() to
+        decode, so one malformed line only skips that row.
+        '''
+        if file_format == 'csv':
+            reader = csv.DictReader(f)
+            for row in reader:
+                for field in NAME_FIELDS:
+                    names = row.get(field) or ''
+                    row[field] = [name.strip() for name in names.split(';')
+                                  if name.strip()]
+                yield reader.line_num, row
+        else:
+            for number, line in enumerate(f, 1):
+                if line.strip():
+                    yield number, line
+
+    def clean(self, number, line, row):
+        '''return a validated item for bulk_create_recipes, or None'''
+        try:
+            return self.validate(row)
+        except ValidationError as exc:
+            errors = exc.message_dict if hasattr(exc, 'error_dict') \
+                else exc.messages
+            self.stderr.write(
+                f'Row {number} skipped (line {line}): {errors}'
+            )
+
+    def validate(self, row):
+        '''return row as an item, raising ValidationError if invalid'''
+        if isinstance(row, str):
+            try:
+                row = json.loads(row)
+            except ValueError as exc:
+                raise ValidationError(f'Invalid JSON: {exc}')
+        if not isinstance(row, dict):
+            raise ValidationError('Expected a JSON object')
+
+        recipe = Recipe(**{field: row.get(field) for field in FIELDS})
+        recipe.link = recipe.link or ''
+        recipe.clean_fields(exclude=UNCHECKED)
+        item = {field: getattr(recipe, field) for field in FIELDS}
+
+        for field, model in NAME_FIELDS.items():
+            names = row.get(field) or []
+            if not isinstance(names, list):
+                raise ValidationError({field: ['Expected a list of names']})
+            names = [str(name) for name in names]
+            max_length = model._meta.get_field('name').max_length
+            too_long = [name for name in names if len(name) > max_length]
+            if too_long:
+                raise ValidationError({field: [
+                    f'Names may have at most {max_length} characters'
+                ]})
+            item[field] = names
+
+        return item
+
+    def import_batch(self, user, items):
+        '''resolve the batch's names to ids, then insert it in one go'''
+        for model, field in ((Tag, 'tags'), (Ingredient, 'ingredients')):
+            names = {name for item in items for name in item[field]}
+            if not names:
+                continue
+            ids, _ = bulk_get_or_create_named(model, user, sorted(names))
+            for item in items:
+                item[field] = [ids[name] for name in item[field]]
+        bulk_create_recipes(user, items)
+
+    def read_checkpoint(self, user, checkpoint):
+        '''return the rows already imported under the checkpoint name'''
+        return ImportCheckpoint.objects.filter(user=user, name=checkpoint) \
+            .values_list('rows', flat=True).first() or 0
@@ -0,0 +1,23 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from core.profiling import sign_user
+
+
+class Command(BaseCommand):
+    '''print an X-Profile header value for a staff user'''
+    help = ('Print an X-Profile header that has requests profiled while '
+            'PROFILING is enabled, valid for PROFILING_HEADER_MAX_AGE.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', required=True,
+                            help='email of a staff user')
+
+    def handle(self, *args, **options):
+        try:
+            user = get_user_model().objects.get(email=options['user'],
+                                                is_staff=True)
+        except get_user_model().DoesNotExist:
+            raise CommandError(f'No staff user {options["user"]}')
+
+        self.stdout.write(f'X-Profile: {sign_user(user)}')
@@ -0,0 +1,202 @@
+import random
+import time
+from collections import Counter
+from io import BytesIO
+from itertools import accumulate
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import F
+from PIL import Image
+
+from core import imagestore
+from core.bulk import bulk_create_recipes, insert_returning_ids
+from core.models import Tag, Ingredient, StoredImage
+
+
+ADJECTIVES = ('Smoked', 'Roasted', 'Spicy', 'Sweet', 'Crispy', 'Creamy',
+              'Grilled', 'Fresh', 'Wild', 'Golden', 'Tangy', 'Rustic')
+INGREDIENTS = ('Garlic', 'Basil', 'Tomato', 'Lemon', 'Chickpea', 'Salmon',
+               'Mushroom', 'Ginger', 'Paprika', 'Spinach', 'Lentil',
+               'Coconut', 'Chilli', 'Pepper', 'Onion', 'Thyme')
+TAGS = ('Vegan', 'Dinner', 'Quick', 'Dessert', 'Breakfast', 'Lunch',
+        'Spicy', 'Healthy', 'Comfort', 'Party', 'Budget', 'Seasonal')
+DISHES = ('Soup', 'Stew', 'Curry', 'Salad', 'Pie', 'Pasta', 'Risotto',
+          'Tart', 'Bowl', 'Roast', 'Bake', 'Skewers')
+PLACEHOLDERS = 8
+
+
+def zipf_counts(rng, users, largest, exponent):
+    '''largest / rank ** exponent for each user, ranks in random order'''
+    ranks = list(range(1, users + 1))
+    rng.shuffle(ranks)
+    return [max(1, round(largest / rank ** exponent)) for rank in ranks]
+
+
+def zipf_weights(count, exponent):
+    '''cumulative popularity of count items, the first the most popular'''
+    return list(accumulate(1 / rank ** exponent
+                           for rank in range(1, count + 1)))
+
+
+class Command(BaseCommand):
+    '''bulk generate a reproducible synthetic dataset'''
+    help = ('Create users with Zipf distributed numbers of tags, '
+            'ingredients and recipes, linked and optionally given '
+            'placeholder images, in batched inserts. The same --seed '
+            'always creates the same data.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--max-recipes', type=int, default=1000,
+                            help='recipes of the busiest user')
+        parser.add_argument('--max-tags', type=int, default=50)
+        parser.add_argument('--max-ingredients', type=int, default=200)
+        parser.add_argument('--tags-per-recipe', type=int, default=3)
+        parser.add_argument('--ingredients-per-recipe', type=int, default=8)
+        parser.add_argument(
+            '--zipf-exponent', type=float, default=1.0,
+            help='skew of the per user counts and of link popularity'
+        )
+        parser.add_argument(
+            '--images', type=float, default=0,
+            help='share of recipes given a placeholder image'
+        )
+        parser.add_argument('--batch-size', type=int, default=5000,
+                            help='recipes inserted per transaction')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--email-prefix', default='seed')
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.rng = random.Random(options['seed'])
+        self.start = time.monotonic()
+        self.rows = 0
+        # SQLite's own limit on rows per INSERT must not be overridden
+        self.insert_batch = None if connection.vendor == 'sqlite' \
+            else options['batch_size']
+        prefix = f'{options["email_prefix"]}-{options["seed"]}-'
+        users = get_user_model().objects.filter(email__startswith=prefix)
+        if users.exists():
+            raise CommandError(f'Users {prefix}* exist, pick another '
+                               '--seed or --email-prefix')
+
+        users = self.create_users(prefix)
+        exponent = options['zipf_exponent']
+        counts = {
+            field: zipf_counts(self.rng, len(users),
+                               options[f'max_{field}'], exponent)
+            for field in ('tags', 'ingredients', 'recipes')
+        }
+        images = self.placeholders() if options['images'] else []
+
+        image_uses = Counter()
+        pending = []
+        for index, user_id in enumerate(users):
+            tag_ids = self.create_named(Tag, user_id, counts['tags'][index])
+            ingredient_ids = self.create_named(
+                Ingredient, user_id, counts['ingredients'][index]
+            )
+            for item in self.recipes(user_id, counts['recipes'][index],
+                                     tag_ids, ingredient_ids, images):
+                image_uses[item.get('image')] += 1
+                pending.append(item)
+                if len(pending) >= options['batch_size']:
+                    self.flush(pending)
+        self.flush(pending)
+        self.count_image_uses(images, image_uses)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Seeded {len(users)} users, {self.rows} rows in '
+            f'{time.monotonic() - self.start:.1f}s'
+        ))
+
+    def progress(self, rows):
+        self.rows += rows
+        rate = self.rows / max(time.monotonic() - self.start, 1e-6)
+        self.stdout.write(f'{self.rows} rows, {rate:.0f} rows/s')
+
+    def create_users(self, prefix):
+        '''create the users, all with the password "password"'''
+        password = make_password('password')
+        users = [get_user_model()(email=f'{prefix}{n}@example.com',
+                                  name=f'Seed User {n}', password=password)
+                 for n in range(self.options['users'])]
+        with transaction.atomic():
+            insert_returning_ids(get_user_model(), users, self.insert_batch)
+        self.progress(len(users))
+
+        return [user.pk for user in users]
+
+    def create_named(self, model, user_id, count):
+        '''create count uniquely named tags or ingredients for a user'''
+        words = TAGS if model is Tag else INGREDIENTS
+        objs = [model(user_id=user_id,
+                      name=f'{self.rng.choice(ADJECTIVES)} '
+                           f'{self.rng.choice(words)} {n}')
+                for n in range(count)]
+        with transaction.atomic():
+            insert_returning_ids(model, objs, self.insert_batch)
+        self.rows += len(objs)
+
+        return [obj.pk for obj in objs]
+
+    def recipes(self, user_id, count, tag_ids, ingredient_ids, images):
+        '''yield count recipe items with Zipf weighted links'''
+        exponent = self.options['zipf_exponent']
+        tag_weights = zipf_weights(len(tag_ids), exponent)
+        ingredient_weights = zipf_weights(len(ingredient_ids), exponent)
+        rng = self.rng
+        for n in range(count):
+            item = {
+                'user_id': user_id,
+                'title': f'{rng.choice(ADJECTIVES)} '
+                         f'{rng.choice(INGREDIENTS)} {rng.choice(DISHES)}',
+                'time_minutes': rng.randint(5, 180),
+                'price': f'{rng.randint(1, 60)}.{rng.choice((0, 50, 99))}',
+                'link': f'https://example.com/recipes/{user_id}/{n}',
+                'tags': rng.choices(tag_ids, cum_weights=tag_weights,
+                                    k=self.options['tags_per_recipe']),
+                'ingredients': rng.choices(
+                    ingredient_ids, cum_weights=ingredient_weights,
+                    k=self.options['ingredients_per_recipe']
+                ),
+            }
+            if images and rng.random() < self.options['images']:
+                item['image'] = rng.choice(images)
+            yield item
+
+    def flush(self, pending):
+        '''insert the pending recipes with their links and search index'''
+        if not pending:
+            return
+        links = sum(len(set(item['tags'])) + len(set(item['ingredients']))
+                    for item in pending)
+        bulk_create_recipes(None, pending, self.insert_batch)
+        self.progress(len(pending) + links)
+        pending.clear()
+
+    def placeholders(self):
+        '''store a few solid colour JPEGs to share between recipes'''
+        names = []
+        for n in range(PLACEHOLDERS):
+            colour = tuple(self.rng.randrange(256) for _ in range(3))
+            buffer = BytesIO()
+            Image.new('RGB', (640, 480), colour).save(buffer, 'JPEG')
+            names.append(imagestore.store(
+                ContentFile(buffer.getvalue(), name=f'placeholder-{n}.jpg')
+            ))
+
+        return names
+
+    def count_image_uses(self, images, uses):
+        '''take one reference per recipe using each placeholder'''
+        for name in images:
+            if uses[name]:
+                StoredImage.objects.filter(name=name) \
+                    .update(ref_count=F('ref_count') + uses[name] - 1)
+            else:
+                imagestore.release(name)
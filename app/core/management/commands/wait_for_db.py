@@ -1,20 +1,57 @@
+import random
 import time
-from django.db import connections
+
+from django.db import DEFAULT_DB_ALIAS
 from django.db.utils import OperationalError
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
+
+from core.health import check_database, pending_migrations
 
 
 class Command(BaseCommand):
     '''command to pause execution until db is available'''
 
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+        parser.add_argument('--timeout', type=float, default=60,
+                            help='seconds to wait before giving up')
+        parser.add_argument('--max-delay', type=float, default=5,
+                            help='longest pause between attempts')
+        parser.add_argument(
+            '--wait-for-migrations', action='store_true',
+            help='also wait until every migration has been applied'
+        )
+
     def handle(self, *args, **options):
         self.stdout.write('Waiting for database')
-        db_conn = None
-        while not db_conn:
+        deadline = time.monotonic() + options['timeout']
+        delay = 0.1
+        while True:
             try:
-                db_conn = connections['default']
-            except OperationalError:
-                self.stdout.write('db unavailable waiting 1s')
-                time.sleep(1)
+                latency = check_database(options['database'])
+                if options['wait_for_migrations']:
+                    pending = pending_migrations(options['database'])
+                    if pending:
+                        raise OperationalError(
+                            f'{len(pending)} migrations pending'
+                        )
+                break
+            except OperationalError as exc:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise CommandError(
+                        f'Database unavailable after {options["timeout"]}s: '
+                        f'{exc}'
+                    )
+                # full jitter keeps restarting containers from retrying
+                # in lockstep
+                pause = min(random.uniform(0, delay), remaining)
+                self.stdout.write(
+                    f'db unavailable ({exc}), waiting {pause:.2f}s'
+                )
+                time.sleep(pause)
+                delay = min(delay * 2, options['max_delay'])
 
-        self.stdout.write(self.style.SUCCESS('Database available!'))
+        self.stdout.write(self.style.SUCCESS(
+            f'Database available! ({latency:.1f}ms)'
+        ))
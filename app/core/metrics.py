@@ -0,0 +1,372 @@
+'''Prometheus metrics, served in the text format by core.views.metrics
+
+Values live in process memory, or with METRICS_MULTIPROC_DIR set, in a
+memory-mapped file per process in that directory. Each process writes only
+its own files and a scrape sums them all, so whichever worker answers
+sees the totals of every worker. Updates take one short per-process lock.
+Gauges of exited processes are dropped by mark_process_dead, and their
+counters and histograms are folded into one file of totals for all
+exited processes, so the directory does not grow as workers recycle.
+'''
+import glob
+import json
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+from collections import defaultdict
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100)
+
+_registry = []
+
+
+class _MemoryValues:
+    '''float values by key, for a single process'''
+
+    def __init__(self):
+        self._values = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def inc(self, key, amount):
+        with self._lock:
+            self._values[key] += amount
+
+    def set(self, key, value):
+        with self._lock:
+            self._values[key] = value
+
+    def items(self):
+        with self._lock:
+            return list(self._values.items())
+
+
+class _MappedValues:
+    '''float values by key in a file that only this process writes
+
+    The file starts with the number of bytes in use, followed by entries
+    of a key length, the key padded to 8 bytes and a double. New entries
+    are written before the used length moves past them, so readers in
+    other processes never see half an entry.
+    '''
+
+    def __init__(self, path, size=64 * 1024):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, 'a+b')
+        if os.fstat(self._file.fileno()).st_size < size:
+            self._file.truncate(size)
+        self._map = mmap.mmap(self._file.fileno(),
+                              os.fstat(self._file.fileno()).st_size)
+        self._used = struct.unpack_from('<i', self._map, 0)[0] or 8
+        struct.pack_into('<i', self._map, 0, self._used)
+        self._offsets = {key: offset for key, offset, _
+                         in _entries(self._map, self._used)}
+
+    def _offset(self, key):
+        '''the offset of key's value, adding the key if new'''
+        offset = self._offsets.get(key)
+        if offset is not None:
+            return offset
+
+        encoded = key.encode()
+        padding = b' ' * ((8 - (4 + len(encoded)) % 8) % 8)
+        entry = struct.pack(f'<i{len(encoded) + len(padding)}sd',
+                            len(encoded), encoded + padding, 0.0)
+        while self._used + len(entry) > len(self._map):
+            self._map.close()
+            self._file.truncate(os.fstat(self._file.fileno()).st_size * 2)
+            self._map = mmap.mmap(self._file.fileno(),
+                                  os.fstat(self._file.fileno()).st_size)
+        self._map[self._used:self._used + len(entry)] = entry
+        self._used += len(entry)
+        struct.pack_into('<i', self._map, 0, self._used)
+        self._offsets[key] = offset = self._used - 8
+
+        return offset
+
+    def inc(self, key, amount):
+        with self._lock:
+            offset = self._offset(key)
+            value = struct.unpack_from('<d', self._map, offset)[0]
+            struct.pack_into('<d', self._map, offset, value + amount)
+
+    def set(self, key, value):
+        with self._lock:
+            struct.pack_into('<d', self._map, self._offset(key), value)
+
+    def items(self):
+        with self._lock:
+            return [(key, value) for key, _, value
+                    in _entries(self._map, self._used)]
+
+    def close(self):
+        with self._lock:
+            self._map.close()
+            self._file.close()
+
+
+def _entries(data, used):
+    '''yield (key, value offset, value) for each entry in a values file'''
+    offset = 8
+    while offset < used:
+        length = struct.unpack_from('<i', data, offset)[0]
+        key = bytes(data[offset + 4:offset + 4 + length]).decode()
+        offset += 4 + length + (8 - (4 + length) % 8) % 8
+        yield key, offset, struct.unpack_from('<d', data, offset)[0]
+        offset += 8
+
+
+def _read_file(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    if len(data) < 8:
+        return []
+
+    used = min(struct.unpack_from('<i', data, 0)[0], len(data))
+    return [(key, value) for key, _, value in _entries(data, used)]
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def _store(kind):
+    '''the values of this process for one kind of metric'''
+    directory = settings.METRICS_MULTIPROC_DIR
+    key = (kind, os.getpid(), directory)
+    store = _stores.get(key)
+    if store is None:
+        with _stores_lock:
+            store = _stores.get(key)
+            if store is None:
+                store = _stores[key] = _MappedValues(
+                    os.path.join(directory, f'{kind}_{os.getpid()}.db')
+                ) if directory else _MemoryValues()
+
+    return store
+
+
+def collect():
+    '''the summed value of every sample of every process, by key'''
+    totals = defaultdict(float)
+    directory = settings.METRICS_MULTIPROC_DIR
+    if directory:
+        samples = (sample
+                   for path in glob.glob(os.path.join(directory, '*.db'))
+                   for sample in _read_file(path))
+    else:
+        samples = (sample for (kind, pid, _), store in list(_stores.items())
+                   if pid == os.getpid() for sample in store.items())
+    for key, value in samples:
+        totals[key] += value
+
+    return totals
+
+
+def mark_process_dead(pid, directory):
+    '''forget the gauges of a process that exited, keeping its totals
+
+    Its counters and histograms are added to the {kind}_dead.db files,
+    which only the process calling this writes.
+    '''
+    for path in glob.glob(os.path.join(directory, f'gauge_{pid}.db')):
+        os.remove(path)
+    for kind in ('counter', 'histogram'):
+        path = os.path.join(directory, f'{kind}_{pid}.db')
+        if not os.path.exists(path):
+            continue
+        totals = _MappedValues(os.path.join(directory, f'{kind}_dead.db'))
+        try:
+            for key, value in _read_file(path):
+                totals.inc(key, value)
+        finally:
+            totals.close()
+        os.remove(path)
+
+
+class Metric:
+    '''a named metric with labels, registered for exposition'''
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        _registry.append(self)
+
+    def _key(self, suffix, labels, *extra):
+        labels = [[name, str(labels[name])] for name in self.labelnames]
+        return json.dumps([self.name, suffix, labels + list(extra)])
+
+    def _inc(self, suffix, labels, amount, *extra):
+        _store(self.kind).inc(self._key(suffix, labels, *extra), amount)
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        self._inc('', labels, amount)
+
+
+class Gauge(Metric):
+    '''a value summed over the live processes'''
+    kind = 'gauge'
+
+    def inc(self, amount=1, **labels):
+        self._inc('', labels, amount)
+
+    def dec(self, amount=1, **labels):
+        self._inc('', labels, -amount)
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(),
+                 buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets) + (math.inf,)
+
+    def observe(self, value, **labels):
+        bucket = next(bound for bound in self.buckets if value <= bound)
+        self._inc('_bucket', labels, 1, ['le', _format(bucket)])
+        self._inc('_sum', labels, value)
+        self._inc('_count', labels, 1)
+
+
+def _format(value):
+    if value == math.inf:
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+
+    return repr(float(value))
+
+
+def _escape(value):
+    return value.replace('\\', r'\\').replace('\n', r'\n') \
+        .replace('"', r'\"')
+
+
+def _sample(name, labels, value):
+    if labels:
+        pairs = ','.join(f'{label}="{_escape(text)}"'
+                         for label, text in labels)
+        name = f'{name}{{{pairs}}}'
+
+    return f'{name} {_format(value)}'
+
+
+def exposition():
+    '''every registered metric in the Prometheus text format'''
+    samples = defaultdict(list)
+    for key, value in collect().items():
+        name, suffix, labels = json.loads(key)
+        samples[name].append((suffix, labels, value))
+
+    lines = []
+    for metric in _registry:
+        lines.append(f'# HELP {metric.name} {metric.documentation}')
+        lines.append(f'# TYPE {metric.name} {metric.kind}')
+        if isinstance(metric, Histogram):
+            lines.extend(_histogram_lines(metric, samples[metric.name]))
+        else:
+            lines.extend(_sample(metric.name, labels, value)
+                         for _, labels, value
+                         in sorted(samples[metric.name]))
+
+    return '\n'.join(lines) + '\n'
+
+
+def _histogram_lines(metric, samples):
+    '''cumulative buckets, sum and count for each set of labels'''
+    series = defaultdict(dict)
+    for suffix, labels, value in samples:
+        if suffix == '_bucket':
+            *labels, (_, bound) = labels
+            series[json.dumps(labels)][bound] = value
+        else:
+            series[json.dumps(labels)][suffix] = value
+
+    for labels, values in sorted(series.items()):
+        labels = [tuple(pair) for pair in json.loads(labels)]
+        count = 0
+        for bound in metric.buckets:
+            count += values.get(_format(bound), 0)
+            yield _sample(f'{metric.name}_bucket',
+                          labels + [('le', _format(bound))], count)
+        yield _sample(f'{metric.name}_sum', labels, values.get('_sum', 0))
+        yield _sample(f'{metric.name}_count', labels,
+                      values.get('_count', 0))
+
+
+REQUESTS = Counter('http_requests_total', 'Requests answered.',
+                   ('view', 'method', 'status'))
+LATENCY = Histogram('http_request_duration_seconds',
+                    'Time to produce a response.', ('view', 'method'))
+IN_FLIGHT = Gauge('http_requests_in_flight', 'Requests being handled.')
+QUERIES = Histogram('http_request_db_queries',
+                    'Database queries run per request.', ('view',),
+                    buckets=QUERY_BUCKETS)
+AUTH_CACHE = Counter('auth_token_cache_lookups_total',
+                     'Token cache lookups by tier that answered them.',
+                     ('result',))
+RESPONSE_CACHE = Counter(
+    'http_conditional_requests_total',
+    'Conditional GETs answered 304 (hit) or with a new body (miss).',
+    ('view', 'result')
+)
+RENDITION_QUEUE = Gauge('image_rendition_jobs',
+                        'Rendition jobs queued or running.')
+
+
+class _QueryCounter:
+    '''execute wrapper counting the queries run'''
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class MetricsMiddleware:
+    '''count requests by view and status, and time them'''
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        queries = _QueryCounter()
+        start = time.perf_counter()
+        IN_FLIGHT.inc()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(queries))
+                response = self.get_response(request)
+        finally:
+            IN_FLIGHT.dec()
+
+        match = request.resolver_match
+        view = match.view_name if match else 'unmatched'
+        REQUESTS.inc(view=view, method=request.method,
+                     status=response.status_code)
+        LATENCY.observe(time.perf_counter() - start, view=view,
+                        method=request.method)
+        QUERIES.observe(queries.count, view=view)
+
+        return response
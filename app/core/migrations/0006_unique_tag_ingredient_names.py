@@ -0,0 +1,51 @@
+from django.db import migrations
+from django.db.models.functions import Lower
+
+
+def merge_duplicate_names(apps, schema_editor):
+    '''fold rows whose names differ only by case into the oldest one'''
+    Recipe = apps.get_model('core', 'Recipe')
+    for model_name, field in (('Tag', 'tags'), ('Ingredient', 'ingredients')):
+        model = apps.get_model('core', model_name)
+        through = getattr(Recipe, field).through
+        column = f'{model_name.lower()}_id'
+
+        keep = {}
+        duplicates = {}
+        rows = model.objects.annotate(lower_name=Lower('name')) \
+            .order_by('id').values_list('id', 'user_id', 'lower_name')
+        for pk, user_id, lower_name in rows:
+            key = (user_id, lower_name)
+            if key in keep:
+                duplicates[pk] = keep[key]
+            else:
+                keep[key] = pk
+
+        for duplicate, original in duplicates.items():
+            linked = through.objects.filter(**{column: original}) \
+                .values('recipe_id')
+            through.objects.filter(**{column: duplicate}) \
+                .exclude(recipe_id__in=linked) \
+                .update(**{column: original})
+            model.objects.filter(pk=duplicate).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_recipe_image'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_names, migrations.RunPython.noop),
+        migrations.RunSQL(
+            ['CREATE UNIQUE INDEX core_tag_user_lower_name_uniq '
+             'ON core_tag (user_id, lower(name))'],
+            ['DROP INDEX core_tag_user_lower_name_uniq'],
+        ),
+        migrations.RunSQL(
+            ['CREATE UNIQUE INDEX core_ingredient_user_lower_name_uniq '
+             'ON core_ingredient (user_id, lower(name))'],
+            ['DROP INDEX core_ingredient_user_lower_name_uniq'],
+        ),
+    ]
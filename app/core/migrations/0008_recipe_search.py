@@ -0,0 +1,79 @@
+import django.contrib.postgres.search
+from django.conf import settings
+from django.db import migrations
+
+
+# the search documents as this migration builds them; core.search keeps
+# the current definitions, which may change in later migrations
+POSTGRES_BACKFILL_SQL = '''
+    UPDATE core_recipe SET search_vector =
+    setweight(to_tsvector(%(config)s::regconfig, core_recipe.title), 'A') ||
+    setweight(to_tsvector(%(config)s::regconfig, coalesce(
+        (SELECT string_agg(item.name, ' ') FROM core_recipe_tags link
+         JOIN core_tag item ON item.id = link.tag_id
+         WHERE link.recipe_id = core_recipe.id), '')), 'B') ||
+    setweight(to_tsvector(%(config)s::regconfig, coalesce(
+        (SELECT string_agg(item.name, ' ') FROM core_recipe_ingredients link
+         JOIN core_ingredient item ON item.id = link.ingredient_id
+         WHERE link.recipe_id = core_recipe.id), '')), 'B')
+'''
+
+SQLITE_CREATE_SQL = (
+    'CREATE VIRTUAL TABLE IF NOT EXISTS core_recipe_fts '
+    "USING fts5(title, tags, ingredients, tokenize='porter unicode61')"
+)
+
+SQLITE_BACKFILL_SQL = '''
+    INSERT INTO core_recipe_fts(rowid, title, tags, ingredients)
+    SELECT core_recipe.id, core_recipe.title,
+        coalesce((SELECT group_concat(item.name, ' ')
+                  FROM core_recipe_tags link
+                  JOIN core_tag item ON item.id = link.tag_id
+                  WHERE link.recipe_id = core_recipe.id), ''),
+        coalesce((SELECT group_concat(item.name, ' ')
+                  FROM core_recipe_ingredients link
+                  JOIN core_ingredient item ON item.id = link.ingredient_id
+                  WHERE link.recipe_id = core_recipe.id), '')
+    FROM core_recipe
+'''
+
+
+def create_search_index(apps, schema_editor):
+    '''build the full-text index for the connected backend'''
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute(
+                'CREATE INDEX core_recipe_search_vector_gin '
+                'ON core_recipe USING gin (search_vector)'
+            )
+            cursor.execute(POSTGRES_BACKFILL_SQL,
+                           {'config': settings.RECIPE_SEARCH_CONFIG})
+        elif connection.vendor == 'sqlite':
+            cursor.execute(SQLITE_CREATE_SQL)
+            cursor.execute(SQLITE_BACKFILL_SQL)
+
+
+def drop_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('DROP INDEX core_recipe_search_vector_gin')
+        elif connection.vendor == 'sqlite':
+            cursor.execute('DROP TABLE core_recipe_fts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_list_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
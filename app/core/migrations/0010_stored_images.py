@@ -0,0 +1,36 @@
+# Generated by Django 2.1.15 on 2026-10-18 17:29
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def count_existing_images(apps, schema_editor):
+    '''start counting references to images uploaded before this migration'''
+    Recipe = apps.get_model('core', 'Recipe')
+    StoredImage = apps.get_model('core', 'StoredImage')
+    counts = Recipe.objects.exclude(image__isnull=True).exclude(image='') \
+        .values('image').annotate(refs=Count('id'))
+    StoredImage.objects.bulk_create(
+        StoredImage(name=row['image'], ref_count=row['refs'])
+        for row in counts
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_recipe_image_renditions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StoredImage',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('ref_count', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(count_existing_images,
+                             migrations.RunPython.noop),
+    ]
@@ -1,6 +1,7 @@
 import uuid
 import os
 from django.db import models
+from django.contrib.postgres.search import SearchVectorField
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager, \
     PermissionsMixin
 from django.conf import settings
@@ -14,6 +15,14 @@ def recipe_image_file_path(instance, filename):
     return os.path.join('uploads/recipe/', filename)
 
 
+def recipe_rendition_file_path(instance, filename):
+    '''generate a file path for a resized copy of a recipe image'''
+    ext = filename.split('.')[-1]
+    filename = f'{uuid.uuid4()}.{ext}'
+
+    return os.path.join('uploads/recipe/renditions/', filename)
+
+
 class UserManager(BaseUserManager):
 
     def create_user(self, email, password=None, **extra_fields):
@@ -48,11 +57,20 @@ class User(AbstractBaseUser, PermissionsMixin):
     USERNAME_FIELD = 'email'
 
 
+# Tag and Ingredient names are unique per user ignoring case, enforced by
+# the (user_id, lower(name)) indexes added in migration 0006
 class Tag(models.Model):
     'tag for recipe'
     name = models.CharField(max_length=255)
     user = models.ForeignKey(settings.AUTH_USER_MODEL,
                              on_delete=models.CASCADE)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'name']),
+            models.Index(fields=['user', 'updated_at']),
+        ]
 
     def __str__(self):
         return self.name
@@ -63,6 +81,13 @@ class Ingredient(models.Model):
     name = models.CharField(max_length=255)
     user = models.ForeignKey(settings.AUTH_USER_MODEL,
                              on_delete=models.CASCADE)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'name']),
+            models.Index(fields=['user', 'updated_at']),
+        ]
 
     def __str__(self):
         return self.name
@@ -79,6 +104,66 @@ class Recipe(models.Model):
     ingredients = models.ManyToManyField('Ingredient')
     tags = models.ManyToManyField('Tag')
     image = models.ImageField(null=True, upload_to=recipe_image_file_path)
+    # maintained by core.search, only populated on Postgres
+    search_vector = SearchVectorField(null=True, editable=False)
+    # also moved when its tags, ingredients or renditions change, see
+    # core.signals
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'id']),
+            models.Index(fields=['user', 'updated_at']),
+        ]
 
     def __str__(self):
         return self.title
+
+
+class StoredImage(models.Model):
+    '''reference count of a content-addressed recipe image file
+
+    Recipes with identical image bytes share one file, named after its
+    hash by core.imagestore. The file is removed once no recipe uses it.
+    '''
+    name = models.CharField(max_length=255, unique=True)
+    ref_count = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return self.name
+
+
+class RecipeImageRendition(models.Model):
+    '''resized copy of a recipe image in one size and format'''
+    recipe = models.ForeignKey('Recipe', on_delete=models.CASCADE,
+                               related_name='renditions')
+    size = models.CharField(max_length=20)
+    format = models.CharField(max_length=10)
+    image = models.ImageField(upload_to=recipe_rendition_file_path)
+    width = models.PositiveIntegerField()
+    height = models.PositiveIntegerField()
+
+    class Meta:
+        unique_together = ('recipe', 'size', 'format')
+
+    def __str__(self):
+        return f'{self.recipe_id} {self.size} {self.format}'
+
+
+class ImportCheckpoint(models.Model):
+    '''rows of an import file loaded so far, see import_recipes
+
+    Written in the transaction that inserts each batch, so a resumed
+    import never loads a batch twice or skips one.
+    '''
+    user = models.ForeignKey(settings.AUTH_USER_MODEL,
+                             on_delete=models.CASCADE)
+    name = models.CharField(max_length=255)
+    rows = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('user', 'name')
+
+    def __str__(self):
+        return f'{self.name}: {self.rows} rows'
@@ -0,0 +1,165 @@
+'''profile single requests end to end on demand
+
+With PROFILING['ENABLED'] off the middleware removes itself at startup
+and costs nothing. When on, a request is profiled if it carries an
+X-Profile header made by the profile_header command for a staff user,
+or if it is drawn at PROFILING['SAMPLE_RATE']. The profile is written to
+PROFILING['DIR'] as a pstats file, or as speedscope JSON with the
+optional pyinstrument profiler, and only the newest PROFILING['KEEP']
+profiles are kept. Requests that asked with the header get the file
+name back in X-Profile-Id.
+'''
+import cProfile
+import os
+import random
+import re
+import time
+from datetime import datetime
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core import signing
+from django.core.exceptions import ImproperlyConfigured, MiddlewareNotUsed
+
+
+HEADER = 'HTTP_X_PROFILE'
+SALT = 'core.profiling'
+
+
+def sign_user(user):
+    '''the X-Profile header value that lets user profile requests'''
+    return signing.TimestampSigner(salt=SALT).sign(str(user.pk))
+
+
+def signed_staff(value):
+    '''whether value is a current header value signed for a staff user'''
+    try:
+        pk = signing.TimestampSigner(salt=SALT).unsign(
+            value, max_age=settings.PROFILING['HEADER_MAX_AGE']
+        )
+    except signing.BadSignature:
+        return False
+
+    return get_user_model().objects.filter(
+        pk=pk, is_staff=True, is_active=True
+    ).exists()
+
+
+class _CProfile:
+    extension = 'prof'
+
+    def __init__(self):
+        self.profiler = cProfile.Profile()
+
+    def start(self):
+        self.profiler.enable()
+
+    def stop(self):
+        self.profiler.disable()
+
+    def write(self, path):
+        self.profiler.dump_stats(path)
+
+
+class _Pyinstrument:
+    extension = 'speedscope.json'
+
+    def __init__(self):
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            raise ImproperlyConfigured(
+                "PROFILING['PROFILER'] 'pyinstrument' needs pyinstrument"
+            )
+        self.profiler = Profiler()
+
+    def start(self):
+        self.profiler.start()
+
+    def stop(self):
+        self.profiler.stop()
+
+    def write(self, path):
+        from pyinstrument.renderers import SpeedscopeRenderer
+        with open(path, 'w') as f:
+            f.write(self.profiler.output(SpeedscopeRenderer()))
+
+
+PROFILERS = {'cprofile': _CProfile, 'pyinstrument': _Pyinstrument}
+
+
+class ProfilingMiddleware:
+    '''profile requests that ask for it, or a sampled share of them
+
+    Install it first in MIDDLEWARE so the profile covers the others.
+    '''
+
+    def __init__(self, get_response):
+        config = settings.PROFILING
+        if not config['ENABLED']:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        self.profiler_class = PROFILERS[config['PROFILER']]
+        self.directory = config['DIR']
+        os.makedirs(self.directory, exist_ok=True)
+
+    def __call__(self, request):
+        requested = self.requested(request)
+        if not requested and \
+                random.random() >= settings.PROFILING['SAMPLE_RATE']:
+            return self.get_response(request)
+
+        profiler = self.profiler_class()
+        start = time.perf_counter()
+        profiler.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            profiler.stop()
+
+        elapsed = (time.perf_counter() - start) * 1000
+        name = self.write(request, profiler, elapsed)
+        # sampled requests may come from anyone; the name tells of views,
+        # pids and timings
+        if requested:
+            response['X-Profile-Id'] = name
+
+        return response
+
+    def requested(self, request):
+        '''whether the request carries a valid X-Profile header'''
+        value = request.META.get(HEADER)
+        return bool(value) and signed_staff(value)
+
+    def write(self, request, profiler, elapsed):
+        '''save the profile and drop the oldest past the retention count'''
+        match = request.resolver_match
+        label = match.view_name if match else request.path
+        label = re.sub(r'[^\w.-]+', '-', label).strip('-')[:60]
+        name = '{}-{}-{}-{:.0f}ms-{}.{}'.format(
+            datetime.utcnow().strftime('%Y%m%dT%H%M%S%f'), request.method,
+            label, elapsed, os.getpid(), profiler.extension
+        )
+        profiler.write(os.path.join(self.directory, name))
+
+        self.prune()
+        return name
+
+    def prune(self):
+        '''delete all but the newest profiles, leaving other files be'''
+        extensions = tuple(f'.{profiler.extension}'
+                           for profiler in PROFILERS.values())
+        profiles = []
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith(extensions):
+                continue
+            try:
+                profiles.append((entry.stat().st_mtime, entry.path))
+            except FileNotFoundError:
+                continue
+        profiles.sort(reverse=True)
+        for _, path in profiles[settings.PROFILING['KEEP']:]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,152 @@
+'''N+1 and slow query detection for development and CI
+
+QueryCheckMiddleware records every query a request runs. Requests that
+repeat one query shape, the same SQL apart from its parameters and the
+length of IN lists, QUERY_CHECK['REPEAT_THRESHOLD'] times or more, or run
+a query slower than QUERY_CHECK['SLOW_MS'], are appended to the
+QUERY_CHECK['REPORT'] file as a JSON line with EXPLAIN output for the slow
+SELECTs. With QUERY_CHECK['RAISE'] the request also fails with
+QueryCheckFailed, so a test suite run with it fails on regressions.
+'''
+import json
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import DatabaseError, connections
+
+
+IN_LIST = re.compile(r'IN \(%s(?:, %s)*\)')
+
+_report_lock = threading.Lock()
+
+
+class QueryCheckFailed(AssertionError):
+    '''raised for requests with repeated or slow queries'''
+
+
+def query_shape(sql):
+    '''sql with IN lists of any length written the same way'''
+    return IN_LIST.sub('IN (...)', sql)
+
+
+class QueryLog:
+    '''execute wrapper recording the queries run on one connection'''
+
+    def __init__(self, alias):
+        self.alias = alias
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append({
+                'sql': sql,
+                'params': params,
+                'many': many,
+                'ms': (time.perf_counter() - start) * 1000,
+            })
+
+    def repeated(self, threshold):
+        '''(shape, count) of each shape run at least threshold times'''
+        counts = Counter(query_shape(query['sql']) for query in self.queries)
+        return [(shape, count) for shape, count in counts.most_common()
+                if count >= threshold]
+
+    def slow(self, slow_ms):
+        return [query for query in self.queries if query['ms'] >= slow_ms]
+
+    def explain(self, query):
+        '''the plan of a slow SELECT as text, or None'''
+        if query['many'] or \
+                not query['sql'].lstrip().upper().startswith('SELECT'):
+            return None
+        connection = connections[self.alias]
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f'{connection.ops.explain_query_prefix()} {query["sql"]}',
+                    query['params']
+                )
+                return '\n'.join(' '.join(str(column) for column in row)
+                                 for row in cursor.fetchall())
+        except DatabaseError as exc:
+            return f'EXPLAIN failed: {exc}'
+
+
+class QueryCheckMiddleware:
+    '''report requests with N+1 query patterns or slow queries'''
+
+    def __init__(self, get_response):
+        if not settings.QUERY_CHECK['ENABLED']:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+
+    def __call__(self, request):
+        logs = [QueryLog(connection.alias)
+                for connection in connections.all()]
+        with ExitStack() as stack:
+            for log in logs:
+                stack.enter_context(
+                    connections[log.alias].execute_wrapper(log)
+                )
+            response = self.get_response(request)
+
+        problems = self.check(logs)
+        if problems:
+            self.report(request, response, problems)
+            if settings.QUERY_CHECK['RAISE']:
+                raise QueryCheckFailed(self.describe(request, problems))
+
+        return response
+
+    def check(self, logs):
+        '''the repeated and slow queries of the request, by database'''
+        config = settings.QUERY_CHECK
+        problems = []
+        for log in logs:
+            repeated = log.repeated(config['REPEAT_THRESHOLD'])
+            slow = log.slow(config['SLOW_MS'])
+            if not repeated and not slow:
+                continue
+            problems.append({
+                'database': log.alias,
+                'queries': len(log.queries),
+                'repeated': [{'sql': shape, 'count': count}
+                             for shape, count in repeated],
+                'slow': [{'sql': query['sql'],
+                          'ms': round(query['ms'], 1),
+                          'explain': log.explain(query)}
+                         for query in slow],
+            })
+
+        return problems
+
+    def report(self, request, response, problems):
+        match = request.resolver_match
+        line = json.dumps({
+            'method': request.method,
+            'path': request.path,
+            'view': match.view_name if match else None,
+            'status': response.status_code,
+            'problems': problems,
+        })
+        with _report_lock, \
+                open(settings.QUERY_CHECK['REPORT'], 'a') as report:
+            report.write(line + '\n')
+
+    def describe(self, request, problems):
+        lines = [f'{request.method} {request.path} ran:']
+        for problem in problems:
+            lines.extend(f'  {item["count"]}x {item["sql"]}'
+                         for item in problem['repeated'])
+            lines.extend(f'  {item["ms"]}ms {item["sql"]}'
+                         for item in problem['slow'])
+
+        return '\n'.join(lines)
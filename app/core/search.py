@@ -0,0 +1,181 @@
+'''full-text search over recipe titles and their tag and ingredient names
+
+Postgres keeps a weighted tsvector in Recipe.search_vector behind a GIN
+index. SQLite, used for local and test runs, keeps the same documents in
+the core_recipe_fts FTS5 table. Either way the index is refreshed for
+just the recipes that changed, see core.signals.
+'''
+import re
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.models import BigIntegerField, ExpressionWrapper, F, Func, \
+    Value
+from django.db.models.expressions import RawSQL
+
+
+# names of a recipe's tags or ingredients, space separated
+_NAMES_SQL = '''(SELECT {agg} FROM core_recipe_{field} link
+    JOIN core_{model} item ON item.id = link.{model}_id
+    WHERE link.recipe_id = core_recipe.id)'''
+
+POSTGRES_DOCUMENT_SQL = '''
+    setweight(to_tsvector(%(config)s::regconfig, core_recipe.title), 'A') ||
+    setweight(to_tsvector(%(config)s::regconfig, coalesce({tags}, '')), 'B') ||
+    setweight(to_tsvector(%(config)s::regconfig,
+                          coalesce({ingredients}, '')), 'B')
+'''.format(
+    tags=_NAMES_SQL.format(agg="string_agg(item.name, ' ')", field='tags',
+                           model='tag'),
+    ingredients=_NAMES_SQL.format(agg="string_agg(item.name, ' ')",
+                                  field='ingredients', model='ingredient'),
+)
+
+SQLITE_DOCUMENT_SQL = '''
+    SELECT core_recipe.id, core_recipe.title,
+           coalesce({tags}, ''), coalesce({ingredients}, '')
+    FROM core_recipe
+'''.format(
+    tags=_NAMES_SQL.format(agg="group_concat(item.name, ' ')", field='tags',
+                           model='tag'),
+    ingredients=_NAMES_SQL.format(agg="group_concat(item.name, ' ')",
+                                  field='ingredients', model='ingredient'),
+)
+
+
+# ids stay below this, so folding one into a rank keeps it unique
+RANK_ID_SPAN = 10 ** 10
+
+
+class ScaledRank(Func):
+    '''rank as an integer, so cursor positions compare exactly'''
+    template = 'CAST(%(expressions)s * 1000000 AS bigint)'
+    output_field = BigIntegerField()
+
+
+def _unique_rank(rank):
+    '''scaled rank with the recipe id in its low digits
+
+    Equal ranks then still order by id, and each is a distinct cursor
+    position, so pages of tied results never fall back to offsets.
+    '''
+    return ExpressionWrapper(
+        ScaledRank(rank) * Value(RANK_ID_SPAN) + F('id'),
+        output_field=BigIntegerField()
+    )
+
+
+def _placeholders(ids):
+    return ', '.join(['%s'] * len(ids))
+
+
+def _fts_match(text):
+    '''quote each word so user input is never parsed as FTS5 syntax'''
+    words = re.findall(r'\w+', text)
+    return ' '.join('"{}"'.format(word) for word in words)
+
+
+_deferred = threading.local()
+
+
+@contextmanager
+def deferred_indexing():
+    '''index the recipes changed inside the block once, as it ends
+
+    Saving a recipe and setting its tags and ingredients each reindex it,
+    so writes that do several of these run inside this. Recipes are
+    indexed on the database each change was made on.
+    '''
+    if getattr(_deferred, 'ids', None) is not None:
+        yield
+        return
+    _deferred.ids = defaultdict(set)
+    try:
+        yield
+        pending = _deferred.ids
+    finally:
+        _deferred.ids = None
+    for using, recipe_ids in pending.items():
+        index_recipes(sorted(recipe_ids), using)
+
+
+def index_recipes(recipe_ids, using=None):
+    '''rebuild the search documents of the given recipes'''
+    recipe_ids = list(recipe_ids)
+    if not recipe_ids:
+        return
+    using = using or DEFAULT_DB_ALIAS
+    if getattr(_deferred, 'ids', None) is not None:
+        _deferred.ids[using].update(recipe_ids)
+        return
+    conn = connections[using]
+    with conn.cursor() as cursor:
+        if conn.vendor == 'postgresql':
+            cursor.execute(
+                'UPDATE core_recipe SET search_vector = '
+                f'{POSTGRES_DOCUMENT_SQL} '
+                'WHERE core_recipe.id = ANY(%(ids)s)',
+                {'config': settings.RECIPE_SEARCH_CONFIG, 'ids': recipe_ids}
+            )
+        elif conn.vendor == 'sqlite':
+            marks = _placeholders(recipe_ids)
+            cursor.execute(
+                f'DELETE FROM core_recipe_fts WHERE rowid IN ({marks})',
+                recipe_ids
+            )
+            cursor.execute(
+                'INSERT INTO core_recipe_fts'
+                '(rowid, title, tags, ingredients) '
+                f'{SQLITE_DOCUMENT_SQL} WHERE core_recipe.id IN ({marks})',
+                recipe_ids
+            )
+
+
+def remove_recipes(recipe_ids, using=None):
+    '''drop deleted recipes from the search index'''
+    recipe_ids = list(recipe_ids)
+    conn = connections[using or DEFAULT_DB_ALIAS]
+    if recipe_ids and conn.vendor == 'sqlite':
+        with conn.cursor() as cursor:
+            cursor.execute(
+                'DELETE FROM core_recipe_fts WHERE rowid IN '
+                f'({_placeholders(recipe_ids)})',
+                recipe_ids
+            )
+
+
+def search_recipes(queryset, text):
+    '''filter queryset to recipes matching text, annotated with a rank
+
+    Higher ranks are better matches, ties broken by the higher id.
+    Backends without a full-text index fall back to a case-insensitive
+    title match with a constant rank.
+    '''
+    vendor = connections[queryset.db].vendor
+    if vendor == 'postgresql':
+        query = SearchQuery(text, config=settings.RECIPE_SEARCH_CONFIG)
+        return queryset.annotate(
+            rank=_unique_rank(SearchRank(F('search_vector'), query))
+        ).filter(search_vector=query)
+
+    if vendor == 'sqlite':
+        match = _fts_match(text)
+        if not match:
+            return queryset.none()
+        # bm25() scores better matches lower, weighted to favour titles;
+        # the subquery is NULL for recipes that do not match
+        rank = RawSQL(
+            'SELECT -bm25(core_recipe_fts, 4.0, 1.0, 1.0) '
+            'FROM core_recipe_fts WHERE core_recipe_fts MATCH %s '
+            'AND core_recipe_fts.rowid = core_recipe.id',
+            (match,)
+        )
+        return queryset.annotate(rank=_unique_rank(rank)) \
+            .filter(rank__isnull=False)
+
+    return queryset.annotate(rank=_unique_rank(Value(1))) \
+        .filter(title__icontains=text)
@@ -0,0 +1,107 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, \
+    pre_delete
+from django.dispatch import receiver
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from core import imagestore, search
+from core.authentication import evict_user_tokens, token_cache
+from core.models import Tag, Ingredient, Recipe, RecipeImageRendition
+
+
+@receiver(post_delete, sender=Token)
+def revoke_deleted_token(sender, instance, **kwargs):
+    '''stop authenticating with a token as soon as it is deleted'''
+    token_cache.evict(instance.key)
+
+
+@receiver(post_save, sender=get_user_model())
+def refresh_cached_user(sender, instance, created, **kwargs):
+    '''drop cached copies of a user when it changes or is deactivated'''
+    if not created:
+        evict_user_tokens(instance.pk)
+
+
+@receiver(post_save, sender=Recipe)
+def index_saved_recipe(sender, instance, using, **kwargs):
+    '''refresh the search document of a created or edited recipe'''
+    search.index_recipes([instance.pk], using)
+
+
+@receiver(post_delete, sender=Recipe)
+def unindex_deleted_recipe(sender, instance, using, **kwargs):
+    '''drop a deleted recipe from the search index'''
+    search.remove_recipes([instance.pk], using)
+
+
+@receiver(post_delete, sender=Recipe)
+def release_deleted_recipe_image(sender, instance, **kwargs):
+    '''give up a deleted recipe's reference to its image'''
+    imagestore.release(instance.image.name)
+
+
+def _recipes_changed(recipe_ids, using):
+    '''reindex recipes and move their updated_at after a related change'''
+    recipe_ids = list(recipe_ids)
+    if recipe_ids:
+        search.index_recipes(recipe_ids, using)
+        Recipe.objects.using(using).filter(id__in=recipe_ids) \
+            .update(updated_at=timezone.now())
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def index_relinked_recipes(sender, instance, action, reverse, pk_set,
+                           using, **kwargs):
+    '''refresh recipes whose tags or ingredients were changed'''
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            _recipes_changed([instance.pk], using)
+        return
+
+    # changed from the tag or ingredient side: pk_set holds recipe ids,
+    # except on clear where they are collected before the links go
+    if action == 'pre_clear':
+        instance._search_recipe_ids = _linked_recipe_ids(instance)
+    elif action == 'post_clear':
+        _recipes_changed(instance.__dict__.pop('_search_recipe_ids', []),
+                         using)
+    elif action in ('post_add', 'post_remove'):
+        _recipes_changed(pk_set, using)
+
+
+def _linked_recipe_ids(instance):
+    '''ids of recipes linked to a tag or ingredient'''
+    return list(instance.recipe_set.values_list('id', flat=True))
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_save, sender=Ingredient)
+def index_renamed_recipes(sender, instance, created, using, **kwargs):
+    '''refresh recipes that show a renamed tag or ingredient'''
+    if not created:
+        _recipes_changed(_linked_recipe_ids(instance), using)
+
+
+@receiver(pre_delete, sender=Tag)
+@receiver(pre_delete, sender=Ingredient)
+def collect_unlinked_recipes(sender, instance, **kwargs):
+    '''remember recipes that lose a deleted tag or ingredient'''
+    instance._search_recipe_ids = _linked_recipe_ids(instance)
+
+
+@receiver(post_delete, sender=Tag)
+@receiver(post_delete, sender=Ingredient)
+def index_unlinked_recipes(sender, instance, using, **kwargs):
+    '''refresh recipes that lost a deleted tag or ingredient'''
+    _recipes_changed(instance.__dict__.pop('_search_recipe_ids', []),
+                     using)
+
+
+@receiver(post_delete, sender=RecipeImageRendition)
+def delete_rendition_file(sender, instance, **kwargs):
+    '''remove a rendition's file once its row is gone for good'''
+    storage, name = instance.image.storage, instance.image.name
+    transaction.on_commit(lambda: storage.delete(name))
@@ -0,0 +1,115 @@
+import asyncio
+import threading
+
+from django.test import SimpleTestCase
+
+from core.asgi import ThreadPoolASGIHandler
+
+
+def echo_app(environ, start_response):
+    '''return the request body back in two chunks'''
+    body = environ['wsgi.input'].read()
+    start_response('201 Created', [('Content-Type', 'text/plain'),
+                                   ('X-Path', environ['PATH_INFO'])])
+    return [body[:1], b'', body[1:]]
+
+
+async def request(handler, scope, messages):
+    '''run handler for scope with the given request messages'''
+    sent = []
+    pending = list(messages)
+
+    async def receive():
+        return pending.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    await handler(scope, receive, send)
+    return sent
+
+
+def call(handler, scope, messages):
+    return asyncio.get_event_loop().run_until_complete(
+        request(handler, scope, messages)
+    )
+
+
+def http_scope(path='/', headers=()):
+    return {'type': 'http', 'method': 'POST', 'path': path,
+            'query_string': b'', 'headers': list(headers)}
+
+
+class ThreadPoolASGIHandlerTests(SimpleTestCase):
+
+    def test_body_and_response_chunks(self):
+        '''body chunks are joined and response chunks sent as produced'''
+        handler = ThreadPoolASGIHandler(echo_app, max_workers=1)
+        sent = call(handler, http_scope('/echo/'), [
+            {'type': 'http.request', 'body': b'ab', 'more_body': True},
+            {'type': 'http.request', 'body': b'c'},
+        ])
+
+        self.assertEqual(sent[0]['status'], 201)
+        self.assertIn((b'x-path', b'/echo/'), sent[0]['headers'])
+        self.assertEqual([message.get('body') for message in sent[1:]],
+                         [b'a', b'bc', None])
+
+    def test_disconnect_before_body(self):
+        '''the application is not run for clients that went away'''
+        def app(environ, start_response):
+            raise AssertionError('application called')
+
+        handler = ThreadPoolASGIHandler(app, max_workers=1)
+        sent = call(handler, http_scope(), [
+            {'type': 'http.request', 'body': b'a', 'more_body': True},
+            {'type': 'http.disconnect'},
+        ])
+
+        self.assertEqual(sent, [])
+
+    def test_body_too_large(self):
+        '''bodies over the cap get a 413 without running the application'''
+        handler = ThreadPoolASGIHandler(echo_app, max_workers=1,
+                                        max_body_size=3)
+        declared = call(handler, http_scope(headers=[
+            (b'content-length', b'4')
+        ]), [])
+        streamed = call(handler, http_scope(), [
+            {'type': 'http.request', 'body': b'ab', 'more_body': True},
+            {'type': 'http.request', 'body': b'cd'},
+        ])
+
+        self.assertEqual(declared[0]['status'], 413)
+        self.assertEqual(streamed[0]['status'], 413)
+
+    def test_requests_run_concurrently(self):
+        '''requests share the pool instead of queueing behind each other'''
+        barrier = threading.Barrier(2, timeout=5)
+
+        def app(environ, start_response):
+            barrier.wait()
+            start_response('200 OK', [])
+            return [b'ok']
+
+        handler = ThreadPoolASGIHandler(app, max_workers=2)
+        messages = [{'type': 'http.request', 'body': b''}]
+        responses = asyncio.get_event_loop().run_until_complete(
+            asyncio.gather(request(handler, http_scope(), messages),
+                           request(handler, http_scope(), messages))
+        )
+
+        self.assertEqual([sent[0]['status'] for sent in responses],
+                         [200, 200])
+
+    def test_lifespan(self):
+        '''startup and shutdown are acknowledged'''
+        handler = ThreadPoolASGIHandler(echo_app, max_workers=1)
+        sent = call(handler, {'type': 'lifespan'}, [
+            {'type': 'lifespan.startup'},
+            {'type': 'lifespan.shutdown'},
+        ])
+
+        self.assertEqual([message['type'] for message in sent], [
+            'lifespan.startup.complete', 'lifespan.shutdown.complete'
+        ])
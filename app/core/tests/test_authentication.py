@@ -0,0 +1,181 @@
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.test import TestCase
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.test import APIClient
+
+from core.authentication import CachedTokenAuthentication, TokenCache, \
+    dump_user, evict_user_tokens, token_cache
+
+
+ME_URL = reverse('user:me')
+
+
+class CachedTokenAuthenticationTests(TestCase):
+    '''test token lookups are cached and revoked'''
+
+    def setUp(self):
+        token_cache.clear()
+        self.user = get_user_model().objects.create_user(
+            'tester@test.com',
+            'password'
+        )
+        self.token = Token.objects.create(user=self.user)
+        self.auth = CachedTokenAuthentication()
+
+    def test_second_lookup_skips_database(self):
+        '''test a cached token authenticates without queries'''
+        self.auth.authenticate_credentials(self.token.key)
+
+        with self.assertNumQueries(0):
+            user, token = self.auth.authenticate_credentials(self.token.key)
+
+        self.assertEqual(user, self.user)
+        self.assertEqual(token.key, self.token.key)
+        self.assertEqual(token_cache.stats()['hits'], 1)
+        self.assertEqual(token_cache.stats()['misses'], 1)
+
+    def test_cached_user_is_a_private_copy(self):
+        '''test callers cannot mutate the cached user'''
+        user, _ = self.auth.authenticate_credentials(self.token.key)
+        user.name = 'changed'
+
+        user, _ = self.auth.authenticate_credentials(self.token.key)
+
+        self.assertEqual(user.name, '')
+
+    def test_deleted_token_is_revoked(self):
+        '''test deleting a token stops it authenticating immediately'''
+        key = self.token.key
+        self.auth.authenticate_credentials(key)
+        self.token.delete()
+
+        with self.assertRaises(AuthenticationFailed):
+            self.auth.authenticate_credentials(key)
+
+    def test_deactivated_user_is_revoked(self):
+        '''test deactivating a user stops its token authenticating'''
+        self.auth.authenticate_credentials(self.token.key)
+        self.user.is_active = False
+        self.user.save()
+
+        with self.assertRaises(AuthenticationFailed):
+            self.auth.authenticate_credentials(self.token.key)
+
+    def test_cached_inactive_user_refused(self):
+        '''test a cached copy of an inactive user does not authenticate'''
+        self.auth.authenticate_credentials(self.token.key)
+        self.user.is_active = False
+        token_cache.set(self.token.key, dump_user(self.user))
+
+        with self.assertRaises(AuthenticationFailed):
+            self.auth.authenticate_credentials(self.token.key)
+
+    def test_user_updated_in_bulk_is_revoked(self):
+        '''test evicting after update() stops the token authenticating'''
+        self.auth.authenticate_credentials(self.token.key)
+        get_user_model().objects.filter(pk=self.user.pk) \
+            .update(is_active=False)
+        evict_user_tokens(self.user.pk)
+
+        with self.assertRaises(AuthenticationFailed):
+            self.auth.authenticate_credentials(self.token.key)
+
+    def test_password_hash_not_cached(self):
+        '''test the cache keeps the user without its password hash'''
+        self.auth.authenticate_credentials(self.token.key)
+
+        self.assertNotIn(self.user.password,
+                         token_cache.get(self.token.key)[1])
+        user, _ = self.auth.authenticate_credentials(self.token.key)
+        self.assertIn('password', user.get_deferred_fields())
+        self.assertTrue(user.check_password('password'))
+
+    def test_me_endpoint_uses_cache(self):
+        '''test the manage user view authenticates through the cache'''
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        client.get(ME_URL)
+
+        with self.assertNumQueries(0):
+            res = client.get(ME_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['email'], self.user.email)
+
+    def test_me_update_reads_current_user(self):
+        '''test an update starts from the stored user, not the cached one'''
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        client.get(ME_URL)
+        get_user_model().objects.filter(pk=self.user.pk) \
+            .update(name='Changed elsewhere')
+
+        res = client.patch(ME_URL, {'password': 'newpassword'})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.name, 'Changed elsewhere')
+        self.assertTrue(self.user.check_password('newpassword'))
+
+
+class TokenCacheTests(TestCase):
+    '''test the token cache tiers'''
+
+    def test_least_recently_used_evicted(self):
+        '''test the local tier is bounded'''
+        cache = TokenCache(max_size=2, ttl=60)
+        cache.set('a', 'user a')
+        cache.set('b', 'user b')
+        cache.get('a')
+        cache.set('c', 'user c')
+
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), 'user a')
+        self.assertEqual(cache.stats()['size'], 2)
+
+    def test_entries_expire(self):
+        '''test local entries are dropped after the ttl'''
+        cache = TokenCache(max_size=2, ttl=60)
+        with patch('core.authentication.time.monotonic') as clock:
+            clock.return_value = 100
+            cache.set('a', 'user a')
+            clock.return_value = 161
+
+            self.assertIsNone(cache.get('a'))
+
+    def test_shared_tier(self):
+        '''test a miss in one process is served from the shared tier'''
+        writer = TokenCache(max_size=2, ttl=60, shared_cache='default')
+        reader = TokenCache(max_size=2, ttl=60, shared_cache='default')
+        writer.set('a', 'user a')
+
+        self.assertEqual(reader.get('a'), 'user a')
+        self.assertEqual(reader.stats()['shared_hits'], 1)
+
+        writer.evict('a')
+        self.assertIsNone(reader.get('a'))
+
+    def test_revocation_reaches_other_processes(self):
+        '''test a local copy is dropped once another process evicts it'''
+        shared = caches['default']
+        self.addCleanup(shared.clear)
+        first = TokenCache(max_size=2, ttl=60, shared_cache='default')
+        second = TokenCache(max_size=2, ttl=60, shared_cache='default')
+        first.set('a', 'user a')
+        self.assertEqual(second.get('a'), 'user a')
+        self.assertEqual(second.get('a'), 'user a')
+        self.assertEqual(second.stats()['hits'], 1)
+
+        first.evict('a')
+        self.assertIsNone(second.get('a'))
+
+        first.set('a', 'user a changed')
+        second.set('a', 'user a')
+        self.assertEqual(first.get('a'), 'user a')
@@ -1,23 +1,298 @@
+import json
+import os
+import tempfile
+from decimal import Decimal
+from io import StringIO
 from unittest.mock import patch
 
+from django.contrib.auth import get_user_model
 from django.core.management import call_command
+from django.core.management.base import CommandError
 from django.db.utils import OperationalError
-from django.test import TestCase
+from django.test import TestCase, override_settings
+
+from core.bulk import bulk_create_recipes
+from core.health import check_database, pending_migrations
+from core.models import ImportCheckpoint, Ingredient, Recipe, \
+    StoredImage, Tag
 
 
 class CommandTests(TestCase):
 
     def test_wait_for_db_ready(self):
         '''test waiting for db when db is available'''
-        with patch('django.db.utils.ConnectionHandler.__getitem__') as gi:
-            gi.return_value = True
-            call_command('wait_for_db')
-            self.assertEqual(gi.call_count, 1)
+        with patch('core.management.commands.wait_for_db.check_database') \
+                as check:
+            check.return_value = 1.5
+            call_command('wait_for_db', stdout=StringIO())
+            self.assertEqual(check.call_count, 1)
 
     @patch('time.sleep', return_value=True)
     def test_wait_for_db(self, ts):
         '''test waiting for db'''
-        with patch('django.db.utils.ConnectionHandler.__getitem__') as gi:
-            gi.side_effect = [OperationalError] * 5 + [True]
-            call_command('wait_for_db')
-            self.assertEqual(gi.call_count, 6)
+        with patch('core.management.commands.wait_for_db.check_database') \
+                as check:
+            check.side_effect = [OperationalError] * 5 + [1.5]
+            call_command('wait_for_db', stdout=StringIO())
+            self.assertEqual(check.call_count, 6)
+
+    @patch('time.sleep', return_value=True)
+    def test_wait_for_db_backoff(self, ts):
+        '''test pauses grow exponentially up to the maximum, with jitter'''
+        with patch('core.management.commands.wait_for_db.check_database') \
+                as check, patch('random.uniform', side_effect=lambda a, b: b):
+            check.side_effect = [OperationalError] * 8 + [1.5]
+            call_command('wait_for_db', '--max-delay', '1', stdout=StringIO())
+
+        pauses = [call[0][0] for call in ts.call_args_list]
+        self.assertEqual(pauses, [0.1, 0.2, 0.4, 0.8, 1, 1, 1, 1])
+
+    @patch('time.sleep', return_value=True)
+    def test_wait_for_db_timeout(self, ts):
+        '''test giving up once the timeout has passed'''
+        with patch('core.management.commands.wait_for_db.check_database') \
+                as check, patch('time.monotonic', side_effect=[0, 5, 11]):
+            check.side_effect = OperationalError('refused')
+            with self.assertRaises(CommandError):
+                call_command('wait_for_db', '--timeout', '10',
+                             stdout=StringIO())
+
+        self.assertEqual(check.call_count, 2)
+
+    @patch('time.sleep', return_value=True)
+    def test_wait_for_migrations(self, ts):
+        '''test waiting until no migrations are pending'''
+        module = 'core.management.commands.wait_for_db'
+        with patch(f'{module}.check_database', return_value=1.5), \
+                patch(f'{module}.pending_migrations') as pending:
+            pending.side_effect = [['core.0011_updated_at'], []]
+            call_command('wait_for_db', '--wait-for-migrations',
+                         stdout=StringIO())
+
+        self.assertEqual(pending.call_count, 2)
+
+    def test_check_database(self):
+        '''test the probe runs a real query'''
+        self.assertGreaterEqual(check_database(), 0)
+        self.assertEqual(pending_migrations(), [])
+
+
+class ImportRecipesTests(TestCase):
+    '''test bulk importing recipes from export files'''
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'tester@test.com',
+            'password'
+        )
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+
+    def write(self, name, content):
+        path = os.path.join(self.dir.name, name)
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def run_import(self, path, *args):
+        out, err = StringIO(), StringIO()
+        call_command('import_recipes', path, '--user', self.user.email,
+                     *args, stdout=out, stderr=err)
+        return out.getvalue(), err.getvalue()
+
+    def test_import_ndjson(self):
+        '''test importing NDJSON resolves tag and ingredient names'''
+        Tag.objects.create(user=self.user, name='Vegan')
+        rows = [
+            {'title': 'Curry', 'time_minutes': 30, 'price': '7.50',
+             'tags': ['vegan', 'Hot'], 'ingredients': ['Rice']},
+            {'title': 'Toast', 'time_minutes': 2, 'price': '1.00',
+             'link': 'http://x.test', 'tags': ['Hot']},
+        ]
+        path = self.write('book.ndjson',
+                          '\n'.join(json.dumps(row) for row in rows))
+
+        out, _ = self.run_import(path, '--batch-size', '1')
+
+        curry = Recipe.objects.get(user=self.user, title='Curry')
+        self.assertEqual(curry.price, Decimal('7.50'))
+        self.assertEqual(sorted(t.name for t in curry.tags.all()),
+                         ['Hot', 'Vegan'])
+        self.assertEqual(curry.ingredients.get().name, 'Rice')
+        self.assertEqual(Tag.objects.filter(user=self.user).count(), 2)
+        self.assertEqual(
+            Recipe.objects.get(title='Toast').link, 'http://x.test'
+        )
+        self.assertIn('rows/s', out)
+        self.assertIn('Imported 2 recipes', out)
+
+    def test_import_csv_skips_invalid_rows(self):
+        '''test invalid CSV rows are reported and skipped'''
+        path = self.write(
+            'book.csv',
+            'id,title,time_minutes,price,link,tags,ingredients\n'
+            '1,Curry,30,7.50,,Vegan; Hot,Rice\n'
+            '2,Broken,soon,1.00,,,\n'
+        )
+
+        out, err = self.run_import(path)
+
+        recipe = Recipe.objects.get(user=self.user)
+        self.assertEqual(recipe.title, 'Curry')
+        self.assertEqual(recipe.tags.count(), 2)
+        self.assertIn('Row 2 skipped', err)
+        self.assertIn('1 skipped', out)
+
+    def test_import_ndjson_skips_malformed_lines(self):
+        '''test bad JSON, non-objects and long names skip only their row'''
+        path = self.write('book.ndjson', '\n'.join([
+            json.dumps({'title': 'Curry', 'time_minutes': 30,
+                        'price': '7.50'}),
+            '{"title": "Broken',
+            '',
+            '["not", "an", "object"]',
+            json.dumps({'title': 'Toast', 'time_minutes': 2,
+                        'price': '1.00', 'tags': ['x' * 256]}),
+            json.dumps({'title': 'Soup', 'time_minutes': 5,
+                        'price': '2.00', 'tags': 'Hot'}),
+            json.dumps({'title': 'Salad', 'time_minutes': 5,
+                        'price': '3.00'}),
+        ]))
+
+        out, err = self.run_import(path)
+
+        self.assertEqual(
+            sorted(Recipe.objects.values_list('title', flat=True)),
+            ['Curry', 'Salad']
+        )
+        self.assertIn('Row 2 skipped (line 2): [\'Invalid JSON', err)
+        self.assertIn('Row 3 skipped (line 4)', err)
+        self.assertIn('Row 4 skipped (line 5)', err)
+        self.assertIn('Row 5 skipped (line 6)', err)
+        self.assertFalse(Tag.objects.exists())
+        self.assertIn('4 skipped', out)
+
+    def test_resume_from_checkpoint(self):
+        '''test --resume skips the rows the checkpoint records'''
+        path = self.write('book.ndjson', '\n'.join(
+            json.dumps({'title': f'Soup {i}', 'time_minutes': 5,
+                        'price': '2.00'})
+            for i in range(5)
+        ))
+        ImportCheckpoint.objects.create(user=self.user, name='book', rows=3)
+
+        self.run_import(path, '--resume', '--checkpoint', 'book')
+
+        self.assertEqual(
+            sorted(Recipe.objects.values_list('title', flat=True)),
+            ['Soup 3', 'Soup 4']
+        )
+        self.assertEqual(ImportCheckpoint.objects.get(name='book').rows, 5)
+
+    def test_checkpoint_commits_with_batch(self):
+        '''test a batch that fails leaves the checkpoint before it'''
+        path = self.write('book.ndjson', '\n'.join(
+            json.dumps({'title': f'Soup {i}', 'time_minutes': 5,
+                        'price': '2.00'})
+            for i in range(4)
+        ))
+        real = bulk_create_recipes
+        calls = []
+
+        def fail_second_batch(*args, **kwargs):
+            calls.append(1)
+            recipes = real(*args, **kwargs)
+            if len(calls) == 2:
+                raise OperationalError('connection lost')
+            return recipes
+
+        with patch('core.management.commands.import_recipes.'
+                   'bulk_create_recipes', side_effect=fail_second_batch):
+            with self.assertRaises(OperationalError):
+                self.run_import(path, '--batch-size', '2')
+        self.run_import(path, '--batch-size', '2', '--resume')
+
+        self.assertEqual(
+            sorted(Recipe.objects.values_list('title', flat=True)),
+            [f'Soup {i}' for i in range(4)]
+        )
+        checkpoint = ImportCheckpoint.objects.get(user=self.user)
+        self.assertEqual(checkpoint.name, path)
+        self.assertEqual(checkpoint.rows, 4)
+
+    def test_unknown_user(self):
+        '''test importing for an unknown user fails'''
+        path = self.write('book.ndjson', '')
+
+        with self.assertRaises(CommandError):
+            call_command('import_recipes', path, '--user', 'no@test.com')
+
+
+class SeedDataTests(TestCase):
+    '''test generating synthetic data'''
+
+    def seed(self, *args):
+        out = StringIO()
+        call_command('seed_data', '--users', '5', '--max-recipes', '20',
+                     '--max-tags', '4', '--max-ingredients', '6', *args,
+                     stdout=out)
+        return out.getvalue()
+
+    def dataset(self, prefix):
+        recipes = Recipe.objects.filter(user__email__startswith=prefix) \
+            .order_by('pk').prefetch_related('tags', 'ingredients')
+        return [(recipe.title, recipe.time_minutes, recipe.price,
+                 sorted(tag.name for tag in recipe.tags.all()),
+                 sorted(i.name for i in recipe.ingredients.all()))
+                for recipe in recipes]
+
+    def test_seed_creates_linked_data(self):
+        '''test seeding creates users with linked recipes'''
+        out = self.seed('--seed', '1')
+
+        users = get_user_model().objects.filter(email__startswith='seed-1-')
+        self.assertEqual(users.count(), 5)
+        self.assertTrue(users[0].check_password('password'))
+        recipes = Recipe.objects.filter(user__in=users)
+        # Zipf counts: 20 / rank for ranks 1 to 5
+        self.assertEqual(recipes.count(), 20 + 10 + 7 + 5 + 4)
+        self.assertEqual(Tag.objects.filter(user__in=users).count(),
+                         4 + 2 + 1 + 1 + 1)
+        self.assertEqual(Ingredient.objects.count(), 6 + 3 + 2 + 2 + 1)
+        for recipe in recipes.prefetch_related('tags', 'ingredients'):
+            self.assertTrue(1 <= len(recipe.tags.all()) <= 3)
+            self.assertTrue(1 <= len(recipe.ingredients.all()) <= 8)
+            for tag in recipe.tags.all():
+                self.assertEqual(tag.user_id, recipe.user_id)
+        self.assertIn('Seeded 5 users', out)
+
+    def test_same_seed_same_data(self):
+        '''test the same seed produces the same data'''
+        self.seed('--seed', '2', '--email-prefix', 'one')
+        self.seed('--seed', '2', '--email-prefix', 'two')
+        self.seed('--seed', '3', '--email-prefix', 'three')
+
+        self.assertEqual(self.dataset('one-'), self.dataset('two-'))
+        self.assertNotEqual(self.dataset('one-'), self.dataset('three-'))
+
+    def test_existing_users_refused(self):
+        '''test seeding refuses to reuse existing users'''
+        self.seed()
+
+        with self.assertRaises(CommandError):
+            self.seed()
+
+    def test_placeholder_images_counted(self):
+        '''test placeholder images are reference counted'''
+        with tempfile.TemporaryDirectory() as media, \
+                override_settings(MEDIA_ROOT=media):
+            self.seed('--images', '0.5')
+
+            used = Recipe.objects.exclude(image='')
+            images = StoredImage.objects.all()
+            self.assertTrue(used.exists())
+            self.assertEqual(sum(image.ref_count for image in images),
+                             used.count())
+            for image in images:
+                self.assertEqual(used.filter(image=image.name).count(),
+                                 image.ref_count)
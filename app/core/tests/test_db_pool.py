@@ -0,0 +1,264 @@
+import importlib.util
+import threading
+import unittest
+from unittest.mock import patch
+
+from django.test import SimpleTestCase
+
+from core.db.pool import ConnectionPool, PoolTimeout
+
+
+class FakeConnection:
+    '''stand-in for a driver connection'''
+
+    def __init__(self, number):
+        self.number = number
+        self.closed = False
+        self.usable = True
+
+    def close(self):
+        self.closed = True
+
+
+class Clock:
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class ConnectionPoolTests(SimpleTestCase):
+    '''test the driver independent connection pool'''
+
+    def setUp(self):
+        self.opened = []
+        self.clock = Clock()
+
+    def connect(self):
+        conn = FakeConnection(len(self.opened))
+        self.opened.append(conn)
+        return conn
+
+    def make_pool(self, max_size=2, **kwargs):
+        kwargs.setdefault('check', lambda conn: conn.usable)
+        return ConnectionPool(max_size, clock=self.clock, **kwargs)
+
+    def test_reuses_returned_connections(self):
+        '''test returned connections are checked out again'''
+        pool = self.make_pool()
+        conn = pool.get(self.connect)
+        pool.put(conn)
+
+        self.assertIs(pool.get(self.connect), conn)
+        self.assertEqual(len(self.opened), 1)
+        stats = pool.stats()
+        self.assertEqual(stats['checkouts'], 2)
+        self.assertEqual(stats['connects'], 1)
+        self.assertEqual(stats['in_use'], 1)
+
+    def test_reuses_newest_first(self):
+        '''test the most recently returned connection is reused'''
+        pool = self.make_pool()
+        first, second = pool.get(self.connect), pool.get(self.connect)
+        pool.put(first)
+        pool.put(second)
+
+        self.assertIs(pool.get(self.connect), second)
+
+    def test_unusable_connection_replaced(self):
+        '''test an unusable idle connection is closed and replaced'''
+        pool = self.make_pool()
+        conn = pool.get(self.connect)
+        pool.put(conn)
+        conn.usable = False
+
+        replacement = pool.get(self.connect)
+
+        self.assertIsNot(replacement, conn)
+        self.assertTrue(conn.closed)
+        self.assertEqual(pool.stats()['reconnects'], 1)
+        self.assertEqual(pool.stats()['size'], 1)
+
+    def test_idle_connections_expire(self):
+        '''test connections idle past the timeout are closed'''
+        pool = self.make_pool(idle_timeout=60)
+        conn = pool.get(self.connect)
+        pool.put(conn)
+        self.clock.now = 61
+
+        self.assertIsNot(pool.get(self.connect), conn)
+        self.assertTrue(conn.closed)
+        self.assertEqual(pool.stats()['expired'], 1)
+
+    def test_failed_reset_discards(self):
+        '''test a connection that fails to reset is discarded'''
+        def reset(conn):
+            raise RuntimeError('broken')
+
+        pool = self.make_pool(reset=reset)
+        conn = pool.get(self.connect)
+        pool.put(conn)
+
+        self.assertTrue(conn.closed)
+        self.assertEqual(pool.stats()['size'], 0)
+        self.assertEqual(pool.stats()['discarded'], 1)
+
+    def test_failed_connect_frees_slot(self):
+        '''test a failed connect does not hold a pool slot'''
+        pool = self.make_pool(max_size=1)
+
+        def refuse():
+            raise ConnectionError
+
+        with self.assertRaises(ConnectionError):
+            pool.get(refuse)
+        self.assertIsNotNone(pool.get(self.connect))
+
+    def test_waits_for_free_connection(self):
+        '''test checkout waits for a connection to be returned'''
+        pool = ConnectionPool(1, timeout=5)
+        conn = pool.get(self.connect)
+        threading.Timer(0.05, pool.put, [conn]).start()
+
+        self.assertIs(pool.get(self.connect), conn)
+        self.assertEqual(pool.stats()['waits'], 1)
+
+    def test_checkout_timeout(self):
+        '''test checkout gives up when the pool stays full'''
+        pool = ConnectionPool(1, timeout=0.05)
+        pool.get(self.connect)
+
+        with self.assertRaises(PoolTimeout):
+            pool.get(self.connect)
+        self.assertEqual(pool.stats()['timeouts'], 1)
+
+    def test_close_all(self):
+        '''test closing the pool closes idle connections'''
+        pool = self.make_pool()
+        conn = pool.get(self.connect)
+        pool.put(conn)
+
+        pool.close_all()
+
+        self.assertTrue(conn.closed)
+        self.assertEqual(pool.stats()['size'], 0)
+
+
+@unittest.skipUnless(importlib.util.find_spec('psycopg2'),
+                     'psycopg2 is not installed')
+class PooledBackendTests(SimpleTestCase):
+    '''test the Postgres backend hands connections to and from its pool'''
+
+    def make_wrapper(self):
+        from core.db.backends.postgresql.base import DatabaseWrapper
+        return DatabaseWrapper({
+            'NAME': 'pooltest', 'USER': 'u', 'PASSWORD': '', 'HOST': 'h',
+            'PORT': '', 'OPTIONS': {}, 'CONN_MAX_AGE': 0,
+            'AUTOCOMMIT': True, 'TIME_ZONE': None, 'HEALTH_CHECKS': False,
+            'POOL': {'MAX_SIZE': 2},
+        }, alias='pooltest')
+
+    def test_connections_return_to_pool(self):
+        '''test backend close returns the connection to the pool'''
+        from django.db.backends.postgresql import base
+        from psycopg2 import extensions
+        conn = FakeConnection(0)
+        conn.isolation_level = None
+        conn.get_transaction_status = \
+            lambda: extensions.TRANSACTION_STATUS_IDLE
+        with patch.object(base.DatabaseWrapper, 'get_new_connection',
+                          return_value=conn):
+            first = self.make_wrapper()
+            pool = first.pool
+            self.assertIs(first.get_new_connection({}), conn)
+            first.connection = conn
+            first._close()
+            second = self.make_wrapper()
+
+            self.assertIs(second.get_new_connection({}), conn)
+        self.assertEqual(pool.stats()['connects'], 1)
+
+
+class PsycopgConnection:
+    '''stand-in for a psycopg2 connection that tracks transactions'''
+
+    def __init__(self):
+        self.closed = 0
+        self.isolation_level = None
+        self.in_transaction = False
+        self.queries = []
+        self._autocommit = False
+
+    @property
+    def autocommit(self):
+        return self._autocommit
+
+    @autocommit.setter
+    def autocommit(self, value):
+        from psycopg2 import ProgrammingError
+        if self.in_transaction:
+            raise ProgrammingError(
+                'set_session cannot be used inside a transaction'
+            )
+        self._autocommit = value
+
+    def cursor(self):
+        conn = self
+
+        class Cursor:
+
+            def execute(self, sql, params=None):
+                conn.queries.append(sql)
+                if not conn.autocommit:
+                    conn.in_transaction = True
+
+        return Cursor()
+
+    def set_client_encoding(self, encoding):
+        pass
+
+    def get_parameter_status(self, name):
+        return 'UTC'
+
+
+@unittest.skipUnless(importlib.util.find_spec('psycopg2'),
+                     'psycopg2 is not installed')
+class HealthCheckBackendTests(SimpleTestCase):
+    '''test the Postgres backend health checks'''
+
+    def make_wrapper(self):
+        from core.db.backends.postgresql.base import DatabaseWrapper
+        return DatabaseWrapper({
+            'NAME': 'checktest', 'USER': 'u', 'PASSWORD': '', 'HOST': 'h',
+            'PORT': '', 'OPTIONS': {}, 'CONN_MAX_AGE': 60,
+            'AUTOCOMMIT': True, 'TIME_ZONE': None, 'HEALTH_CHECKS': True,
+            'POOL': {'MAX_SIZE': 0},
+        }, alias='checktest')
+
+    def test_new_connection_not_checked(self):
+        '''test connecting sets autocommit without a health check'''
+        from django.db.backends.postgresql import base
+        conn = PsycopgConnection()
+        wrapper = self.make_wrapper()
+        with patch.object(base.Database, 'connect', return_value=conn):
+            wrapper.ensure_connection()
+
+        self.assertIs(wrapper.connection, conn)
+        self.assertTrue(conn.autocommit)
+        self.assertEqual(conn.queries, [])
+
+    def test_persistent_connection_checked_once(self):
+        '''test a reused connection is checked once per request'''
+        from django.db.backends.postgresql import base
+        conn = PsycopgConnection()
+        wrapper = self.make_wrapper()
+        with patch.object(base.Database, 'connect', return_value=conn):
+            wrapper.ensure_connection()
+            wrapper.close_if_unusable_or_obsolete()
+            wrapper.ensure_connection()
+            wrapper.ensure_connection()
+
+        self.assertIs(wrapper.connection, conn)
+        self.assertEqual(conn.queries, ['SELECT 1'])
@@ -0,0 +1,125 @@
+from io import BytesIO
+from unittest.mock import patch
+
+from PIL import Image
+
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.test import TestCase, override_settings
+
+from core import images
+from core.models import Recipe, RecipeImageRendition
+
+
+RENDITIONS = {'thumb': 100, 'large': 400}
+RENDITION_DIR = 'uploads/recipe/renditions'
+
+
+def jpeg_bytes(width, height):
+    buffer = BytesIO()
+    Image.new('RGB', (width, height), 'orange').save(buffer, 'JPEG')
+    return buffer.getvalue()
+
+
+@override_settings(RECIPE_IMAGE_RENDITIONS=RENDITIONS,
+                   RECIPE_IMAGE_FORMATS=('webp', 'jpeg'))
+class RenditionTests(TestCase):
+    '''test resized recipe image generation'''
+
+    def setUp(self):
+        user = get_user_model().objects.create_user(
+            'tester@test.com',
+            'password'
+        )
+        self.recipe = Recipe.objects.create(
+            user=user,
+            title='Carrot cake',
+            time_minutes=60,
+            price=6.00
+        )
+        self.recipe.image.save('cake.jpg', ContentFile(jpeg_bytes(800, 600)))
+
+    def tearDown(self):
+        # file deletes wait for a commit, which never comes in a TestCase
+        _, names = default_storage.listdir(RENDITION_DIR)
+        for name in names:
+            default_storage.delete(f'{RENDITION_DIR}/{name}')
+        self.recipe.image.delete()
+
+    def test_generate_renditions(self):
+        '''test every size and format is stored with its dimensions'''
+        images.generate_renditions(self.recipe.id)
+
+        renditions = RecipeImageRendition.objects.filter(recipe=self.recipe)
+        self.assertEqual(renditions.count(), 4)
+        thumb = renditions.get(size='thumb', format='webp')
+        self.assertEqual((thumb.width, thumb.height), (100, 75))
+        large = renditions.get(size='large', format='jpeg')
+        self.assertEqual((large.width, large.height), (400, 300))
+        with large.image.open('rb') as f, Image.open(f) as image:
+            self.assertEqual(image.format, 'JPEG')
+            self.assertEqual(image.size, (400, 300))
+
+    def test_regenerate_replaces_renditions(self):
+        '''test generating again leaves one rendition per size and format'''
+        images.generate_renditions(self.recipe.id)
+        images.generate_renditions(self.recipe.id)
+
+        self.assertEqual(
+            RecipeImageRendition.objects.filter(recipe=self.recipe).count(),
+            4
+        )
+
+    def test_webp_skipped_without_encoder(self):
+        '''test a Pillow build without WebP still makes JPEG renditions'''
+        with patch('core.images.features.check', return_value=False):
+            images.generate_renditions(self.recipe.id)
+
+        self.assertEqual(
+            sorted(RecipeImageRendition.objects.filter(recipe=self.recipe)
+                   .values_list('format', flat=True)),
+            ['jpeg', 'jpeg']
+        )
+
+    def test_replaced_image_discards_renditions(self):
+        '''test renditions of an image replaced mid-resize are dropped'''
+        def replace_image(*args, **kwargs):
+            Recipe.objects.filter(pk=self.recipe.pk).update(image='other.jpg')
+            return b'data'
+
+        with patch('core.images._encode', side_effect=replace_image):
+            images.generate_renditions(self.recipe.id)
+
+        self.assertFalse(RecipeImageRendition.objects.exists())
+
+    @override_settings(RECIPE_IMAGE_WORKERS=2)
+    def test_submit_uses_worker_pool(self):
+        '''test renditions are made off the request thread'''
+        with patch('core.images.get_executor') as get_executor, \
+                patch('core.images.generate_renditions') as generate:
+            images.submit_renditions(self.recipe.id)
+
+        get_executor.return_value.submit.assert_called_once_with(
+            images._run_in_worker, self.recipe.id
+        )
+        generate.assert_not_called()
+
+    @override_settings(RECIPE_IMAGE_WORKERS=0)
+    def test_submit_inline_without_workers(self):
+        '''test renditions are made inline when no workers are set'''
+        images.submit_renditions(self.recipe.id)
+
+        self.assertEqual(self.recipe.renditions.count(), 4)
+
+    def test_recipe_exposes_rendition_urls(self):
+        '''test the recipe serializer lists rendition urls and sizes'''
+        from recipe.serializers import RecipeSerializer
+        images.generate_renditions(self.recipe.id)
+
+        data = RecipeSerializer(self.recipe).data
+
+        self.assertEqual(len(data['renditions']), 4)
+        rendition = data['renditions'][0]
+        self.assertTrue(rendition['url'].startswith('/media/uploads/'))
+        self.assertIn('width', rendition)
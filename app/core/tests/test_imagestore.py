@@ -0,0 +1,103 @@
+from io import BytesIO
+
+from PIL import Image
+
+from django.contrib.auth import get_user_model
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase
+
+from core import imagestore
+from core.models import Recipe, StoredImage
+
+
+def png_file(color='red', name='photo.png'):
+    buffer = BytesIO()
+    Image.new('RGB', (8, 8), color).save(buffer, 'PNG')
+    return SimpleUploadedFile(name, buffer.getvalue(), 'image/png')
+
+
+class ImageStoreTests(TestCase):
+    '''test content-addressed image storage'''
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'tester@test.com',
+            'password'
+        )
+        self.names = set()
+
+    def tearDown(self):
+        for name in self.names:
+            default_storage.delete(name)
+
+    def store(self, file):
+        name = imagestore.store(file)
+        self.names.add(name)
+        return name
+
+    def sample_recipe(self, image=None):
+        return Recipe.objects.create(user=self.user, title='Soup',
+                                     time_minutes=5, price=2, image=image)
+
+    def test_name_from_content(self):
+        '''test identical bytes get the same name whatever the filename'''
+        first = self.store(png_file(name='a.png'))
+        second = self.store(png_file(name='b.png'))
+        other = self.store(png_file(color='blue'))
+
+        self.assertEqual(first, second)
+        self.assertNotEqual(first, other)
+        self.assertRegex(first, r'^uploads/recipe/[0-9a-f]{2}/[0-9a-f]{64}'
+                                r'\.png$')
+        self.assertTrue(default_storage.exists(first))
+        self.assertEqual(StoredImage.objects.get(name=first).ref_count, 2)
+
+    def test_streamed_hash_is_used(self):
+        '''test a hash computed while uploading is not recomputed'''
+        file = png_file()
+        file.sha256 = 'ab' * 32
+
+        name = self.store(file)
+
+        self.assertEqual(name, f'uploads/recipe/ab/{"ab" * 32}.png')
+
+    def test_release_keeps_shared_file(self):
+        '''test a file still referenced elsewhere is kept'''
+        name = self.store(png_file())
+        self.store(png_file())
+
+        imagestore.release(name)
+        imagestore.collect(name)
+
+        self.assertTrue(default_storage.exists(name))
+        self.assertEqual(StoredImage.objects.get(name=name).ref_count, 1)
+
+    def test_release_last_reference_deletes_file(self):
+        '''test releasing the last reference deletes the file'''
+        name = self.store(png_file())
+
+        imagestore.release(name)
+        imagestore.collect(name)
+
+        self.assertFalse(default_storage.exists(name))
+        self.assertFalse(StoredImage.objects.filter(name=name).exists())
+
+    def test_store_after_release_keeps_file(self):
+        '''test a new reference taken before collection saves the file'''
+        name = self.store(png_file())
+        imagestore.release(name)
+
+        self.store(png_file())
+        imagestore.collect(name)
+
+        self.assertTrue(default_storage.exists(name))
+
+    def test_deleting_recipe_releases_image(self):
+        '''test deleting a recipe gives up its image reference'''
+        name = self.store(png_file())
+        recipe = self.sample_recipe(image=name)
+
+        recipe.delete()
+
+        self.assertEqual(StoredImage.objects.get(name=name).ref_count, 0)
@@ -0,0 +1,165 @@
+import os
+import tempfile
+
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from core import metrics
+from core.authentication import token_cache
+
+
+TAGS_URL = reverse('recipe:tag-list')
+METRICS_URL = reverse('metrics')
+
+
+def sample(text, line_start):
+    '''the value of the exposition line starting with line_start'''
+    for line in text.splitlines():
+        if line.startswith(line_start + ' '):
+            return float(line.rsplit(' ', 1)[1])
+
+    return 0
+
+
+class MetricsEndpointTests(TestCase):
+    '''test requests show up on the metrics endpoint'''
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'test@londonappdev.com', 'testpass'
+        )
+        self.client = APIClient()
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=self.user)}'
+        )
+        token_cache.clear()
+
+    def scrape(self):
+        res = self.client.get(METRICS_URL)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res['Content-Type'], metrics.CONTENT_TYPE)
+        return res.content.decode()
+
+    def test_request_counted_and_timed(self):
+        '''test requests are counted and timed per view'''
+        requests = 'http_requests_total{view="recipe:tag-list",' \
+            'method="GET",status="200"}'
+        latency = 'http_request_duration_seconds_bucket' \
+            '{view="recipe:tag-list",method="GET",le="+Inf"}'
+        before = self.scrape()
+
+        self.client.get(TAGS_URL)
+        after = self.scrape()
+
+        self.assertEqual(sample(after, requests) - sample(before, requests), 1)
+        self.assertEqual(sample(after, latency) - sample(before, latency), 1)
+        self.assertIn('# TYPE http_request_db_queries histogram', after)
+        self.assertIn('http_requests_in_flight ', after)
+
+    def test_caches_counted(self):
+        '''test token and conditional cache hits are counted'''
+        hits = 'auth_token_cache_lookups_total{result="hit"}'
+        not_modified = 'http_conditional_requests_total' \
+            '{view="recipe:tag-list",result="hit"}'
+        before = self.scrape()
+
+        etag = self.client.get(TAGS_URL)['ETag']
+        res = self.client.get(TAGS_URL, HTTP_IF_NONE_MATCH=etag)
+        after = self.scrape()
+
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(sample(after, not_modified) -
+                         sample(before, not_modified), 1)
+        self.assertGreater(sample(after, hits), sample(before, hits))
+
+
+class MultiprocessMetricsTests(SimpleTestCase):
+    '''test values kept in files are summed over processes'''
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        settings = override_settings(METRICS_MULTIPROC_DIR=self.directory)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def other_process(self, kind, pid=1):
+        return metrics._MappedValues(
+            os.path.join(self.directory, f'{kind}_{pid}.db')
+        )
+
+    def test_sums_processes(self):
+        '''test values are summed across worker files'''
+        metrics.IN_FLIGHT.inc()
+        self.addCleanup(metrics.IN_FLIGHT.dec)
+        other = self.other_process('gauge')
+        other.inc(metrics.IN_FLIGHT._key('', {}), 2)
+
+        text = metrics.exposition()
+
+        self.assertEqual(sample(text, 'http_requests_in_flight'), 3)
+
+    def test_histogram_buckets_cumulative(self):
+        '''test histogram buckets are exposed cumulatively'''
+        other = self.other_process('histogram')
+        for value in (0.001, 0.2, 20):
+            labels = {'view': 'test', 'method': 'GET'}
+            bucket = next(bound for bound in metrics.LATENCY.buckets
+                          if value <= bound)
+            other.inc(metrics.LATENCY._key(
+                '_bucket', labels, ['le', metrics._format(bucket)]
+            ), 1)
+            other.inc(metrics.LATENCY._key('_count', labels), 1)
+
+        text = metrics.exposition()
+
+        prefix = 'http_request_duration_seconds_bucket{view="test",' \
+            'method="GET",le='
+        self.assertEqual(sample(text, prefix + '"0.005"}'), 1)
+        self.assertEqual(sample(text, prefix + '"0.25"}'), 2)
+        self.assertEqual(sample(text, prefix + '"10"}'), 2)
+        self.assertEqual(sample(text, prefix + '"+Inf"}'), 3)
+
+    def test_dead_process_gauges_dropped(self):
+        '''test an exited process's gauges stop counting'''
+        self.other_process('gauge', pid=2).inc(
+            metrics.IN_FLIGHT._key('', {}), 5
+        )
+
+        metrics.mark_process_dead(2, self.directory)
+
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_dead_process_totals_merged(self):
+        '''test exited processes' counters fold into one file'''
+        for pid in (2, 3):
+            self.other_process('counter', pid).inc('requests', pid)
+            self.other_process('histogram', pid).inc('latency', 1)
+        before = metrics.collect()
+
+        for pid in (2, 3):
+            metrics.mark_process_dead(pid, self.directory)
+
+        self.assertEqual(sorted(os.listdir(self.directory)),
+                         ['counter_dead.db', 'histogram_dead.db'])
+        after = metrics.collect()
+        self.assertEqual(after, before)
+        self.assertEqual(after['requests'], 5)
+        self.assertEqual(after['latency'], 2)
+
+    def test_file_grows_and_reopens(self):
+        '''test the value file grows and reads back on reopen'''
+        values = metrics._MappedValues(
+            os.path.join(self.directory, 'counter_3.db'), size=64
+        )
+        for n in range(20):
+            values.inc(f'key {n}', n)
+
+        reopened = metrics._MappedValues(values.path)
+
+        self.assertEqual(dict(reopened.items()),
+                         {f'key {n}': n for n in range(20)})
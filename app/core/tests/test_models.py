@@ -1,6 +1,8 @@
 from django.test import TestCase
 from unittest.mock import patch
 from django.contrib.auth import get_user_model
+from django.db import IntegrityError
+from core.bulk import bulk_get_or_create_named
 from core import models
 
 
@@ -80,3 +82,40 @@ class ModelTests(TestCase):
 
         exp_path = f'uploads/recipe/{uuid}.jpg'
         self.assertEqual(file_path, exp_path)
+
+    def test_tag_names_unique_per_user_ignoring_case(self):
+        '''test the database rejects a user's duplicate tag names'''
+        user = sample_user()
+        models.Tag.objects.create(user=user, name='Vegan')
+
+        with self.assertRaises(IntegrityError):
+            models.Tag.objects.create(user=user, name='vegan')
+
+    def test_bulk_get_or_create_named(self):
+        '''test names are resolved and created for a single user'''
+        user = sample_user()
+        other = sample_user('other@example.com')
+        models.Ingredient.objects.create(user=other, name='salt')
+        salt = models.Ingredient.objects.create(user=user, name='Salt')
+
+        ids, created = bulk_get_or_create_named(
+            models.Ingredient, user, ['SALT', 'pepper']
+        )
+
+        self.assertEqual(ids['SALT'], salt.id)
+        self.assertEqual(created, ['pepper'])
+        self.assertEqual(
+            models.Ingredient.objects.get(id=ids['pepper']).user, user
+        )
+
+    def test_bulk_get_or_create_named_non_ascii(self):
+        '''test non-ASCII names match rows the way the database folds them'''
+        user = sample_user()
+        eclair = models.Tag.objects.create(user=user, name='Éclair')
+
+        ids, created = bulk_get_or_create_named(
+            models.Tag, user, ['Éclair', 'Crème']
+        )
+
+        self.assertEqual(ids['Éclair'], eclair.id)
+        self.assertEqual(created, ['Crème'])
@@ -0,0 +1,121 @@
+import os
+import pstats
+import tempfile
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.http import HttpResponse
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from core.profiling import ProfilingMiddleware, sign_user
+
+
+TAGS_URL = reverse('recipe:tag-list')
+
+
+class ProfilingTests(TestCase):
+    '''test requests are profiled only when asked to'''
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.staff = get_user_model().objects.create_user(
+            'staff@londonappdev.com', 'testpass', is_staff=True
+        )
+        self.user = get_user_model().objects.create_user(
+            'test@londonappdev.com', 'testpass'
+        )
+
+    def config(self, **config):
+        return override_settings(PROFILING=dict({
+            'ENABLED': True,
+            'SAMPLE_RATE': 0,
+            'PROFILER': 'cprofile',
+            'DIR': self.directory,
+            'KEEP': 3,
+            'HEADER_MAX_AGE': 60,
+        }, **config))
+
+    def get(self, **headers):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        return client.get(TAGS_URL, **headers)
+
+    def test_disabled(self):
+        '''test the middleware is unused when disabled'''
+        with self.config(ENABLED=False):
+            with self.assertRaises(MiddlewareNotUsed):
+                ProfilingMiddleware(lambda request: HttpResponse())
+
+    def test_staff_header_profiles_request(self):
+        '''test a signed staff header writes a profile'''
+        with self.config():
+            res = self.get(HTTP_X_PROFILE=sign_user(self.staff))
+
+        name = res['X-Profile-Id']
+        self.assertIn('recipe-tag-list', name)
+        self.assertTrue(name.endswith('.prof'))
+        stats = pstats.Stats(os.path.join(self.directory, name))
+        self.assertTrue(stats.total_calls)
+
+    def test_header_of_non_staff_ignored(self):
+        '''test headers signed for non-staff users are ignored'''
+        with self.config():
+            res = self.get(HTTP_X_PROFILE=sign_user(self.user))
+
+        self.assertFalse(res.has_header('X-Profile-Id'))
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_tampered_header_ignored(self):
+        '''test headers with a bad signature are ignored'''
+        with self.config():
+            res = self.get(HTTP_X_PROFILE=sign_user(self.staff) + 'x')
+
+        self.assertFalse(res.has_header('X-Profile-Id'))
+
+    def test_expired_header_ignored(self):
+        '''test expired headers are ignored'''
+        with self.config(HEADER_MAX_AGE=-1):
+            res = self.get(HTTP_X_PROFILE=sign_user(self.staff))
+
+        self.assertFalse(res.has_header('X-Profile-Id'))
+
+    def test_sampled_requests_profiled_and_pruned(self):
+        '''test sampled profiles are kept to the newest few, unnamed'''
+        other = os.path.join(self.directory, 'notes.txt')
+        open(other, 'w').close()
+        with self.config(SAMPLE_RATE=1):
+            responses = [self.get() for _ in range(5)]
+            names = [self.get(HTTP_X_PROFILE=sign_user(self.staff))
+                     ['X-Profile-Id'] for _ in range(2)]
+
+        for res in responses:
+            self.assertFalse(res.has_header('X-Profile-Id'))
+        profiles = sorted(os.listdir(self.directory))
+        self.assertEqual(len(profiles), 4)
+        self.assertIn('notes.txt', profiles)
+        for name in names:
+            self.assertIn(name, profiles)
+
+    def test_profile_header_command(self):
+        '''test the command prints a working header'''
+        out = StringIO()
+        call_command('profile_header', user=self.staff.email, stdout=out)
+        header = out.getvalue().strip()
+
+        self.assertTrue(header.startswith('X-Profile: '))
+        with self.config():
+            res = self.get(HTTP_X_PROFILE=header.split(': ', 1)[1])
+        self.assertTrue(res.has_header('X-Profile-Id'))
+
+    def test_profile_header_command_needs_staff(self):
+        '''test the command refuses non-staff users'''
+        with self.assertRaises(CommandError):
+            call_command('profile_header', user=self.user.email,
+                         stdout=StringIO())
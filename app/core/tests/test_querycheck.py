@@ -0,0 +1,105 @@
+import json
+import os
+import tempfile
+
+from django.contrib.auth import get_user_model
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from core.models import Recipe, Tag
+from core.querycheck import QueryCheckFailed, QueryCheckMiddleware, \
+    query_shape
+
+
+def lookups(count):
+    '''a view running the same lookup count times'''
+    def view(request):
+        for pk in range(count):
+            Recipe.objects.filter(pk=pk).exists()
+        return HttpResponse()
+
+    return view
+
+
+class QueryCheckTests(TestCase):
+    '''test requests with repeated or slow queries are reported'''
+
+    def setUp(self):
+        fd, self.report = tempfile.mkstemp(suffix='.jsonl')
+        os.close(fd)
+        self.addCleanup(os.remove, self.report)
+        self.request = RequestFactory().get('/api/recipe/recipes/')
+
+    def check(self, view, **config):
+        config = dict({
+            'ENABLED': True,
+            'REPEAT_THRESHOLD': 3,
+            'SLOW_MS': 1000,
+            'REPORT': self.report,
+            'RAISE': False,
+        }, **config)
+        with override_settings(QUERY_CHECK=config):
+            QueryCheckMiddleware(view)(self.request)
+
+        with open(self.report) as f:
+            return [json.loads(line) for line in f]
+
+    def test_disabled(self):
+        '''test the middleware is unused when disabled'''
+        with override_settings(QUERY_CHECK={'ENABLED': False}):
+            with self.assertRaises(MiddlewareNotUsed):
+                QueryCheckMiddleware(lookups(0))
+
+    def test_clean_request_not_reported(self):
+        '''test requests below the threshold are not reported'''
+        self.assertEqual(self.check(lookups(2)), [])
+
+    def test_repeated_queries_reported(self):
+        '''test repeated query shapes are reported'''
+        report = self.check(lookups(3))
+
+        self.assertEqual(len(report), 1)
+        repeated = report[0]['problems'][0]['repeated']
+        self.assertEqual(repeated[0]['count'], 3)
+        self.assertIn('core_recipe', repeated[0]['sql'])
+
+    def test_slow_queries_explained(self):
+        '''test slow queries are reported with their plan'''
+        report = self.check(lookups(1), SLOW_MS=0)
+
+        slow = report[0]['problems'][0]['slow']
+        self.assertEqual(len(slow), 1)
+        self.assertTrue(slow[0]['explain'])
+
+    def test_raise(self):
+        '''test problems raise when configured to'''
+        with self.assertRaisesRegex(QueryCheckFailed, r'3x SELECT'):
+            self.check(lookups(3), RAISE=True)
+
+    def test_in_lists_share_a_shape(self):
+        '''test IN lists of any length share a shape'''
+        self.assertEqual(query_shape('WHERE id IN (%s)'),
+                         query_shape('WHERE id IN (%s, %s, %s)'))
+
+    def test_recipe_update_indexes_once(self):
+        '''saving a recipe and its tags does not reindex it per change'''
+        user = get_user_model().objects.create_user('test@londonappdev.com',
+                                                    'testpass')
+        recipe = Recipe.objects.create(user=user, title='Soup',
+                                       time_minutes=5, price=1)
+        recipe.tags.add(Tag.objects.create(user=user, name='Vegan'))
+        tag = Tag.objects.create(user=user, name='Dinner')
+        client = APIClient()
+        client.force_authenticate(user)
+
+        config = {'ENABLED': True, 'REPEAT_THRESHOLD': 3, 'SLOW_MS': 1000,
+                  'REPORT': self.report, 'RAISE': True}
+        with override_settings(QUERY_CHECK=config):
+            res = client.patch(reverse('recipe:recipe-detail',
+                                       args=[recipe.id]),
+                               {'title': 'Stew', 'tags': [tag.id]})
+
+        self.assertEqual(res.status_code, 200)
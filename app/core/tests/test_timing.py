@@ -0,0 +1,70 @@
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from core.models import Recipe
+
+
+RECIPES_URL = reverse('recipe:recipe-list')
+ME_URL = reverse('user:me')
+
+
+def metrics(response):
+    '''map each Server-Timing metric name to its parameters'''
+    parsed = {}
+    for metric in response['Server-Timing'].split(', '):
+        name, *params = metric.split(';')
+        parsed[name] = dict(param.split('=', 1) for param in params)
+
+    return parsed
+
+
+@override_settings(SERVER_TIMING_SAMPLE_RATE=1)
+class ServerTimingTests(TestCase):
+    '''test sampled requests report where their time went'''
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'test@londonappdev.com', 'testpass'
+        )
+        Recipe.objects.create(user=self.user, title='Soup',
+                              time_minutes=5, price=1)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_list_metrics(self):
+        '''test sampled list requests are timed and logged'''
+        with self.assertLogs('core.timing', 'INFO') as logs:
+            res = self.client.get(RECIPES_URL)
+
+        timing = metrics(res)
+        self.assertEqual(list(timing),
+                         ['db', 'serialize', 'render', 'view', 'total'])
+        self.assertRegex(timing['db']['desc'], r'^"\d+ queries"$')
+        self.assertLessEqual(float(timing['view']['dur']),
+                             float(timing['total']['dur']))
+        self.assertIn('view=recipe:recipe-list status=200 db_queries=',
+                      logs.output[0])
+
+    @override_settings(API_LEAN_LISTS=True)
+    def test_lean_list_serialize_metric(self):
+        '''test the lean list path reports serialize time'''
+        with self.assertLogs('core.timing', 'INFO'):
+            res = self.client.get(RECIPES_URL)
+
+        self.assertIn('serialize', metrics(res))
+
+    def test_user_view_metrics(self):
+        '''test user views report serialize time'''
+        with self.assertLogs('core.timing', 'INFO'):
+            res = self.client.get(ME_URL)
+
+        self.assertIn('serialize', metrics(res))
+
+    @override_settings(SERVER_TIMING_SAMPLE_RATE=0)
+    def test_unsampled_request(self):
+        '''test unsampled requests get no timing header'''
+        res = self.client.get(RECIPES_URL)
+
+        self.assertFalse(res.has_header('Server-Timing'))
@@ -0,0 +1,194 @@
+from unittest.mock import patch
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db.utils import OperationalError
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+
+CONTENT = bytes(range(256)) * 4
+
+
+class ServeMediaTests(TestCase):
+    '''test media files are served with caching and range support'''
+
+    def setUp(self):
+        self.name = default_storage.save('uploads/recipe/test.jpg',
+                                         ContentFile(CONTENT))
+        self.url = reverse('media', args=[self.name])
+
+    def tearDown(self):
+        default_storage.delete(self.name)
+
+    def test_serve_file(self):
+        '''test a media file is served with validators and caching headers'''
+        res = self.client.get(self.url)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(b''.join(res.streaming_content), CONTENT)
+        self.assertEqual(res['Content-Type'], 'image/jpeg')
+        self.assertEqual(res['Accept-Ranges'], 'bytes')
+        self.assertIn('max-age=', res['Cache-Control'])
+        self.assertTrue(res['ETag'].startswith('"'))
+
+    def test_uploads_cached_as_immutable(self):
+        '''test content-addressed uploads are cached as immutable'''
+        res = self.client.get(self.url)
+
+        self.assertEqual(res['Cache-Control'],
+                         'public, max-age=31536000, immutable')
+
+    @override_settings(MEDIA_IMMUTABLE_PREFIXES=(), MEDIA_CACHE_MAX_AGE=60)
+    def test_cache_max_age(self):
+        '''test other media are cached for MEDIA_CACHE_MAX_AGE'''
+        res = self.client.get(self.url)
+
+        self.assertEqual(res['Cache-Control'], 'public, max-age=60')
+
+    def test_missing_file(self):
+        '''test a missing file is a 404'''
+        res = self.client.get(reverse('media', args=['uploads/missing.jpg']))
+
+        self.assertEqual(res.status_code, 404)
+
+    def test_path_outside_media_root(self):
+        '''test paths escaping MEDIA_ROOT are a 404'''
+        res = self.client.get(reverse('media', args=['../../settings.py']))
+
+        self.assertEqual(res.status_code, 404)
+
+    def test_if_none_match_not_modified(self):
+        '''test a current ETag is answered with 304 and no body'''
+        etag = self.client.get(self.url)['ETag']
+
+        res = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res['ETag'], etag)
+        self.assertEqual(res.content, b'')
+
+    def test_if_none_match_changed(self):
+        '''test a stale ETag gets the file'''
+        res = self.client.get(self.url, HTTP_IF_NONE_MATCH='"stale"')
+
+        self.assertEqual(res.status_code, 200)
+
+    def test_range(self):
+        '''test a byte range is answered with 206 and that slice'''
+        res = self.client.get(self.url, HTTP_RANGE='bytes=10-19')
+
+        self.assertEqual(res.status_code, 206)
+        self.assertEqual(b''.join(res.streaming_content), CONTENT[10:20])
+        self.assertEqual(res['Content-Range'], f'bytes 10-19/{len(CONTENT)}')
+        self.assertEqual(res['Content-Length'], '10')
+
+    def test_suffix_and_open_ranges(self):
+        '''test suffix and open ended byte ranges'''
+        res = self.client.get(self.url, HTTP_RANGE='bytes=-5')
+        self.assertEqual(b''.join(res.streaming_content), CONTENT[-5:])
+
+        res = self.client.get(self.url, HTTP_RANGE='bytes=1000-')
+        self.assertEqual(b''.join(res.streaming_content), CONTENT[1000:])
+
+    def test_unsatisfiable_range(self):
+        '''test a range past the end is answered with 416'''
+        res = self.client.get(self.url, HTTP_RANGE='bytes=5000-6000')
+
+        self.assertEqual(res.status_code, 416)
+        self.assertEqual(res['Content-Range'], f'bytes */{len(CONTENT)}')
+
+    def test_stale_if_range_sends_whole_file(self):
+        '''test a stale If-Range gets the whole file'''
+        res = self.client.get(self.url, HTTP_RANGE='bytes=0-9',
+                              HTTP_IF_RANGE='"stale"')
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(b''.join(res.streaming_content), CONTENT)
+
+    @override_settings(MEDIA_SENDFILE='x-accel-redirect',
+                       MEDIA_SENDFILE_PREFIX='/protected/')
+    def test_x_accel_redirect(self):
+        '''test nginx is handed the file with an empty body'''
+        res = self.client.get(self.url)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res['X-Accel-Redirect'], f'/protected/{self.name}')
+        self.assertEqual(res.content, b'')
+        self.assertEqual(res['Content-Type'], 'image/jpeg')
+
+    @override_settings(MEDIA_SENDFILE='x-accel-redirect',
+                       MEDIA_SENDFILE_PREFIX='/protected/')
+    def test_x_accel_redirect_quotes_path(self):
+        '''test names with spaces, ? and # make a valid internal uri'''
+        name = default_storage.save('uploads/recipe/my cake?#1.jpg',
+                                    ContentFile(CONTENT))
+        self.addCleanup(default_storage.delete, name)
+
+        res = self.client.get(reverse('media', args=[name]))
+
+        self.assertEqual(res['X-Accel-Redirect'],
+                         '/protected/uploads/recipe/my%20cake%3F%231.jpg')
+
+    @override_settings(MEDIA_SENDFILE='x-sendfile')
+    def test_x_sendfile(self):
+        '''test the proxy is handed the absolute path of the file'''
+        res = self.client.get(self.url)
+
+        self.assertTrue(res['X-Sendfile'].endswith(self.name))
+        self.assertEqual(res.content, b'')
+
+    def test_post_not_allowed(self):
+        '''test media only answers safe methods'''
+        res = self.client.post(self.url)
+
+        self.assertEqual(res.status_code, 405)
+
+
+class HealthTests(TestCase):
+    '''test the liveness and readiness probes'''
+
+    def test_healthz(self):
+        '''test liveness reports database latency'''
+        res = self.client.get(reverse('healthz'))
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.json()['status'], 'ok')
+        self.assertIn('latency_ms', res.json()['database'])
+
+    @patch('core.views.check_database', side_effect=OperationalError('down'))
+    def test_healthz_database_down(self, check):
+        '''test liveness stays up when the database is down'''
+        with self.assertLogs('core.views', 'WARNING') as logs:
+            res = self.client.get(reverse('healthz'))
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.json()['database'], {'error': 'unavailable'})
+        self.assertNotIn('down', res.content.decode())
+        self.assertIn('OperationalError: down', logs.output[0])
+
+    def test_readyz(self):
+        '''test readiness is ready and uncached'''
+        res = self.client.get(reverse('readyz'))
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.json()['status'], 'ready')
+        self.assertIn('no-cache', res['Cache-Control'])
+
+    @patch('core.views.check_database', side_effect=OperationalError('down'))
+    def test_readyz_database_down(self, check):
+        '''test readiness fails when the database is down'''
+        with self.assertLogs('core.views', 'WARNING'):
+            res = self.client.get(reverse('readyz'))
+
+        self.assertEqual(res.status_code, 503)
+        self.assertEqual(res.json()['status'], 'unavailable')
+
+    @patch('core.views._migrated', False)
+    @patch('core.views.pending_migrations', return_value=['core.0011'])
+    def test_readyz_migrations_pending(self, pending):
+        '''test readiness fails with pending migrations'''
+        res = self.client.get(reverse('readyz'))
+
+        self.assertEqual(res.status_code, 503)
+        self.assertEqual(res.json()['database']['pending_migrations'], 1)
@@ -0,0 +1,39 @@
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+
+class QueryBudgetMixin:
+    '''assertions that keep an endpoint's query count flat'''
+
+    def count_queries(self, func, *args, **kwargs):
+        '''return the number of queries made by calling func'''
+        with CaptureQueriesContext(connection) as context:
+            func(*args, **kwargs)
+
+        return len(context.captured_queries)
+
+    def assertQueryBudget(self, budget, func, *args, **kwargs):
+        '''fail if calling func makes more than budget queries'''
+        with CaptureQueriesContext(connection) as context:
+            result = func(*args, **kwargs)
+
+        executed = len(context.captured_queries)
+        if executed > budget:
+            queries = '\n'.join(q['sql'] for q in context.captured_queries)
+            self.fail(
+                f'{executed} queries executed, budget is {budget}\n{queries}'
+            )
+
+        return result
+
+    def assertQueriesDoNotScale(self, func, grow, sizes=(1, 5, 10)):
+        '''fail if func's query count changes as grow(n) adds n rows'''
+        counts = []
+        for size in sizes:
+            grow(size)
+            counts.append(self.count_queries(func))
+
+        self.assertEqual(
+            len(set(counts)), 1,
+            f'query count grows with result size: {counts}'
+        )
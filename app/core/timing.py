@@ -0,0 +1,174 @@
+'''per-request timings, sent as a Server-Timing header and a log line
+
+A SERVER_TIMING_SAMPLE_RATE share of requests is measured: the queries
+run on every database connection, serializer output, rendering of DRF
+responses, the view and the whole request. Serializer time includes the
+queries it triggers. Requests that are not sampled only pay for drawing
+a random number.
+'''
+import logging
+import random
+import threading
+import time
+from collections import defaultdict
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import connections
+
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+
+# Server-Timing metric names, in the order they are sent
+METRICS = ('db', 'serialize', 'render', 'view', 'total')
+
+
+class RequestTimings:
+    '''milliseconds spent per metric during one request'''
+
+    def __init__(self):
+        self.durations = defaultdict(float)
+        self.queries = 0
+        self._started = {}
+
+    def start(self, name):
+        self._started[name] = time.perf_counter()
+
+    def stop(self, name):
+        started = self._started.pop(name, None)
+        if started is not None:
+            self.durations[name] += (time.perf_counter() - started) * 1000
+
+    @contextmanager
+    def measure(self, name):
+        self.start(name)
+        try:
+            yield
+        finally:
+            self.stop(name)
+
+    def __call__(self, execute, sql, params, many, context):
+        '''database execute wrapper counting and timing queries'''
+        self.queries += 1
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.durations['db'] += (time.perf_counter() - start) * 1000
+
+    def header(self):
+        '''the Server-Timing header value'''
+        metrics = []
+        for name in METRICS:
+            if name not in self.durations:
+                continue
+            metric = f'{name};dur={self.durations[name]:.1f}'
+            if name == 'db':
+                metric += f';desc="{self.queries} queries"'
+            metrics.append(metric)
+
+        return ', '.join(metrics)
+
+
+def current():
+    '''the timings of the request being measured on this thread, if any'''
+    return getattr(_local, 'timings', None)
+
+
+@contextmanager
+def measure(name):
+    '''add the time spent in the block to the current request's metric'''
+    timings = current()
+    if timings is None:
+        yield
+        return
+    with timings.measure(name):
+        yield
+
+
+def timed(name, func):
+    '''wrap func so its calls are measured under name'''
+    def wrapper(*args, **kwargs):
+        with measure(name):
+            return func(*args, **kwargs)
+
+    return wrapper
+
+
+class TimedSerializerMixin:
+    '''measure the output of the view's serializers as "serialize"'''
+
+    def get_serializer(self, *args, **kwargs):
+        serializer = super().get_serializer(*args, **kwargs)
+        if current() is not None:
+            serializer.to_representation = timed(
+                'serialize', serializer.to_representation
+            )
+
+        return serializer
+
+
+class ServerTimingMiddleware:
+    '''measure sampled requests and report where their time went
+
+    Install it first in MIDDLEWARE so total covers the other middleware.
+    '''
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if random.random() >= settings.SERVER_TIMING_SAMPLE_RATE:
+            return self.get_response(request)
+
+        timings = _local.timings = RequestTimings()
+        try:
+            with timings.measure('total'), ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(timings))
+                response = self.get_response(request)
+            # responses that are not rendered end their view here
+            timings.stop('view')
+        finally:
+            _local.timings = None
+
+        response['Server-Timing'] = ', '.join(filter(None, (
+            response.get('Server-Timing'), timings.header()
+        )))
+        self.log(request, response, timings)
+
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        timings = current()
+        if timings is not None:
+            timings.start('view')
+
+    def process_template_response(self, request, response):
+        timings = current()
+        if timings is not None:
+            timings.stop('view')
+            timings.start('render')
+            response.add_post_render_callback(
+                lambda response: timings.stop('render')
+            )
+
+        return response
+
+    def log(self, request, response, timings):
+        match = request.resolver_match
+        fields = {
+            'method': request.method,
+            'path': request.path,
+            'view': match.view_name if match else None,
+            'status': response.status_code,
+            'db_queries': timings.queries,
+        }
+        fields.update((f'{name}_ms', round(timings.durations[name], 1))
+                      for name in METRICS if name in timings.durations)
+        logger.info(
+            ' '.join(f'{key}={value}' for key, value in fields.items()),
+            extra={'timings': fields}
+        )
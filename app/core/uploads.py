@@ -0,0 +1,117 @@
+'''bounded-memory handling of uploaded recipe images'''
+import hashlib
+import os
+
+from django.conf import settings
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from PIL import Image
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+
+# formats whose decoder can scale down while decoding, see Image.draft()
+DRAFT_FORMATS = ('JPEG',)
+
+
+class UploadTooLarge(APIException):
+    status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    default_detail = 'The upload exceeds the size limit.'
+    default_code = 'upload_too_large'
+
+
+class ImageTooLarge(ValueError):
+    '''raised for images with more pixels than allowed'''
+
+
+class LimitedUploadHandler(TemporaryFileUploadHandler):
+    '''stream uploaded files to disk in chunks, stopping at a size cap
+
+    Nothing is buffered in memory; a body whose Content-Length is already
+    over the cap is refused before any of it is read. Each file is hashed
+    as it arrives, see core.imagestore.
+    '''
+
+    def __init__(self, request=None, max_size=None):
+        super().__init__(request)
+        self.max_size = max_size or settings.RECIPE_IMAGE_MAX_UPLOAD_SIZE
+        self.received = 0
+
+    def handle_raw_input(self, input_data, META, content_length, boundary,
+                         encoding=None):
+        '''refuse bodies that announce themselves as too large'''
+        # leave room for the multipart boundaries and headers
+        if content_length > self.max_size + 64 * 1024:
+            raise UploadTooLarge()
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.received = 0
+        self.hasher = hashlib.sha256()
+
+    def receive_data_chunk(self, raw_data, start):
+        '''write a chunk, giving up once the file passes the cap'''
+        self.received += len(raw_data)
+        if self.received > self.max_size:
+            self.file.close()
+            raise UploadTooLarge()
+
+        self.hasher.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)
+        file.sha256 = self.hasher.hexdigest()
+        return file
+
+
+def ingest_image(uploaded):
+    '''check an uploaded image's size and downscale it if needed
+
+    uploaded is a file validated by an ImageField, whose .image has read
+    only the image header. Images over RECIPE_IMAGE_MAX_PIXELS are refused
+    without being decoded. Ones with an edge longer than
+    RECIPE_IMAGE_INGEST_MAX_EDGE are replaced with a downscaled copy.
+    JPEGs are decoded at reduced scale for that; other formats decode in
+    full, so they are refused undecoded past the much lower
+    RECIPE_IMAGE_MAX_DECODE_PIXELS.
+    '''
+    width, height = uploaded.image.size
+    if width * height > settings.RECIPE_IMAGE_MAX_PIXELS:
+        raise ImageTooLarge(
+            f'Images may have at most {settings.RECIPE_IMAGE_MAX_PIXELS} '
+            f'pixels, this one has {width * height}.'
+        )
+
+    edge = settings.RECIPE_IMAGE_INGEST_MAX_EDGE
+    if max(width, height) <= edge:
+        return uploaded
+    if uploaded.image.format not in DRAFT_FORMATS and \
+            width * height > settings.RECIPE_IMAGE_MAX_DECODE_PIXELS:
+        raise ImageTooLarge(
+            f'{uploaded.image.format} images with an edge over {edge} '
+            f'pixels may have at most '
+            f'{settings.RECIPE_IMAGE_MAX_DECODE_PIXELS} pixels, this one '
+            f'has {width * height}. Upload a JPEG or a smaller image.'
+        )
+
+    source = uploaded.temporary_file_path() \
+        if hasattr(uploaded, 'temporary_file_path') else uploaded
+    if hasattr(source, 'seek'):
+        source.seek(0)
+    with Image.open(source) as image:
+        image_format = image.format
+        image.draft(image.mode, (edge, edge))
+        image.thumbnail((edge, edge), Image.LANCZOS)
+
+        resized = TemporaryUploadedFile(
+            uploaded.name, uploaded.content_type, 0, None
+        )
+        options = {'quality': 90} if image_format == 'JPEG' else {}
+        image.save(resized, image_format, **options)
+
+    resized.size = os.path.getsize(resized.temporary_file_path())
+    resized.seek(0)
+    resized.image = image
+
+    return resized
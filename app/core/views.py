@@ -0,0 +1,218 @@
+import logging
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.db.utils import OperationalError
+from django.http import (
+    FileResponse, Http404, HttpResponse, HttpResponseNotModified,
+    JsonResponse, StreamingHttpResponse
+)
+from django.utils._os import safe_join
+from django.utils.http import http_date, parse_etags, parse_http_date_safe
+from django.views.decorators.cache import never_cache
+from django.views.decorators.http import require_safe
+
+from core import metrics as prometheus
+from core.db.pool import pool_stats
+from core.health import check_database, pending_migrations
+
+
+logger = logging.getLogger(__name__)
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+CHUNK_SIZE = 64 * 1024
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+
+def _etag(stat):
+    '''strong validator from the file's size and modification time'''
+    return '"{:x}-{:x}"'.format(stat.st_mtime_ns, stat.st_size)
+
+
+def _not_modified(request, etag, mtime):
+    '''return whether the client's cached copy is still current'''
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match:
+        # If-None-Match uses the weak comparison
+        etags = [tag.replace('W/', '', 1)
+                 for tag in parse_etags(if_none_match)]
+        return '*' in etags or etag in etags
+
+    since = parse_http_date_safe(
+        request.META.get('HTTP_IF_MODIFIED_SINCE', '')
+    )
+    return since is not None and int(mtime) <= since
+
+
+def _byte_range(request, etag, size):
+    '''return the (start, end) requested by a Range header
+
+    None means the whole file should be sent, because there is no range, it
+    is one we do not support, or If-Range no longer matches. An empty tuple
+    means the range cannot be satisfied.
+    '''
+    header = request.META.get('HTTP_RANGE')
+    if not header:
+        return None
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if if_range and if_range != etag:
+        return None
+
+    match = RANGE_RE.match(header.strip())
+    if not match or match.groups() == ('', ''):
+        # several ranges or a malformed header: ignore it
+        return None
+    first, last = match.groups()
+    if not first:
+        # the final n bytes
+        start, end = max(size - int(last), 0), size - 1
+    else:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        return ()
+
+    return start, end
+
+
+def _read_range(path, start, length):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def _file_response(request, full_path, etag, size):
+    byte_range = _byte_range(request, etag, size)
+    if byte_range is None:
+        # FileResponse lets the WSGI server use sendfile where it can
+        return FileResponse(open(full_path, 'rb'))
+    if not byte_range:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+
+    start, end = byte_range
+    length = end - start + 1
+    response = StreamingHttpResponse(
+        _read_range(full_path, start, length), status=206
+    )
+    response['Content-Length'] = str(length)
+    response['Content-Range'] = f'bytes {start}-{end}/{size}'
+
+    return response
+
+
+@require_safe
+def serve_media(request, path):
+    '''serve a file under MEDIA_ROOT with caching and range support
+
+    With MEDIA_SENDFILE set the body is left to the front proxy, which is
+    handed the file through an X-Accel-Redirect or X-Sendfile header.
+    '''
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+    except SuspiciousFileOperation:
+        raise Http404('Not found')
+    try:
+        stat = os.stat(full_path)
+    except (FileNotFoundError, NotADirectoryError):
+        raise Http404('Not found')
+    if not os.path.isfile(full_path):
+        raise Http404('Not found')
+
+    etag = _etag(stat)
+    if path.startswith(tuple(settings.MEDIA_IMMUTABLE_PREFIXES)):
+        # uploads are never rewritten in place, see core.imagestore
+        cache_control = f'public, max-age={IMMUTABLE_MAX_AGE}, immutable'
+    else:
+        cache_control = f'public, max-age={settings.MEDIA_CACHE_MAX_AGE}'
+    headers = {
+        'ETag': etag,
+        'Last-Modified': http_date(stat.st_mtime),
+        'Cache-Control': cache_control,
+        'Accept-Ranges': 'bytes',
+    }
+
+    if _not_modified(request, etag, stat.st_mtime):
+        response = HttpResponseNotModified()
+    elif settings.MEDIA_SENDFILE == 'x-accel-redirect':
+        response = HttpResponse()
+        response['X-Accel-Redirect'] = (
+            settings.MEDIA_SENDFILE_PREFIX.rstrip('/') + '/' + quote(path)
+        )
+    elif settings.MEDIA_SENDFILE == 'x-sendfile':
+        response = HttpResponse()
+        response['X-Sendfile'] = os.path.abspath(full_path)
+    else:
+        response = _file_response(request, full_path, etag, stat.st_size)
+
+    if response.status_code in (200, 206):
+        content_type, encoding = mimetypes.guess_type(full_path)
+        response['Content-Type'] = content_type or 'application/octet-stream'
+        if encoding:
+            response['Content-Encoding'] = encoding
+    for header, value in headers.items():
+        response[header] = value
+
+    return response
+
+
+def _database_status():
+    '''database latency, or a generic error; the details only go to the log'''
+    try:
+        return True, {'latency_ms': round(check_database(), 2)}
+    except OperationalError:
+        logger.warning('database check failed', exc_info=True)
+        return False, {'error': 'unavailable'}
+
+
+@never_cache
+@require_safe
+def healthz(request):
+    '''liveness: the process serves requests, whatever the database does'''
+    _, database = _database_status()
+    pools = pool_stats()
+    if pools:
+        database['pools'] = pools
+
+    return JsonResponse({'status': 'ok', 'database': database})
+
+
+_migrated = False
+
+
+@never_cache
+@require_safe
+def readyz(request):
+    '''readiness: the database answers and every migration is applied'''
+    global _migrated
+    ready, database = _database_status()
+    if ready and not _migrated:
+        # once applied, migrations stay applied for this process
+        pending = pending_migrations()
+        _migrated = not pending
+        if pending:
+            ready = False
+            database['pending_migrations'] = len(pending)
+
+    return JsonResponse(
+        {'status': 'ready' if ready else 'unavailable', 'database': database},
+        status=200 if ready else 503
+    )
+
+
+@never_cache
+@require_safe
+def metrics(request):
+    '''every worker's metrics in the Prometheus text format'''
+    return HttpResponse(prometheus.exposition(),
+                        content_type=prometheus.CONTENT_TYPE)
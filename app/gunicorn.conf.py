@@ -0,0 +1,76 @@
+'''gunicorn settings for serving the API in production
+
+Every setting can be overridden from the environment. Run the WSGI app
+with threaded workers:
+
+    gunicorn -c gunicorn.conf.py app.wsgi:application
+
+or the ASGI app under uvicorn workers:
+
+    GUNICORN_WORKER_CLASS=uvicorn.workers.UvicornWorker \\
+        gunicorn -c gunicorn.conf.py app.asgi:application
+
+Send the master SIGHUP to reload code gracefully: new workers are started
+and old ones finish their requests before exiting.
+'''
+import multiprocessing
+import os
+
+# imported here: child_exit runs in the master's signal handler, where
+# importing is not safe
+from core.metrics import mark_process_dead
+
+
+def env_int(name, default):
+    return int(os.environ.get(name, default))
+
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+
+# requests mostly wait on Postgres, so a few threads per process keep the
+# CPUs busy without the memory of more processes
+workers = env_int('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1)
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+threads = env_int('GUNICORN_THREADS', 4)
+
+# seconds an idle client connection is kept open; keep it above the load
+# balancer's own idle timeout so it never reuses a closed connection.
+# uvicorn workers also time out connections whose next request is
+# waiting for a free thread, so a short value drops them under load.
+keepalive = env_int('GUNICORN_KEEPALIVE', 75)
+timeout = env_int('GUNICORN_TIMEOUT', 30)
+graceful_timeout = env_int('GUNICORN_GRACEFUL_TIMEOUT', 30)
+
+# recycle workers after a jittered number of requests so slow leaks are
+# bounded and workers do not all restart at once
+max_requests = env_int('GUNICORN_MAX_REQUESTS', 1000)
+max_requests_jitter = env_int('GUNICORN_MAX_REQUESTS_JITTER', 100)
+
+# loading the app in the master shares memory between workers, but then
+# SIGHUP can no longer pick up new code
+preload_app = bool(env_int('GUNICORN_PRELOAD', 0))
+
+# the heartbeat file lives in memory rather than on the container's disk
+worker_tmp_dir = os.environ.get('GUNICORN_WORKER_TMP_DIR', '/dev/shm')
+
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG', '-')
+errorlog = '-'
+
+# workers keep their metrics in files here so /metrics sums every worker;
+# memory-backed like the heartbeat files
+os.environ.setdefault('METRICS_MULTIPROC_DIR',
+                      os.path.join(worker_tmp_dir, 'app-metrics'))
+
+
+def on_starting(server):
+    '''start from empty metrics rather than those of a previous run'''
+    directory = os.environ['METRICS_MULTIPROC_DIR']
+    os.makedirs(directory, exist_ok=True)
+    for name in os.listdir(directory):
+        if name.endswith('.db'):
+            os.remove(os.path.join(directory, name))
+
+
+def child_exit(server, worker):
+    '''drop an exited worker's gauges and fold in its other metrics'''
+    mark_process_dead(worker.pid, os.environ['METRICS_MULTIPROC_DIR'])
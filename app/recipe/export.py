@@ -0,0 +1,99 @@
+'''streaming export of a user's recipes as NDJSON or CSV
+
+Recipes are read in keyset chunks of RECIPE_EXPORT_CHUNK_SIZE with their
+tag and ingredient names loaded per chunk, and each row is encoded as it
+is sent, so memory stays flat however many recipes a user has.
+'''
+import csv
+import json
+from collections import defaultdict
+
+from django.conf import settings
+from rest_framework.renderers import BaseRenderer
+
+from core.models import Recipe
+from recipe.lean import format_price
+
+
+COLUMNS = ('id', 'title', 'time_minutes', 'price', 'link', 'tags',
+           'ingredients')
+
+
+def _linked_names(through, column, recipe_ids):
+    '''map each recipe id to the names it links to, alphabetically'''
+    linked = defaultdict(list)
+    for recipe_id, name in through.objects.filter(recipe_id__in=recipe_ids) \
+            .order_by(f'{column}__name') \
+            .values_list('recipe_id', f'{column}__name'):
+        linked[recipe_id].append(name)
+
+    return linked
+
+
+def export_rows(user, chunk_size=None):
+    '''yield a dict for each of user's recipes, oldest first'''
+    chunk_size = chunk_size or settings.RECIPE_EXPORT_CHUNK_SIZE
+    recipes = Recipe.objects.filter(user=user).order_by('id').values(
+        'id', 'title', 'time_minutes', 'price', 'link'
+    )
+    last_id = 0
+    while True:
+        chunk = list(recipes.filter(id__gt=last_id)[:chunk_size])
+        if not chunk:
+            return
+        ids = [row['id'] for row in chunk]
+        tags = _linked_names(Recipe.tags.through, 'tag', ids)
+        ingredients = _linked_names(Recipe.ingredients.through,
+                                    'ingredient', ids)
+        for row in chunk:
+            row['price'] = format_price(row['price'])
+            row['tags'] = tags.get(row['id'], [])
+            row['ingredients'] = ingredients.get(row['id'], [])
+            yield row
+        last_id = ids[-1]
+
+
+class NDJSONRenderer(BaseRenderer):
+    '''one JSON object per line'''
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        '''render a non-streamed response, such as an error'''
+        return json.dumps(data) + '\n'
+
+    def render_rows(self, rows):
+        for row in rows:
+            yield json.dumps(row) + '\n'
+
+
+class _Line:
+    '''file-like target that hands back what csv.writer writes'''
+
+    def write(self, value):
+        return value
+
+
+class CSVRenderer(BaseRenderer):
+    '''a header line then one line per row, lists joined with "; "'''
+    media_type = 'text/csv'
+    format = 'csv'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        '''render a non-streamed response, such as an error'''
+        if not isinstance(data, dict):
+            data = {'detail': data}
+        writer = csv.writer(_Line())
+        return writer.writerow(data.keys()) + writer.writerow(data.values())
+
+    def render_rows(self, rows):
+        writer = csv.writer(_Line())
+        yield writer.writerow(COLUMNS)
+        for row in rows:
+            yield writer.writerow(
+                '; '.join(row[name]) if isinstance(row[name], list)
+                else row[name]
+                for name in COLUMNS
+            )
@@ -0,0 +1,109 @@
+'''serializer-free list pages, enabled with the API_LEAN_LISTS setting
+
+Rows come from values() and related ids from the through tables, and are
+turned into the same JSON the list serializers produce without creating
+model instances or serializer fields.
+'''
+from collections import defaultdict
+from decimal import Decimal
+
+from django.conf import settings
+from rest_framework.response import Response
+
+from core.models import Recipe, RecipeImageRendition
+from core.timing import measure
+from recipe import serializers
+
+
+CENTS = Decimal('0.01')
+
+
+def format_price(value):
+    '''format a price the way serializers.DecimalField does'''
+    return '{:f}'.format(value.quantize(CENTS))
+
+
+def _linked_ids(through, column, recipe_ids):
+    '''map each recipe id to the ids it links to, in ascending order'''
+    linked = defaultdict(list)
+    for recipe_id, pk in through.objects.filter(recipe_id__in=recipe_ids) \
+            .order_by(column).values_list('recipe_id', column):
+        linked[recipe_id].append(pk)
+
+    return linked
+
+
+def _renditions(recipe_ids, request):
+    storage = RecipeImageRendition._meta.get_field('image').storage
+    renditions = defaultdict(list)
+    for row in RecipeImageRendition.objects.filter(recipe_id__in=recipe_ids) \
+            .order_by('id').values('recipe_id', 'size', 'format', 'image',
+                                   'width', 'height'):
+        url = storage.url(row['image'])
+        renditions[row['recipe_id']].append({
+            'size': row['size'],
+            'format': row['format'],
+            'url': request.build_absolute_uri(url) if request else url,
+            'width': row['width'],
+            'height': row['height'],
+        })
+
+    return renditions
+
+
+def recipe_rows(rows, request, fields=None):
+    '''render recipe values() rows like serializers.RecipeSerializer'''
+    names = [name for name in serializers.RecipeSerializer.Meta.fields
+             if fields is None or name in fields]
+    ids = [row['id'] for row in rows]
+    related = {}
+    if 'tags' in names:
+        related['tags'] = _linked_ids(Recipe.tags.through, 'tag_id', ids)
+    if 'ingredients' in names:
+        related['ingredients'] = _linked_ids(
+            Recipe.ingredients.through, 'ingredient_id', ids
+        )
+    if 'renditions' in names:
+        related['renditions'] = _renditions(ids, request)
+
+    results = []
+    for row in rows:
+        result = {}
+        for name in names:
+            if name in related:
+                result[name] = related[name].get(row['id'], [])
+            elif name == 'price':
+                result[name] = format_price(row[name])
+            else:
+                result[name] = row[name]
+        results.append(result)
+
+    return results
+
+
+class LeanListMixin:
+    '''list from compact rows instead of serializers when enabled'''
+
+    def get_lean_columns(self, queryset):
+        '''columns to select for each listed row'''
+        return self.get_serializer_class().Meta.fields
+
+    def get_lean_rows(self, rows):
+        '''render selected rows as the list serializer would'''
+        return rows
+
+    def list(self, request, *args, **kwargs):
+        if not settings.API_LEAN_LISTS:
+            return super().list(request, *args, **kwargs)
+
+        queryset = self.filter_queryset(self.get_queryset())
+        queryset = queryset.prefetch_related(None) \
+            .values(*self.get_lean_columns(queryset))
+        page = self.paginate_queryset(queryset)
+        rows = list(queryset if page is None else page)
+        with measure('serialize'):
+            rows = self.get_lean_rows(rows)
+        if page is not None:
+            return self.get_paginated_response(rows)
+
+        return Response(rows)
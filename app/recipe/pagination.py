@@ -0,0 +1,30 @@
+from django.conf import settings
+from rest_framework.pagination import CursorPagination
+
+
+class KeysetPagination(CursorPagination):
+    '''opaque cursor pagination with a capped, client chosen page size'''
+    page_size = settings.API_PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = settings.API_MAX_PAGE_SIZE
+
+
+class RecipePagination(KeysetPagination):
+    '''page recipes newest first on the primary key'''
+    ordering = '-id'
+
+    def get_ordering(self, request, queryset, view):
+        '''page search results best match first
+
+        The cursor is placed on the first column only; search ranks
+        carry the id, see core.search, so no two results share one.
+        '''
+        if 'rank' in queryset.query.annotations:
+            return ('-rank', '-id')
+
+        return super().get_ordering(request, queryset, view)
+
+
+class RecipeAttrPagination(KeysetPagination):
+    '''page tags and ingredients by name, unique per user'''
+    ordering = '-name'
@@ -1,9 +1,40 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models.functions import Lower
 from rest_framework import serializers
 
-from core.models import Tag, Ingredient, Recipe
+from core import imagestore, uploads
+from core.models import Tag, Ingredient, Recipe, RecipeImageRendition
 
 
-class TagSerializer(serializers.ModelSerializer):
+class UniqueNameMixin:
+    '''reject names the user already has, ignoring case'''
+
+    def validate_name(self, value):
+        '''check the name is free for the requesting user'''
+        model = self.Meta.model
+        taken = model.objects.annotate(lower_name=Lower('name')).filter(
+            user=self.context['request'].user,
+            lower_name=value.lower()
+        ).exists()
+        if taken:
+            raise serializers.ValidationError(
+                f'A {model._meta.verbose_name} with this name already exists.'
+            )
+
+        return value
+
+
+class NameListSerializer(serializers.Serializer):
+    '''serializer for a batch of tag or ingredient names'''
+    names = serializers.ListField(
+        child=serializers.CharField(max_length=255),
+        allow_empty=False,
+        max_length=settings.RECIPE_BULK_MAX_ITEMS
+    )
+
+
+class TagSerializer(UniqueNameMixin, serializers.ModelSerializer):
     '''serializer for tags'''
 
     class Meta:
@@ -12,7 +43,7 @@ class TagSerializer(serializers.ModelSerializer):
         read_only_fields = ('id',)
 
 
-class IngredientSerializer(serializers.ModelSerializer):
+class IngredientSerializer(UniqueNameMixin, serializers.ModelSerializer):
     '''serializer for ingredients'''
 
     class Meta:
@@ -21,7 +52,31 @@ class IngredientSerializer(serializers.ModelSerializer):
         read_only_fields = ('id',)
 
 
-class RecipeSerializer(serializers.ModelSerializer):
+class RecipeImageRenditionSerializer(serializers.ModelSerializer):
+    '''serializer for a resized copy of a recipe image'''
+    url = serializers.ImageField(source='image', read_only=True)
+
+    class Meta:
+        model = RecipeImageRendition
+        fields = ('size', 'format', 'url', 'width', 'height')
+        read_only_fields = fields
+
+
+class SparseFieldsMixin:
+    '''serialize only the fields named in the context's fields set
+
+    The view puts the names from ?fields= there, or None for all fields.
+    '''
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        requested = self.context.get('fields')
+        if requested is not None:
+            for name in set(self.fields) - set(requested):
+                self.fields.pop(name)
+
+
+class RecipeSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     '''serializer for recipe'''
 
     ingredients = serializers.PrimaryKeyRelatedField(
@@ -34,10 +89,12 @@ class RecipeSerializer(serializers.ModelSerializer):
         queryset=Tag.objects.all()
     )
 
+    renditions = RecipeImageRenditionSerializer(many=True, read_only=True)
+
     class Meta:
         model = Recipe
         fields = ('id', 'title', 'time_minutes', 'price', 'tags',
-                  'ingredients', 'link')
+                  'ingredients', 'link', 'renditions')
         read_only_fields = ('id',)
 
 
@@ -47,9 +104,49 @@ class RecipeDetailSerializer(RecipeSerializer):
     tags = TagSerializer(many=True, read_only=True)
 
 
+class RecipeBulkItemSerializer(serializers.ModelSerializer):
+    '''serializer for one recipe of a batch, validated without queries'''
+    ingredients = serializers.ListField(
+        child=serializers.IntegerField(),
+        required=False
+    )
+    tags = serializers.ListField(
+        child=serializers.IntegerField(),
+        required=False
+    )
+
+    class Meta:
+        model = Recipe
+        fields = ('id', 'title', 'time_minutes', 'price', 'tags',
+                  'ingredients', 'link')
+        read_only_fields = ('id',)
+
+
 class RecipeImageSerializer(serializers.ModelSerializer):
     ''''''
+    renditions = RecipeImageRenditionSerializer(many=True, read_only=True)
+
     class Meta:
         model = Recipe
-        fields = ('id', 'image')
+        fields = ('id', 'image', 'renditions')
         read_only_fields = ('id',)
+
+    def validate_image(self, value):
+        '''refuse oversize images and downscale large ones'''
+        try:
+            return uploads.ingest_image(value)
+        except uploads.ImageTooLarge as exc:
+            raise serializers.ValidationError(str(exc))
+
+    def update(self, instance, validated_data):
+        '''store the image by content, releasing the one it replaces'''
+        if 'image' not in validated_data:
+            return instance
+        image = validated_data['image']
+        with transaction.atomic():
+            previous = instance.image.name
+            instance.image = imagestore.store(image) if image else None
+            instance.save(update_fields=['image', 'updated_at'])
+            imagestore.release(previous)
+
+        return instance
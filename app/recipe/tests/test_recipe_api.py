@@ -1,9 +1,15 @@
+import csv
+import json
 import tempfile
 import os
+from base64 import b64decode
+from urllib.parse import parse_qs, urlparse
+from unittest.mock import patch
 
 from PIL import Image
 
-from django.test import TestCase
+from django.core.files.storage import default_storage
+from django.test import TestCase, override_settings
 from django.contrib.auth import get_user_model
 
 from django.urls import reverse
@@ -11,12 +17,17 @@ from django.urls import reverse
 from rest_framework import status
 from rest_framework.test import APIClient
 
-from core.models import Recipe, Tag, Ingredient
+from core import search
+from core.models import Recipe, RecipeImageRendition, Tag, Ingredient, \
+    StoredImage
+from core.tests.utils import QueryBudgetMixin
 
 from recipe.serializers import RecipeSerializer, RecipeDetailSerializer
 
 
 RECIPES_URL = reverse('recipe:recipe-list')
+BULK_URL = reverse('recipe:recipe-bulk-create')
+EXPORT_URL = reverse('recipe:recipe-export')
 
 
 def image_upload_url(recipe_id):
@@ -85,7 +96,7 @@ class PrivateRecipeApiTests(TestCase):
         recipes = Recipe.objects.all().order_by('-id')
         serializer = RecipeSerializer(recipes, many=True)
         self.assertEqual(res.status_code, status.HTTP_200_OK)
-        self.assertEqual(res.data, serializer.data)
+        self.assertEqual(res.data['results'], serializer.data)
 
     def test_ingredients_limited_to_user(self):
         '''test recipes are limited to the authenticated user'''
@@ -103,8 +114,8 @@ class PrivateRecipeApiTests(TestCase):
         serializer = RecipeSerializer(recipes, many=True)
 
         self.assertEqual(res.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(res.data), 1)
-        self.assertEqual(res.data, serializer.data)
+        self.assertEqual(len(res.data['results']), 1)
+        self.assertEqual(res.data['results'], serializer.data)
 
     def test_view_recipe_detail(self):
         '''viewing a recipe detail'''
@@ -205,6 +216,51 @@ class PrivateRecipeApiTests(TestCase):
         tags = recipe.tags.all()
         self.assertEqual(len(tags), 0)
 
+    def test_recipe_list_paginated(self):
+        '''test recipes are paged newest first by cursor'''
+        recipes = [sample_recipe(user=self.user) for _ in range(5)]
+
+        res = self.client.get(RECIPES_URL, {'page_size': 2})
+        first = [recipe['id'] for recipe in res.data['results']]
+        res = self.client.get(res.data['next'])
+        second = [recipe['id'] for recipe in res.data['results']]
+        res = self.client.get(res.data['next'])
+        third = [recipe['id'] for recipe in res.data['results']]
+
+        ids = [recipe.id for recipe in reversed(recipes)]
+        self.assertEqual(first + second + third, ids)
+        self.assertIsNone(res.data['next'])
+
+    def test_recipe_list_page_size_capped(self):
+        '''test clients cannot request pages above the configured cap'''
+        for _ in range(3):
+            sample_recipe(user=self.user)
+
+        with patch('recipe.pagination.RecipePagination.max_page_size', 2):
+            res = self.client.get(RECIPES_URL, {'page_size': 100})
+
+        self.assertEqual(len(res.data['results']), 2)
+        self.assertIsNotNone(res.data['next'])
+
+    def test_recipe_filter_kept_across_pages(self):
+        '''test the next page link keeps the tag filter'''
+        tag = sample_tag(user=self.user)
+        for _ in range(3):
+            sample_recipe(user=self.user).tags.add(tag)
+        sample_recipe(user=self.user)
+
+        res = self.client.get(RECIPES_URL, {'tags': tag.id, 'page_size': 2})
+        res = self.client.get(res.data['next'])
+
+        self.assertEqual(len(res.data['results']), 1)
+        self.assertIsNone(res.data['next'])
+
+    def test_invalid_cursor(self):
+        '''test a garbled cursor is rejected'''
+        res = self.client.get(RECIPES_URL, {'cursor': 'bz1hYmM='})
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
 
 class RecipeImageUploadTests(TestCase):
 
@@ -232,12 +288,106 @@ class RecipeImageUploadTests(TestCase):
             self.assertIn('image', res.data)
             self.assertTrue(os.path.exists(self.recipe.image.path))
 
+    @patch('core.images.queue_renditions')
+    def test_upload_image_queues_renditions(self, queue):
+        '''test renditions are queued rather than made in the request'''
+        url = image_upload_url(self.recipe.id)
+        with tempfile.NamedTemporaryFile(suffix='.jpg') as ntf:
+            Image.new('RGB', (10, 10)).save(ntf, format='JPEG')
+            ntf.seek(0)
+            res = self.client.post(url, {'image': ntf}, format='multipart')
+        self.recipe.refresh_from_db()
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        queue.assert_called_once_with(self.recipe.id)
+        self.assertEqual(res.data['renditions'], [])
+
     def test_upload_image_bad_request(self):
         url = image_upload_url(self.recipe.id)
         res = self.client.post(url, {'image': 'notimage'}, format='multipart')
 
         self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
 
+    def _upload(self, width, height):
+        url = image_upload_url(self.recipe.id)
+        with tempfile.NamedTemporaryFile(suffix='.png') as ntf:
+            Image.new('RGB', (width, height), 'red').save(ntf, format='PNG')
+            ntf.seek(0)
+            res = self.client.post(url, {'image': ntf}, format='multipart')
+        self.recipe.refresh_from_db()
+        return res
+
+    def test_upload_same_image_shares_file(self):
+        '''test recipes with identical images share one stored file'''
+        other = sample_recipe(user=self.user, title='Other')
+        self._upload(10, 10)
+        url = image_upload_url(other.id)
+        with tempfile.NamedTemporaryFile(suffix='.png') as ntf:
+            Image.new('RGB', (10, 10), 'red').save(ntf, format='PNG')
+            ntf.seek(0)
+            self.client.post(url, {'image': ntf}, format='multipart')
+        other.refresh_from_db()
+
+        self.assertEqual(other.image.name, self.recipe.image.name)
+        self.assertEqual(
+            StoredImage.objects.get(name=self.recipe.image.name).ref_count, 2
+        )
+
+    def test_replace_image_releases_previous(self):
+        '''test replacing an image releases the previous one'''
+        self._upload(10, 10)
+        first = self.recipe.image.name
+
+        self._upload(12, 12)
+
+        self.assertNotEqual(self.recipe.image.name, first)
+        self.assertEqual(StoredImage.objects.get(name=first).ref_count, 0)
+        default_storage.delete(first)
+
+    @override_settings(RECIPE_IMAGE_MAX_UPLOAD_SIZE=100)
+    def test_upload_image_too_large(self):
+        '''test uploads over the size cap are refused'''
+        res = self._upload(200, 200)
+
+        self.assertEqual(res.status_code,
+                         status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        self.assertFalse(self.recipe.image)
+
+    @override_settings(RECIPE_IMAGE_MAX_PIXELS=100)
+    def test_upload_image_too_many_pixels(self):
+        '''test images with too many pixels are refused undecoded'''
+        res = self._upload(20, 20)
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('image', res.data)
+        self.assertFalse(self.recipe.image)
+
+    def test_upload_large_png_refused_undecoded(self):
+        '''test formats that decode in full have a lower pixel cap'''
+        url = image_upload_url(self.recipe.id)
+        with tempfile.NamedTemporaryFile(suffix='.png') as ntf:
+            Image.new('L', (5000, 3000)).save(ntf, format='PNG')
+            ntf.seek(0)
+            with patch('PIL.ImageFile.ImageFile.load') as load:
+                res = self.client.post(url, {'image': ntf},
+                                       format='multipart')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('PNG', str(res.data['image']))
+        load.assert_not_called()
+        self.recipe.refresh_from_db()
+        self.assertFalse(self.recipe.image)
+
+    @override_settings(RECIPE_IMAGE_INGEST_MAX_EDGE=50)
+    def test_upload_image_downscaled(self):
+        '''test images over the edge limit are stored downscaled'''
+        res = self._upload(200, 100)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        with Image.open(self.recipe.image.path) as image:
+            self.assertEqual(image.size, (50, 25))
+            self.assertEqual(image.format, 'PNG')
+
     def test_filter_recipes_by_tags(self):
         ''' test filtering the list by a certain tag'''
         recipe1 = sample_recipe(user=self.user, title='thai curry')
@@ -257,9 +407,9 @@ class RecipeImageUploadTests(TestCase):
         serializer2 = RecipeSerializer(recipe2)
         serializer3 = RecipeSerializer(recipe3)
 
-        self.assertIn(serializer1.data, res.data)
-        self.assertIn(serializer2.data, res.data)
-        self.assertNotIn(serializer3.data, res.data)
+        self.assertIn(serializer1.data, res.data['results'])
+        self.assertIn(serializer2.data, res.data['results'])
+        self.assertNotIn(serializer3.data, res.data['results'])
 
     def test_filter_recipes_by_ingredients(self):
         '''test filtering the list by a certain ingredient'''
@@ -280,6 +430,571 @@ class RecipeImageUploadTests(TestCase):
         serializer2 = RecipeSerializer(recipe2)
         serializer3 = RecipeSerializer(recipe3)
 
-        self.assertIn(serializer1.data, res.data)
-        self.assertIn(serializer2.data, res.data)
-        self.assertNotIn(serializer3.data, res.data)
+        self.assertIn(serializer1.data, res.data['results'])
+        self.assertIn(serializer2.data, res.data['results'])
+        self.assertNotIn(serializer3.data, res.data['results'])
+
+
+class RecipeQueryBudgetTests(QueryBudgetMixin, TestCase):
+    '''test recipe endpoints make a fixed number of queries'''
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'tester@test.com',
+            'password'
+        )
+        self.client.force_authenticate(self.user)
+        self.tag = sample_tag(user=self.user)
+        self.ingredient = sample_ingredient(user=self.user)
+
+    def add_recipes(self, count):
+        '''create recipes linked to a fresh tag and ingredient each'''
+        for _ in range(count):
+            recipe = sample_recipe(user=self.user)
+            recipe.tags.add(
+                self.tag, sample_tag(user=self.user, name=f'tag {recipe.id}')
+            )
+            recipe.ingredients.add(
+                self.ingredient,
+                sample_ingredient(
+                    user=self.user, name=f'ingredient {recipe.id}'
+                )
+            )
+
+    def test_list_queries_do_not_scale(self):
+        '''test listing recipes prefetches tags and ingredients'''
+        self.assertQueriesDoNotScale(
+            lambda: self.client.get(RECIPES_URL),
+            self.add_recipes
+        )
+
+    def test_filtered_list_queries_do_not_scale(self):
+        '''test filtering recipes keeps the query count flat'''
+        params = {
+            'tags': str(self.tag.id),
+            'ingredients': str(self.ingredient.id)
+        }
+        self.assertQueriesDoNotScale(
+            lambda: self.client.get(RECIPES_URL, params),
+            self.add_recipes
+        )
+
+    def test_filter_returns_each_recipe_once(self):
+        '''test a recipe matching several filter ids is not repeated'''
+        self.add_recipes(1)
+        recipe = Recipe.objects.get(user=self.user)
+        tag_ids = ','.join(str(tag.id) for tag in recipe.tags.all())
+
+        res = self.client.get(RECIPES_URL, {'tags': tag_ids})
+
+        self.assertEqual(len(res.data['results']), 1)
+
+    def test_detail_query_budget(self):
+        '''test recipe detail fetches its relations in fixed queries'''
+        self.add_recipes(1)
+        recipe = Recipe.objects.get(user=self.user)
+
+        # the version lookup for conditional GETs, then the recipe
+        res = self.assertQueryBudget(
+            5, self.client.get, detail_url(recipe.id)
+        )
+
+        self.assertEqual(len(res.data['tags']), 2)
+        self.assertEqual(len(res.data['ingredients']), 2)
+
+
+class RecipeConditionalGetTests(QueryBudgetMixin, TestCase):
+    '''test unchanged recipes are answered with 304 Not Modified'''
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'tester@test.com',
+            'password'
+        )
+        self.client.force_authenticate(self.user)
+        self.recipe = sample_recipe(user=self.user)
+
+    def test_list_not_modified(self):
+        '''test a current list ETag gets a 304 for one query'''
+        etag = self.client.get(RECIPES_URL)['ETag']
+
+        res = self.assertQueryBudget(
+            1, self.client.get, RECIPES_URL, HTTP_IF_NONE_MATCH=etag
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(res['Cache-Control'], 'private, no-cache')
+
+    def test_list_etag_per_query(self):
+        '''test each page, filter and user gets its own ETag'''
+        other = get_user_model().objects.create_user('o@test.com', 'pass')
+        sample_recipe(user=other)
+        etag = self.client.get(RECIPES_URL)['ETag']
+
+        filtered = self.client.get(RECIPES_URL, {'q': 'steak'},
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.client.force_authenticate(other)
+        other_user = self.client.get(RECIPES_URL, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(filtered.status_code, status.HTTP_200_OK)
+        self.assertEqual(other_user.status_code, status.HTTP_200_OK)
+
+    def test_list_modified_by_tag_link(self):
+        '''test linking a tag changes the list ETag'''
+        etag = self.client.get(RECIPES_URL)['ETag']
+
+        self.recipe.tags.add(sample_tag(user=self.user))
+        res = self.client.get(RECIPES_URL, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(res.data['results'][0]['tags']), 1)
+
+    def test_detail_not_modified(self):
+        '''test a current detail ETag or date gets a 304'''
+        url = detail_url(self.recipe.id)
+        first = self.client.get(url)
+
+        by_etag = self.assertQueryBudget(
+            1, self.client.get, url, HTTP_IF_NONE_MATCH=first['ETag']
+        )
+        by_date = self.client.get(
+            url, HTTP_IF_MODIFIED_SINCE=first['Last-Modified']
+        )
+
+        self.assertEqual(by_etag.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(by_date.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_detail_modified_by_tag_rename(self):
+        '''test renaming a linked tag changes the detail ETag'''
+        tag = sample_tag(user=self.user)
+        self.recipe.tags.add(tag)
+        url = detail_url(self.recipe.id)
+        etag = self.client.get(url)['ETag']
+
+        tag.name = 'Starter'
+        tag.save()
+        res = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['tags'][0]['name'], 'Starter')
+
+    def test_detail_missing(self):
+        '''test a missing recipe is still a 404'''
+        res = self.client.get(detail_url(self.recipe.id + 1))
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_detail_malformed_id(self):
+        '''test a non-numeric id is a 404, not a server error'''
+        res = self.client.get(detail_url('abc'))
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class RecipeSparseFieldsTests(QueryBudgetMixin, TestCase):
+    '''test ?fields= trims the response and the queries behind it'''
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'tester@test.com',
+            'password'
+        )
+        self.client.force_authenticate(self.user)
+        self.recipe = sample_recipe(user=self.user, link='http://x.test')
+        self.recipe.tags.add(sample_tag(user=self.user))
+
+    def test_list_fields(self):
+        '''test listing only some fields skips the relation queries'''
+        # the version lookup for conditional GETs, then the page
+        res = self.assertQueryBudget(
+            2, self.client.get, RECIPES_URL, {'fields': 'id,title,price'}
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(set(res.data['results'][0]),
+                         {'id', 'title', 'price'})
+        with self.assertNumQueries(2) as queries:
+            self.client.get(RECIPES_URL, {'fields': 'title'})
+        self.assertNotIn('"link"', queries.captured_queries[-1]['sql'])
+
+    def test_list_requested_relation(self):
+        '''test a list can ask for just some fields and relations'''
+        res = self.client.get(RECIPES_URL, {'fields': 'title,tags'})
+
+        self.assertEqual(set(res.data['results'][0]), {'title', 'tags'})
+        self.assertEqual(len(res.data['results'][0]['tags']), 1)
+
+    def test_detail_fields(self):
+        '''test the detail view honours ?fields='''
+        res = self.client.get(detail_url(self.recipe.id),
+                              {'fields': 'title,tags'})
+
+        self.assertEqual(set(res.data), {'title', 'tags'})
+        self.assertEqual(res.data['tags'][0]['name'], 'Main course')
+
+    def test_unknown_field(self):
+        '''test asking for an unknown field is a bad request'''
+        res = self.client.get(RECIPES_URL, {'fields': 'title,secret'})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('fields', res.data)
+
+    def test_fields_ignored_on_update(self):
+        '''test writes still return every field'''
+        res = self.client.patch(
+            f'{detail_url(self.recipe.id)}?fields=title', {'title': 'Stew'}
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertIn('price', res.data)
+
+
+class RecipeLeanListTests(QueryBudgetMixin, TestCase):
+    '''test the values() list path renders exactly what serializers do'''
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'tester@test.com',
+            'password'
+        )
+        self.client.force_authenticate(self.user)
+        for i in range(3):
+            recipe = sample_recipe(user=self.user, title=f'Curry {i}',
+                                   price='7.5', link=f'http://x.test/{i}')
+            recipe.tags.add(sample_tag(user=self.user, name=f'Tag {i}'),
+                            sample_tag(user=self.user, name=f'Hot {i}'))
+            recipe.ingredients.add(
+                sample_ingredient(user=self.user, name=f'Rice {i}')
+            )
+        RecipeImageRendition.objects.create(
+            recipe=recipe, size='thumb', format='webp',
+            image='uploads/recipe/renditions/a.webp', width=10, height=8
+        )
+        sample_recipe(user=self.user, title='Plain curry')
+
+    def assertSameContent(self, *args, **kwargs):
+        expected = self.client.get(*args, **kwargs)
+        with self.settings(API_LEAN_LISTS=True):
+            res = self.client.get(*args, **kwargs)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.content, expected.content)
+        return res
+
+    def test_list_matches_serializers(self):
+        '''test lean rows render like the serializers'''
+        res = self.assertSameContent(RECIPES_URL)
+
+        self.assertEqual(len(res.data['results']), 4)
+
+    def test_paged_search_and_fields_match_serializers(self):
+        '''test lean pages, searches and fieldsets match too'''
+        first = self.assertSameContent(RECIPES_URL, {'page_size': 2})
+        self.assertSameContent(first.data['next'])
+        self.assertSameContent(RECIPES_URL, {'q': 'curry', 'page_size': 3})
+        self.assertSameContent(RECIPES_URL, {'fields': 'title,price,tags'})
+
+    @override_settings(API_LEAN_LISTS=True)
+    def test_list_query_budget(self):
+        '''test the lean path does not query per recipe'''
+        # version, page, tag links, ingredient links, renditions
+        res = self.assertQueryBudget(5, self.client.get, RECIPES_URL)
+
+        self.assertEqual(len(res.data['results']), 4)
+
+
+class RecipeExportTests(QueryBudgetMixin, TestCase):
+    '''test streaming a user's recipes as NDJSON or CSV'''
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'tester@test.com',
+            'password'
+        )
+        self.client.force_authenticate(self.user)
+        self.recipe = sample_recipe(user=self.user, title='Curry, hot')
+        self.recipe.tags.add(sample_tag(user=self.user, name='Vegan'),
+                             sample_tag(user=self.user, name='Quick'))
+        self.recipe.ingredients.add(sample_ingredient(user=self.user))
+
+    def export(self, **params):
+        res = self.client.get(EXPORT_URL, params)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        return res, b''.join(res.streaming_content).decode()
+
+    def test_export_ndjson(self):
+        '''test the user's recipes export as one JSON object a line'''
+        other = get_user_model().objects.create_user('o@test.com', 'pass')
+        sample_recipe(user=other)
+        sample_recipe(user=self.user, title='Toast')
+
+        res, body = self.export(format='ndjson')
+
+        self.assertTrue(res['Content-Type'].startswith('application/x-ndjson'))
+        self.assertIn('recipes.ndjson', res['Content-Disposition'])
+        rows = [json.loads(line) for line in body.splitlines()]
+        self.assertEqual([row['title'] for row in rows],
+                         ['Curry, hot', 'Toast'])
+        self.assertEqual(rows[0], {
+            'id': self.recipe.id,
+            'title': 'Curry, hot',
+            'time_minutes': 10,
+            'price': '5.00',
+            'link': '',
+            'tags': ['Quick', 'Vegan'],
+            'ingredients': ['cinnamon'],
+        })
+
+    def test_export_csv(self):
+        '''test the export as CSV with joined tag and ingredient names'''
+        res, body = self.export(format='csv')
+
+        self.assertTrue(res['Content-Type'].startswith('text/csv'))
+        rows = list(csv.reader(body.splitlines()))
+        self.assertEqual(rows[0], ['id', 'title', 'time_minutes', 'price',
+                                   'link', 'tags', 'ingredients'])
+        self.assertEqual(rows[1], [str(self.recipe.id), 'Curry, hot', '10',
+                                   '5.00', '', 'Quick; Vegan', 'cinnamon'])
+
+    @override_settings(RECIPE_EXPORT_CHUNK_SIZE=2)
+    def test_export_in_chunks(self):
+        '''test recipes are read in fixed size chunks'''
+        for i in range(4):
+            sample_recipe(user=self.user, title=f'Soup {i}')
+        res = self.client.get(EXPORT_URL, {'format': 'ndjson'})
+
+        # three chunks of three queries, then the empty chunk
+        lines = self.assertQueryBudget(10, list, res.streaming_content)
+
+        self.assertEqual(len(lines), 5)
+
+    def test_export_unknown_format(self):
+        '''test an unknown export format is a 404'''
+        res = self.client.get(EXPORT_URL, {'format': 'xml'})
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_export_login_required(self):
+        '''test exporting requires authentication'''
+        self.client.force_authenticate(None)
+
+        res = self.client.get(EXPORT_URL, {'format': 'ndjson'})
+
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class RecipeBulkCreateTests(QueryBudgetMixin, TestCase):
+    '''test creating recipes in batches'''
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'tester@test.com',
+            'password'
+        )
+        self.client.force_authenticate(self.user)
+        self.tag = sample_tag(user=self.user)
+        self.ingredient = sample_ingredient(user=self.user)
+
+    def payload(self, count):
+        return [{
+            'title': f'recipe {i}',
+            'time_minutes': 10 + i,
+            'price': '4.50',
+            'tags': [self.tag.id],
+            'ingredients': [self.ingredient.id],
+        } for i in range(count)]
+
+    def test_bulk_create_recipes(self):
+        '''test a batch of recipes and their links are created'''
+        res = self.client.post(BULK_URL, self.payload(3), format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(res.data), 3)
+        for item in res.data:
+            recipe = Recipe.objects.get(id=item['id'])
+            self.assertEqual(recipe.title, item['title'])
+            self.assertEqual(list(recipe.tags.all()), [self.tag])
+            self.assertEqual(
+                list(recipe.ingredients.all()), [self.ingredient]
+            )
+
+    def test_bulk_create_queries_do_not_scale(self):
+        '''test batch size does not change the number of statements'''
+        small = self.count_queries(
+            self.client.post, BULK_URL, self.payload(2), format='json'
+        )
+        large = self.count_queries(
+            self.client.post, BULK_URL, self.payload(20), format='json'
+        )
+
+        self.assertEqual(small, large)
+
+    def test_bulk_create_reports_item_errors(self):
+        '''test invalid items are reported and valid ones still created'''
+        other = get_user_model().objects.create_user(
+            'other@test.com',
+            'password'
+        )
+        foreign_tag = sample_tag(user=other)
+        payload = self.payload(3)
+        payload[1]['title'] = ''
+        payload[2]['tags'] = [foreign_tag.id]
+
+        res = self.client.post(BULK_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertIn('id', res.data[0])
+        self.assertIn('title', res.data[1]['errors'])
+        self.assertIn('tags', res.data[2]['errors'])
+        self.assertEqual(Recipe.objects.filter(user=self.user).count(), 1)
+
+    def test_bulk_create_rejects_non_list(self):
+        '''test the batch must be a list'''
+        res = self.client.post(BULK_URL, {'title': 'x'}, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_bulk_create_size_capped(self):
+        '''test batches above the configured size are rejected'''
+        with self.settings(RECIPE_BULK_MAX_ITEMS=2):
+            res = self.client.post(BULK_URL, self.payload(3), format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Recipe.objects.exists())
+
+
+class RecipeSearchTests(TestCase):
+    '''test full-text recipe search'''
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'tester@test.com',
+            'password'
+        )
+        self.client.force_authenticate(self.user)
+
+    def search(self, text, **params):
+        res = self.client.get(RECIPES_URL, dict(q=text, **params))
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        return res
+
+    def titles(self, res):
+        return [recipe['title'] for recipe in res.data['results']]
+
+    def test_search_title_tags_and_ingredients(self):
+        '''test search matches titles, tag names and ingredient names'''
+        curry = sample_recipe(user=self.user, title='Thai green curry')
+        soup = sample_recipe(user=self.user, title='Tomato soup')
+        soup.tags.add(sample_tag(user=self.user, name='Spicy'))
+        stew = sample_recipe(user=self.user, title='Bean stew')
+        stew.ingredients.add(sample_ingredient(user=self.user, name='chilli'))
+
+        self.assertEqual(self.titles(self.search('curry')), [curry.title])
+        self.assertEqual(self.titles(self.search('spicy')), [soup.title])
+        self.assertEqual(self.titles(self.search('CHILLI')), [stew.title])
+        self.assertEqual(self.titles(self.search('pizza')), [])
+
+    def test_search_limited_to_user(self):
+        '''test other users' recipes are never returned'''
+        other = get_user_model().objects.create_user(
+            'other@test.com',
+            'password'
+        )
+        sample_recipe(user=other, title='Lemon tart')
+
+        self.assertEqual(self.titles(self.search('lemon')), [])
+
+    def test_search_ranks_title_matches_first(self):
+        '''test a title match outranks a tag match'''
+        tagged = sample_recipe(user=self.user, title='Brownies')
+        tagged.tags.add(sample_tag(user=self.user, name='chocolate'))
+        titled = sample_recipe(user=self.user, title='Chocolate cake')
+
+        res = self.search('chocolate')
+
+        self.assertEqual(self.titles(res), [titled.title, tagged.title])
+
+    def test_search_paginated(self):
+        '''test search results are paged by rank without repeats'''
+        for i in range(5):
+            sample_recipe(user=self.user, title=f'Pancakes {i}')
+
+        res = self.search('pancakes', page_size=2)
+        titles = self.titles(res)
+        while res.data['next']:
+            res = self.client.get(res.data['next'])
+            titles += self.titles(res)
+
+        self.assertEqual(len(titles), 5)
+        self.assertEqual(len(set(titles)), 5)
+
+    def test_search_cursor_tie_safe(self):
+        '''test equally ranked results page by position, not offset'''
+        recipes = [sample_recipe(user=self.user, title='Waffles')
+                   for _ in range(4)]
+
+        res = self.search('waffles', page_size=2)
+        cursor = parse_qs(urlparse(res.data['next']).query)['cursor'][0]
+        position = parse_qs(b64decode(cursor).decode())
+        second = self.client.get(res.data['next'])
+
+        self.assertNotIn('o', position)
+        self.assertEqual(
+            [recipe['id'] for recipe in
+             res.data['results'] + second.data['results']],
+            [recipe.id for recipe in reversed(recipes)]
+        )
+
+    def test_index_follows_changes(self):
+        '''test renames and relinks update the index incrementally'''
+        recipe = sample_recipe(user=self.user, title='Porridge')
+        tag = sample_tag(user=self.user, name='Breakfast')
+        recipe.tags.add(tag)
+        self.assertEqual(len(self.titles(self.search('breakfast'))), 1)
+
+        tag.name = 'Brunch'
+        tag.save()
+        self.assertEqual(self.titles(self.search('breakfast')), [])
+        self.assertEqual(len(self.titles(self.search('brunch'))), 1)
+
+        recipe.tags.clear()
+        self.assertEqual(self.titles(self.search('brunch')), [])
+
+        recipe.title = 'Oatmeal'
+        recipe.save()
+        self.assertEqual(self.titles(self.search('porridge')), [])
+        self.assertEqual(len(self.titles(self.search('oatmeal'))), 1)
+
+        recipe.delete()
+        self.assertEqual(self.titles(self.search('oatmeal')), [])
+
+    def test_deferred_indexing_keeps_database(self):
+        '''test deferred recipes are indexed on the database they used'''
+        with patch('core.search.connections') as connections:
+            with search.deferred_indexing():
+                search.index_recipes([1], 'other')
+                with search.deferred_indexing():
+                    search.index_recipes([3, 2])
+                search.index_recipes([2])
+                connections.__getitem__.assert_not_called()
+
+        self.assertEqual(
+            sorted(call[0][0] for call
+                   in connections.__getitem__.call_args_list),
+            ['default', 'other']
+        )
+
+    def test_search_ignores_query_syntax(self):
+        '''test punctuation in the query is treated as plain text'''
+        sample_recipe(user=self.user, title='Mac and cheese')
+
+        res = self.search('"cheese* (')
+
+        self.assertEqual(self.titles(res), ['Mac and cheese'])
@@ -6,10 +6,12 @@ from rest_framework import status
 from rest_framework.test import APIClient
 
 from core.models import Tag, Recipe
+from core.tests.utils import QueryBudgetMixin
 
 from recipe.serializers import TagSerializer
 
 TAGS_URL = reverse('recipe:tag-list')
+TAGS_BULK_URL = reverse('recipe:tag-bulk-get-or-create')
 
 
 class PublicTagspiTests(TestCase):
@@ -24,7 +26,7 @@ class PublicTagspiTests(TestCase):
         self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
 
 
-class PrivateTagspiTests(TestCase):
+class PrivateTagspiTests(QueryBudgetMixin, TestCase):
     ''''''
 
     def setUp(self):
@@ -46,7 +48,7 @@ class PrivateTagspiTests(TestCase):
         serializer = TagSerializer(tags, many=True)
 
         self.assertEqual(res.status_code, status.HTTP_200_OK)
-        self.assertEqual(res.data, serializer.data)
+        self.assertEqual(res.data['results'], serializer.data)
 
     def test_tags_limited_to_user(self):
         ''''''
@@ -60,8 +62,8 @@ class PrivateTagspiTests(TestCase):
         res = self.client.get(TAGS_URL)
 
         self.assertEqual(res.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(res.data), 1)
-        self.assertEqual(res.data[0]['name'], tag.name)
+        self.assertEqual(len(res.data['results']), 1)
+        self.assertEqual(res.data['results'][0]['name'], tag.name)
 
     def test_create_tag_successful(self):
         '''test crreating nwe tag'''
@@ -94,8 +96,8 @@ class PrivateTagspiTests(TestCase):
 
         serializer1 = TagSerializer(tag1)
         serializer2 = TagSerializer(tag2)
-        self.assertIn(serializer1.data, res.data)
-        self.assertNotIn(serializer2.data, res.data)
+        self.assertIn(serializer1.data, res.data['results'])
+        self.assertNotIn(serializer2.data, res.data['results'])
 
     def test_retrieve_tags_assigned_unique(self):
         ''''''
@@ -118,4 +120,138 @@ class PrivateTagspiTests(TestCase):
 
         res = self.client.get(TAGS_URL, {'assigned_only': 1})
 
-        self.assertEqual(len(res.data), 1)
+        self.assertEqual(len(res.data['results']), 1)
+
+    def test_tags_paginated_with_assigned_only(self):
+        '''test assigned tags are paged by name'''
+        recipe = Recipe.objects.create(
+            user=self.user,
+            title='Omelette',
+            price=4.00,
+            time_minutes=5
+        )
+        for name in ('breakfast', 'eggs', 'quick'):
+            recipe.tags.add(Tag.objects.create(user=self.user, name=name))
+        Tag.objects.create(user=self.user, name='unused')
+
+        res = self.client.get(TAGS_URL, {'assigned_only': 1, 'page_size': 2})
+        names = [tag['name'] for tag in res.data['results']]
+        res = self.client.get(res.data['next'])
+        names += [tag['name'] for tag in res.data['results']]
+
+        self.assertEqual(names, ['quick', 'eggs', 'breakfast'])
+        self.assertIsNone(res.data['next'])
+
+    def test_create_duplicate_tag_rejected(self):
+        '''test a tag name differing only by case is rejected'''
+        Tag.objects.create(user=self.user, name='Vegan')
+
+        res = self.client.post(TAGS_URL, {'name': 'vegan'})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Tag.objects.filter(user=self.user).count(), 1)
+
+    def test_duplicate_names_allowed_across_users(self):
+        '''test another user's tag name does not block creation'''
+        user2 = get_user_model().objects.create_user(
+            'other@test.com',
+            'password'
+        )
+        Tag.objects.create(user=user2, name='vegan')
+
+        res = self.client.post(TAGS_URL, {'name': 'vegan'})
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+
+    def test_bulk_get_or_create_tags(self):
+        '''test names resolve to existing tags and missing ones are made'''
+        existing = Tag.objects.create(user=self.user, name='Dessert')
+
+        res = self.assertQueryBudget(
+            5,
+            self.client.post,
+            TAGS_BULK_URL,
+            {'names': ['dessert', 'vegan', 'quick', 'vegan']},
+            format='json'
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        ids = res.data['ids']
+        self.assertEqual(ids['dessert'], existing.id)
+        self.assertEqual(sorted(res.data['created']), ['quick', 'vegan'])
+        self.assertEqual(Tag.objects.get(id=ids['vegan']).name, 'vegan')
+        self.assertEqual(Tag.objects.filter(user=self.user).count(), 3)
+
+    def test_bulk_get_or_create_existing_only(self):
+        '''test resolving only existing names creates nothing'''
+        tag = Tag.objects.create(user=self.user, name='vegan')
+
+        res = self.client.post(TAGS_BULK_URL, {'names': ['vegan']},
+                               format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data, {'ids': {'vegan': tag.id}, 'created': []})
+
+    def test_bulk_get_or_create_invalid(self):
+        '''test an empty batch is rejected'''
+        res = self.client.post(TAGS_BULK_URL, {'names': []}, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_unchanged_list_not_modified(self):
+        '''test an unchanged tag list is answered with 304 in one query'''
+        Tag.objects.create(user=self.user, name='vegan')
+        etag = self.client.get(TAGS_URL)['ETag']
+
+        res = self.assertQueryBudget(
+            1, self.client.get, TAGS_URL, HTTP_IF_NONE_MATCH=etag
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(res['ETag'], etag)
+
+    def test_changed_list_modified(self):
+        '''test adding, renaming or deleting a tag changes the ETag'''
+        tag = Tag.objects.create(user=self.user, name='vegan')
+        etags = [self.client.get(TAGS_URL)['ETag']]
+        other = Tag.objects.create(user=self.user, name='dessert')
+        etags.append(self.client.get(TAGS_URL)['ETag'])
+        other.delete()
+        etags.append(self.client.get(TAGS_URL)['ETag'])
+        tag.name = 'vegetarian'
+        tag.save()
+
+        res = self.client.get(TAGS_URL, HTTP_IF_NONE_MATCH=etags[-1])
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(etags[0], etags[1])
+        self.assertNotEqual(etags[1], etags[2])
+        self.assertNotEqual(etags[2], res['ETag'])
+
+    def test_assigned_only_etag_follows_links(self):
+        '''test assigning a tag changes the assigned_only ETag'''
+        tag = Tag.objects.create(user=self.user, name='vegan')
+        recipe = Recipe.objects.create(user=self.user, title='Salad',
+                                       time_minutes=5, price=3)
+        url = f'{TAGS_URL}?assigned_only=1'
+        etag = self.client.get(url)['ETag']
+
+        recipe.tags.add(tag)
+        res = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(res.data['results']), 1)
+
+    def test_lean_list_matches_serializers(self):
+        '''test the values() list path renders exactly what serializers do'''
+        tag = Tag.objects.create(user=self.user, name='vegan')
+        Tag.objects.create(user=self.user, name='dessert')
+        recipe = Recipe.objects.create(user=self.user, title='Salad',
+                                       time_minutes=5, price=3)
+        recipe.tags.add(tag)
+        for params in ({}, {'assigned_only': 1}, {'page_size': 1}):
+            expected = self.client.get(TAGS_URL, params)
+            with self.settings(API_LEAN_LISTS=True):
+                res = self.client.get(TAGS_URL, params)
+
+            self.assertEqual(res.content, expected.content)
@@ -1,62 +1,187 @@
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from django.db.models import Count, Exists, Max, OuterRef, Prefetch
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 from rest_framework import viewsets, mixins, status
-from rest_framework.authentication import TokenAuthentication
 from rest_framework.permissions import IsAuthenticated
 
+from core import images, search, uploads
+from core.authentication import CachedTokenAuthentication
+from core.bulk import bulk_create_recipes, bulk_get_or_create_named
 from core.models import Tag, Ingredient, Recipe
+from core.timing import TimedSerializerMixin
 from recipe import serializers
+from recipe.conditional import ConditionalListMixin, ConditionalRetrieveMixin
+from recipe.export import CSVRenderer, NDJSONRenderer, export_rows
+from recipe.lean import LeanListMixin, recipe_rows
+from recipe.pagination import RecipePagination, RecipeAttrPagination
 
 
-class BaseRecipeAttrViewSet(viewsets.GenericViewSet,
+class BaseRecipeAttrViewSet(TimedSerializerMixin,
+                            ConditionalListMixin,
+                            LeanListMixin,
+                            viewsets.GenericViewSet,
                             mixins.ListModelMixin,
                             mixins.CreateModelMixin):
     '''base to be extended to tags and recipe viewsets'''
-    authentication_classes = (TokenAuthentication,)
+    authentication_classes = (CachedTokenAuthentication,)
     permission_classes = (IsAuthenticated,)
+    pagination_class = RecipeAttrPagination
+
+    def _assigned_only(self):
+        return bool(int(self.request.query_params.get('assigned_only', 0)))
 
     def get_queryset(self):
         '''return objects for logged in user only'''
-        assigned_only = bool(
-            int(self.request.query_params.get('assigned_only', 0))
-        )
         queryset = self.queryset
-        if assigned_only:
-            queryset = queryset.filter(recipe__isnull=False)
+        if self._assigned_only():
+            queryset = queryset.annotate(
+                assigned=Exists(self.recipe_links)
+            ).filter(assigned=True)
 
         return queryset.filter(
             user=self.request.user
-        ).order_by('-name').distinct()
+        ).order_by('-name')
+
+    def get_serializer_class(self):
+        '''return appropriate'''
+        if self.action == 'bulk_get_or_create':
+            return serializers.NameListSerializer
+
+        return self.serializer_class
+
+    def get_list_versions(self):
+        '''include the recipes, whose links decide what is assigned'''
+        versions = super().get_list_versions()
+        if self._assigned_only():
+            recipes = Recipe.objects.filter(user=self.request.user).aggregate(
+                count=Count('id'), updated_at=Max('updated_at')
+            )
+            versions.append((recipes['count'], recipes['updated_at']))
+
+        return versions
 
     def perform_create(self, serializer):
         '''create a new object'''
         serializer.save(user=self.request.user)
 
+    @action(methods=['POST'], detail=False, url_path='bulk')
+    def bulk_get_or_create(self, request):
+        '''resolve a batch of names to ids, creating the missing ones'''
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids, created = bulk_get_or_create_named(
+            self.queryset.model,
+            request.user,
+            serializer.validated_data['names']
+        )
+
+        return Response(
+            {'ids': ids, 'created': created},
+            status=status.HTTP_201_CREATED if created else status.HTTP_200_OK
+        )
+
 
 class TagViewSet(BaseRecipeAttrViewSet):
     '''manage tags in the db'''
     queryset = Tag.objects.all()
+    recipe_links = Recipe.tags.through.objects.filter(tag=OuterRef('pk'))
     serializer_class = serializers.TagSerializer
 
 
 class IngredientViewSet(BaseRecipeAttrViewSet):
     '''manage ingredients in the db'''
     queryset = Ingredient.objects.all()
+    recipe_links = Recipe.ingredients.through.objects.filter(
+        ingredient=OuterRef('pk')
+    )
     serializer_class = serializers.IngredientSerializer
 
 
-class RecipeViewSet(viewsets.ModelViewSet):
+class RecipeViewSet(TimedSerializerMixin,
+                    ConditionalListMixin,
+                    ConditionalRetrieveMixin,
+                    LeanListMixin,
+                    viewsets.ModelViewSet):
     '''manage recipes in the db'''
-    queryset = Recipe.objects.all()
+    queryset = Recipe.objects.defer('search_vector')
     serializer_class = serializers.RecipeSerializer
 
-    authentication_classes = (TokenAuthentication,)
+    authentication_classes = (CachedTokenAuthentication,)
     permission_classes = (IsAuthenticated,)
+    pagination_class = RecipePagination
+
+    def initialize_request(self, request, *args, **kwargs):
+        '''stream image uploads to disk under a size cap'''
+        request = super().initialize_request(request, *args, **kwargs)
+        if self.action == 'upload_image':
+            request._request.upload_handlers = [
+                uploads.LimitedUploadHandler(request._request)
+            ]
+
+        return request
 
     def _params_to_ints(self, qs):
         '''convert string ids to ints'''
         return [int(str_id) for str_id in qs.split(',')]
 
+    def _requested_fields(self):
+        '''return the field names asked for with ?fields=
+
+        None means every field, as does any action but list and retrieve.
+        '''
+        if hasattr(self, '_fields'):
+            return self._fields
+        self._fields = None
+        param = self.request.query_params.get('fields')
+        if param and self.action in ('list', 'retrieve'):
+            fields = {name.strip() for name in param.split(',')} - {''}
+            unknown = fields - set(self.get_serializer_class().Meta.fields)
+            if unknown:
+                raise ValidationError({'fields': [
+                    f'Unknown field "{name}".' for name in sorted(unknown)
+                ]})
+            self._fields = fields
+
+        return self._fields
+
+    def _prefetch_related(self, queryset):
+        '''prefetch only the relations the action's serializer renders'''
+        if self.action == 'upload_image':
+            return queryset
+        if self.action == 'retrieve':
+            tag_fields = ('id', 'name')
+        else:
+            tag_fields = ('id',)
+        fields = self._requested_fields()
+        # in id order, which recipe.lean reproduces from the link tables
+        lookups = {
+            'tags': Prefetch(
+                'tags', queryset=Tag.objects.only(*tag_fields).order_by('id')
+            ),
+            'ingredients': Prefetch(
+                'ingredients',
+                queryset=Ingredient.objects.only(*tag_fields).order_by('id')
+            ),
+            'renditions': 'renditions',
+        }
+
+        return queryset.prefetch_related(*(
+            lookup for name, lookup in lookups.items()
+            if fields is None or name in fields
+        ))
+
+    def _only_requested(self, queryset):
+        '''load just the columns of the requested fields'''
+        fields = self._requested_fields()
+        if fields is None:
+            return queryset
+        columns = {'id'} | (fields - {'tags', 'ingredients', 'renditions'})
+
+        return queryset.only(*sorted(columns))
+
     def get_queryset(self):
         '''return objects for logged in user only'''
         tags = self.request.query_params.get('tags')
@@ -64,12 +189,41 @@ class RecipeViewSet(viewsets.ModelViewSet):
         queryset = self.queryset
         if tags:
             tag_ids = self._params_to_ints(tags)
-            queryset = queryset.filter(tags__id__in=tag_ids)
+            tagged = Recipe.tags.through.objects.filter(tag_id__in=tag_ids)
+            queryset = queryset.filter(id__in=tagged.values('recipe_id'))
         if ingredients:
             ingredient_ids = self._params_to_ints(ingredients)
-            queryset = queryset.filter(ingredients__id__in=ingredient_ids)
+            using = Recipe.ingredients.through.objects.filter(
+                ingredient_id__in=ingredient_ids
+            )
+            queryset = queryset.filter(id__in=using.values('recipe_id'))
+
+        queryset = queryset.filter(user=self.request.user).order_by('-id')
+        text = self.request.query_params.get('q', '').strip()
+        if text:
+            queryset = search.search_recipes(queryset, text)
+
+        return self._prefetch_related(self._only_requested(queryset))
+
+    def get_lean_columns(self, queryset):
+        '''the requested recipe columns, and the cursor's ordering columns'''
+        fields = self._requested_fields()
+        columns = [
+            name for name in ('id', 'title', 'time_minutes', 'price', 'link')
+            if fields is None or name in fields or name == 'id'
+        ]
+        if 'rank' in queryset.query.annotations:
+            columns.append('rank')
 
-        return queryset.filter(user=self.request.user)
+        return columns
+
+    def get_lean_rows(self, rows):
+        return recipe_rows(rows, self.request, self._requested_fields())
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['fields'] = self._requested_fields()
+        return context
 
     def get_serializer_class(self):
         '''return appropriate'''
@@ -77,12 +231,19 @@ class RecipeViewSet(viewsets.ModelViewSet):
             return serializers.RecipeDetailSerializer
         elif self.action == 'upload_image':
             return serializers.RecipeImageSerializer
+        elif self.action == 'bulk_create':
+            return serializers.RecipeBulkItemSerializer
 
         return self.serializer_class
 
     def perform_create(self, serializer):
         '''create a new recipe object'''
-        serializer.save(user=self.request.user)
+        with search.deferred_indexing():
+            serializer.save(user=self.request.user)
+
+    def perform_update(self, serializer):
+        with search.deferred_indexing():
+            serializer.save()
 
     @action(methods=['POST'], detail=True, url_path='upload-image')
     def upload_image(self, request, pk=None):
@@ -94,7 +255,13 @@ class RecipeViewSet(viewsets.ModelViewSet):
         )
 
         if serializer.is_valid():
+            recipe.renditions.all().delete()
             serializer.save()
+            # a downscaled copy is not one of the request's files, so it
+            # is not closed with them
+            if serializer.validated_data.get('image'):
+                serializer.validated_data['image'].close()
+            images.queue_renditions(recipe.id)
             return Response(
                 serializer.data,
                 status=status.HTTP_200_OK
@@ -103,3 +270,86 @@ class RecipeViewSet(viewsets.ModelViewSet):
                 serializer.errors,
                 status=status.HTTP_400_BAD_REQUEST
             )
+
+    @action(methods=['GET'], detail=False,
+            renderer_classes=(NDJSONRenderer, CSVRenderer))
+    def export(self, request):
+        '''stream every recipe of the user as ?format=ndjson or csv'''
+        renderer = request.accepted_renderer
+        response = StreamingHttpResponse(
+            renderer.render_rows(export_rows(request.user)),
+            content_type=f'{renderer.media_type}; charset={renderer.charset}'
+        )
+        response['Content-Disposition'] = \
+            f'attachment; filename="recipes.{renderer.format}"'
+
+        return response
+
+    def _owned_ids(self, model, ids):
+        '''return which of ids belong to the logged in user'''
+        return set(model.objects.filter(
+            user=self.request.user, id__in=ids
+        ).values_list('id', flat=True))
+
+    @action(methods=['POST'], detail=False, url_path='bulk')
+    def bulk_create(self, request):
+        '''create a batch of recipes with bulk inserts'''
+        items = request.data
+        if not isinstance(items, list) or not items:
+            return Response(
+                {'detail': 'Expected a non-empty list of recipes.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if len(items) > settings.RECIPE_BULK_MAX_ITEMS:
+            return Response(
+                {'detail': f'At most {settings.RECIPE_BULK_MAX_ITEMS} '
+                           'recipes can be created at once.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        batch = [self.get_serializer(data=item) for item in items]
+        valid = [serializer.is_valid() for serializer in batch]
+        tag_ids = set()
+        ingredient_ids = set()
+        for serializer, ok in zip(batch, valid):
+            if ok:
+                tag_ids.update(serializer.validated_data.get('tags', []))
+                ingredient_ids.update(
+                    serializer.validated_data.get('ingredients', [])
+                )
+        owned = {
+            'tags': self._owned_ids(Tag, tag_ids),
+            'ingredients': self._owned_ids(Ingredient, ingredient_ids),
+        }
+
+        results = []
+        accepted = []
+        for serializer, ok in zip(batch, valid):
+            errors = {} if ok else dict(serializer.errors)
+            for field, ids in owned.items() if ok else ():
+                requested = serializer.validated_data.get(field, [])
+                missing = [pk for pk in requested if pk not in ids]
+                if missing:
+                    errors[field] = [
+                        f'Invalid pk "{pk}" - object does not exist.'
+                        for pk in missing
+                    ]
+            if errors:
+                results.append({'errors': errors})
+            else:
+                results.append(serializer.data)
+                accepted.append((len(results) - 1, serializer))
+
+        recipes = bulk_create_recipes(
+            request.user, [s.validated_data for _, s in accepted]
+        )
+        for (index, _), recipe in zip(accepted, recipes):
+            results[index] = dict(id=recipe.id, **results[index])
+
+        if not accepted:
+            response_status = status.HTTP_400_BAD_REQUEST
+        elif len(accepted) < len(batch):
+            response_status = status.HTTP_207_MULTI_STATUS
+        else:
+            response_status = status.HTTP_201_CREATED
+        return Response(results, status=response_status)
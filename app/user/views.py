@@ -1,10 +1,13 @@
-from rest_framework import generics, authentication, permissions
+from django.contrib.auth import get_user_model
+from rest_framework import generics, permissions
 from rest_framework.authtoken.views import ObtainAuthToken
 from rest_framework.settings import api_settings
+from core.authentication import CachedTokenAuthentication
+from core.timing import TimedSerializerMixin
 from user.serializers import UserSerializer, AuthTokenSerializer
 
 
-class CreateUserView(generics.CreateAPIView):
+class CreateUserView(TimedSerializerMixin, generics.CreateAPIView):
     ''''''
     serializer_class = UserSerializer
 
@@ -15,12 +18,16 @@ class CreateTokenView(ObtainAuthToken):
     renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES
 
 
-class ManageUserView(generics.RetrieveUpdateAPIView):
+class ManageUserView(TimedSerializerMixin,
+                     generics.RetrieveUpdateAPIView):
     '''manage authentication'''
     serializer_class = UserSerializer
-    authentication_classes = (authentication.TokenAuthentication,)
+    authentication_classes = (CachedTokenAuthentication,)
     permission_classes = (permissions.IsAuthenticated,)
 
     def get_object(self):
-        ''''''
-        return self.request.user
+        '''the current user, read afresh from the database for updates'''
+        if self.request.method in permissions.SAFE_METHODS:
+            return self.request.user
+
+        return get_user_model().objects.get(pk=self.request.user.pk)